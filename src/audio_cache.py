@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+import os
+import os.path as osp
+import hashlib
+import struct
+import time
+from collections import OrderedDict
+import numpy as np
+import soundfile as sf
+
+
+def _wav_data_chunk(wav_file):
+    """ Get the position of the samples in a wav file (data chunk)
+    Args:
+        wav_file: str, path of the wav file.
+
+    Returns:
+        tuple, (offset in bytes of the first sample, size in bytes of the samples)
+    """
+    with open(wav_file, 'rb') as f:
+        f.seek(12)  # RIFF header
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"No data chunk in {wav_file}")
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'data':
+                return f.tell(), chunk_size
+            f.seek(chunk_size + chunk_size % 2, 1)
+
+
+class AudioCache:
+    """ Cache of the decoded soundbank files, stored once as float32 wav files at the sample rate of the soundscapes.
+
+    The cached files mirror the soundbank (cache_dir/<sr>/<soundbank id>/<label>/<filename>), so scaper can use
+    the mirror as foreground or background folder, and their samples can be memory-mapped (see load).
+    The soundbank files are expected to be wav files (as the DESED soundbanks), the name of the files is kept.
+    The cache is only made of files, the processes using the same cache_dir share it without copying anything.
+    Each process counts the size of the files it adds to the cache, the cache is only listed when this count
+    reaches max_size: the least recently used files are then deleted until the cache is below
+    max_size * (1 - margin), so the next listing only happens after margin * max_size bytes are added.
+    The files used in the last min_age seconds are never deleted, a render (of this or another process) may be
+    about to read them, so the cache can temporarily be larger than max_size.
+
+    Args:
+        cache_dir: str, folder of the cache.
+        max_size: float, optional, maximum size of the cache in bytes (no limit if None).
+        max_memory: float, optional, maximum size in bytes of the samples kept in memory by load in each process
+            (only memory-mapped if None).
+        margin: float, fraction of max_size freed by an eviction (see evict).
+        min_age: float, the files used in the last min_age seconds are not deleted.
+
+    Example:
+        cache = AudioCache("cache", max_size=10e9)
+        cached_file = cache.get_file("soundbank/foreground/Dog/1.wav", 44100)
+        audio = cache.load("soundbank/foreground/Dog/1.wav", 44100)
+    """
+    def __init__(self, cache_dir, max_size=None, max_memory=None, margin=0.1, min_age=60):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_memory = max_memory
+        self.margin = margin
+        self.min_age = min_age
+        # Size of the cache when it was last listed, plus the size of the files added since by this process
+        self._size = None
+        # Arrays loaded in this process, {(cached file, mtime): np.array}, least recently used first
+        self._memory = OrderedDict()
+
+    def __getstate__(self):
+        # The arrays loaded are not sent to the other processes
+        state = self.__dict__.copy()
+        state['_memory'] = OrderedDict()
+        return state
+
+    def get_folder(self, folder, sr, pitch_shift=None):
+        """ Get the mirror of a soundbank folder in the cache
+        Args:
+            folder: str, path of the soundbank (containing a subfolder per label).
+            sr: int, sample rate of the cached files.
+            pitch_shift: float, optional, pitch shift (semitones) applied to the cached files.
+
+        Returns:
+            str, path of the mirror folder.
+        """
+        folder_id = hashlib.md5(osp.abspath(folder).encode()).hexdigest()[:16]
+        if pitch_shift:
+            folder_id += f"_pitch{pitch_shift:+g}"
+        return osp.join(self.cache_dir, str(sr), folder_id)
+
+    def get_cached_path(self, filename, sr, pitch_shift=None):
+        """ Get the path of the cached version of a soundbank file (the file may not be cached yet) """
+        class_path, name = osp.split(osp.normpath(filename))
+        return osp.join(self.get_folder(osp.dirname(class_path), sr, pitch_shift), osp.basename(class_path), name)
+
+    def get_file(self, filename, sr, pitch_shift=None):
+        """ Get the cached version of a soundbank file, decode and resample it if it is not cached or modified since.
+        Args:
+            filename: str, path of the soundbank file.
+            sr: int, sample rate of the cached file.
+            pitch_shift: float, optional, pitch shift (semitones) applied to the whole file with sox (as scaper does
+                on the events). Use it with quantized pitch shifts (see utils.quantize_pitch), so a file is only
+                shifted once for each value of the grid.
+
+        Returns:
+            str, path of the cached file (float32 wav).
+        """
+        cached_file = self.get_cached_path(filename, sr, pitch_shift)
+        source_mtime = os.stat(filename).st_mtime_ns
+        # The mtime of a cached file is the last time it has been used (set explicitly, the atime is not updated on
+        # relatime/noatime mounts), it is valid while its source has not been modified since
+        last_used = max(time.time_ns(), source_mtime)
+        if osp.exists(cached_file) and os.stat(cached_file).st_mtime_ns >= source_mtime:
+            os.utime(cached_file, ns=(last_used, last_used))
+            return cached_file
+
+        if pitch_shift:
+            import sox
+            audio, _ = sf.read(self.get_file(filename, sr), dtype='float32')
+            tfm = sox.Transformer()
+            tfm.pitch(pitch_shift)
+            audio = tfm.build_array(input_array=audio, sample_rate_in=sr)
+        else:
+            audio, file_sr = sf.read(filename, dtype='float32')
+            if file_sr != sr:
+                from scipy.signal import resample_poly
+                gcd = np.gcd(file_sr, sr)
+                audio = resample_poly(audio, sr // gcd, file_sr // gcd, axis=0).astype(np.float32)
+        os.makedirs(osp.dirname(cached_file), exist_ok=True)
+        # Written under another name then renamed, other processes never read a partial file
+        tmp_file = f"{cached_file}.{os.getpid()}.tmp"
+        sf.write(tmp_file, audio, sr, subtype='FLOAT', format='WAV')
+        os.utime(tmp_file, ns=(last_used, last_used))
+        os.replace(tmp_file, cached_file)
+        if self.max_size is not None:
+            # Only listed once, then when the files added reach max_size
+            self._size = self.size() if self._size is None else self._size + os.stat(cached_file).st_size
+            if self._size > self.max_size:
+                self.evict()
+        return cached_file
+
+    def load(self, filename, sr, pitch_shift=None):
+        """ Get the samples of a soundbank file, memory-mapped from the cache (read-only).
+        If max_memory is given, the samples of the most recently used files are also kept in memory.
+
+        Args:
+            filename: str, path of the soundbank file.
+            sr: int, sample rate of the samples.
+            pitch_shift: float, optional, pitch shift (semitones) applied to the file (see get_file).
+
+        Returns:
+            np.array (np.memmap if not kept in memory), the samples, shape (n_samples,) or (n_samples, n_channels).
+        """
+        cached_file = self.get_file(filename, sr, pitch_shift)
+        key = (cached_file, os.stat(filename).st_mtime_ns)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        channels = sf.info(cached_file).channels
+        offset, size = _wav_data_chunk(cached_file)
+        n_samples = size // (4 * channels)
+        shape = (n_samples,) if channels == 1 else (n_samples, channels)
+        audio = np.memmap(cached_file, dtype='<f4', mode='r', offset=offset, shape=shape)
+        if self.max_memory is not None:
+            audio = np.array(audio)
+            audio.flags.writeable = False
+            self._memory[key] = audio
+            memory = sum(array.nbytes for array in self._memory.values())
+            while memory > self.max_memory and len(self._memory) > 1:
+                memory -= self._memory.popitem(last=False)[1].nbytes
+        return audio
+
+    def size(self):
+        """ Get the total size of the cached files in bytes """
+        return sum(size for _, _, size in self._list_files())
+
+    def _list_files(self):
+        """ List the cached files, (path, last use (mtime), size) """
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".tmp"):
+                    try:
+                        stat = os.stat(osp.join(root, name))
+                    except FileNotFoundError:
+                        # Deleted by another process
+                        continue
+                    files.append((osp.join(root, name), stat.st_mtime_ns, stat.st_size))
+        return files
+
+    def evict(self):
+        """ Delete the least recently used files until the cache is smaller than max_size * (1 - margin), except the
+        files used in the last min_age seconds
+        Returns:
+            int, the number of files deleted.
+        """
+        files = sorted(self._list_files(), key=lambda x: x[1])
+        total_size = sum(size for _, _, size in files)
+        target_size = self.max_size * (1 - self.margin)
+        recent = time.time_ns() - int(self.min_age * 1e9)
+        n_deleted = 0
+        for path, last_used, size in files:
+            # The files are sorted by last use, the next ones are more recent
+            if total_size <= target_size or last_used >= recent:
+                break
+            try:
+                # A process still reading the file keeps it until it closes it
+                os.remove(path)
+            except FileNotFoundError:
+                # Already deleted by another process
+                pass
+            total_size -= size
+            n_deleted += 1
+        self._size = total_size
+        return n_deleted
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+""" Degradations of the soundscapes, in python, replacing the Audio Degradation Toolbox (generate_eval_distortions.m).
+The degradations and their default parameters are the ones of the toolbox, the impulse responses of the smartphones
+(recorded in the toolbox) are approximated by band-pass filters.
+Each degradation takes a signal (np.array, shape (n_samples,)), its sample rate and a random state, and returns the
+degraded signal and the delay (in seconds) it introduces, to shift the annotations.
+"""
+import numpy as np
+
+from reverb import apply_reverb_batch
+
+# Bandwidth (Hz) of the band-pass approximating the impulse responses of the smartphones of the toolbox
+SMARTPHONE_BANDS = {"speaker": (500., 8000.), "microphone": (100., 8000.)}
+
+
+def _normalize(audio, peak=0.999):
+    """ Normalize the maximum absolute value of a signal (normalizeOutputAudio of the toolbox) """
+    max_value = np.max(np.abs(audio))
+    return audio * peak / max_value if max_value > 0 else audio
+
+
+def clipping(audio, percent_samples=1.):
+    """ Clip a signal by over-normalizing it, so a percentage of its samples are clipped (unit_applyClippingAlternative)
+    Args:
+        audio: np.array, the signal.
+        percent_samples: float, percentage of the samples to clip.
+
+    Returns:
+        np.array, the signal clipped
+    """
+    threshold = np.percentile(np.abs(audio), 100 - percent_samples)
+    if threshold == 0:
+        return audio
+    return np.clip(audio / threshold, -1, 1)
+
+
+def dynamic_range_compression(audio, sr, threshold=-40., slope=0.9, forgetting_time=0.1, smoothing_time=0.01,
+                              normalize=True):
+    """ Compress the dynamic range of a signal (unit_applyDynamicRangeCompression).
+    The level is the RMS of the signal with a forgetting factor, the gain reduces the level above the threshold,
+    and is smoothed (the attack and release times of the toolbox are equal by default).
+
+    Args:
+        audio: np.array, the signal.
+        sr: int, sample rate of the signal.
+        threshold: float, level (dB) above which the signal is compressed.
+        slope: float, compression slope, between 0 (no compression) and 1 (limiter).
+        forgetting_time: float, time constant (s) of the RMS level.
+        smoothing_time: float, time constant (s) of the gain.
+        normalize: bool, whether to normalize the output.
+
+    Returns:
+        np.array, the signal compressed
+    """
+    from scipy.signal import lfilter
+    alpha = np.exp(-1. / (forgetting_time * sr))
+    power = lfilter([1 - alpha], [1, -alpha], audio ** 2)
+    level = 10 * np.log10(np.maximum(power, 1e-20))
+    gain_db = -slope * np.maximum(level - threshold, 0)
+    beta = np.exp(-1. / (smoothing_time * sr))
+    gain_db = lfilter([1 - beta], [1, -beta], gain_db)
+    audio = audio * 10 ** (gain_db / 20.)
+    return _normalize(audio) if normalize else audio
+
+
+def highpass(audio, sr, cutoff=200., order=4):
+    """ High-pass filter a signal without delay (zero-phase Butterworth filter, unit_applyHighpassFilter)
+    Args:
+        audio: np.array, the signal.
+        sr: int, sample rate of the signal.
+        cutoff: float, cutoff frequency (Hz).
+        order: int, order of the filter.
+
+    Returns:
+        np.array, the signal filtered
+    """
+    from scipy.signal import butter, sosfiltfilt
+    return sosfiltfilt(butter(order, cutoff, btype='highpass', fs=sr, output='sos'), audio)
+
+
+def lowpass(audio, sr, cutoff=1000., order=4):
+    """ Low-pass filter a signal without delay (zero-phase Butterworth filter, unit_applyLowpassFilter)
+    Args:
+        audio: np.array, the signal.
+        sr: int, sample rate of the signal.
+        cutoff: float, cutoff frequency (Hz).
+        order: int, order of the filter.
+
+    Returns:
+        np.array, the signal filtered
+    """
+    from scipy.signal import butter, sosfiltfilt
+    return sosfiltfilt(butter(order, cutoff, btype='lowpass', fs=sr, output='sos'), audio)
+
+
+def add_noise(audio, snr, random_state, color='pink'):
+    """ Add noise to a signal (unit_addNoise)
+    Args:
+        audio: np.array, the signal.
+        snr: float, ratio (dB) between the power of the signal and the power of the noise.
+        random_state: np.random.RandomState, the random state to use.
+        color: str, 'white' or 'pink' (-3dB per octave).
+
+    Returns:
+        np.array, the signal with noise
+    """
+    noise = random_state.randn(len(audio))
+    if color == 'pink':
+        spectrum = np.fft.rfft(noise)
+        freqs = np.arange(len(spectrum))
+        spectrum[1:] /= np.sqrt(freqs[1:])
+        spectrum[0] = 0
+        noise = np.fft.irfft(spectrum, len(audio))
+    elif color != 'white':
+        raise ValueError(f"Unknown noise color {color}, choose between 'white' and 'pink'")
+    power_audio, power_noise = np.mean(audio ** 2), np.mean(noise ** 2)
+    if power_audio == 0 or power_noise == 0:
+        return audio
+    return audio + noise * np.sqrt(power_audio / power_noise * 10 ** (-snr / 10.))
+
+
+def smartphone_ir(sr, device, n_taps=255):
+    """ Impulse response approximating the speaker or microphone of a smartphone (linear phase band-pass filter)
+    Args:
+        sr: int, sample rate of the impulse response.
+        device: str, 'speaker' or 'microphone' (see SMARTPHONE_BANDS).
+        n_taps: int, length of the impulse response.
+
+    Returns:
+        np.array, the impulse response
+    """
+    from scipy.signal import firwin
+    low, high = SMARTPHONE_BANDS[device]
+    return firwin(n_taps, [low, min(high, 0.45 * sr)], pass_zero=False, fs=sr)
+
+
+def apply_impulse_response(audio, ir):
+    """ Convolve a signal with an impulse response (unit_applyImpulseResponse), the signal keeps its length.
+    Args:
+        audio: np.array, the signal.
+        ir: np.array, the impulse response.
+
+    Returns:
+        tuple, (np.array the signal, int the delay in samples: position of the peak of the impulse response)
+    """
+    return apply_reverb_batch(audio, ir).astype(audio.dtype), int(np.argmax(np.abs(ir)))
+
+
+def smartphone_playback(audio, sr, random_state):
+    """ Playback on a smartphone speaker (degradation_smartPhonePlayback): speaker impulse response and pink noise
+    (40dB SNR). """
+    audio, delay = apply_impulse_response(audio, smartphone_ir(sr, "speaker"))
+    return _normalize(add_noise(audio, 40, random_state)), delay / sr
+
+
+def smartphone_recording(audio, sr, random_state):
+    """ Recording with a smartphone (degradation_smartPhoneRecording): microphone impulse response, dynamic range
+    compression, clipping of 0.3% of the samples and pink noise (35dB SNR). """
+    audio, delay = apply_impulse_response(audio, smartphone_ir(sr, "microphone"))
+    audio = dynamic_range_compression(audio, sr, threshold=-35, slope=0.5)
+    audio = clipping(audio, 0.3)
+    return _normalize(add_noise(audio, 35, random_state)), delay / sr
+
+
+# Name of the degradations (the same as the toolbox, and the subfolders of the distorted subsets):
+# function(audio, sr, random_state) returning the degraded signal and its delay in seconds
+DEGRADATIONS = {
+    'smartPhonePlayback': smartphone_playback,
+    'smartPhoneRecording': smartphone_recording,
+    'unit_applyClippingAlternative': lambda audio, sr, random_state: (clipping(audio), 0.),
+    'unit_applyDynamicRangeCompression': lambda audio, sr, random_state: (dynamic_range_compression(audio, sr), 0.),
+    'unit_applyHighpassFilter': lambda audio, sr, random_state: (_normalize(highpass(audio, sr)), 0.),
+    'unit_applyLowpassFilter': lambda audio, sr, random_state: (_normalize(lowpass(audio, sr)), 0.),
+}
+
+
+def degrade(audio, sr, name, random_state=None):
+    """ Apply a degradation to a signal
+    Args:
+        audio: np.array, the signal, shape (n_samples,).
+        sr: int, sample rate of the signal.
+        name: str, the name of the degradation (see DEGRADATIONS).
+        random_state: np.random.RandomState, optional, the random state to use (for the noise).
+
+    Returns:
+        tuple, (np.array the degraded signal, float the delay in seconds introduced by the degradation)
+    """
+    if name not in DEGRADATIONS:
+        raise ValueError(f"Unknown degradation {name}, choose between {list(DEGRADATIONS)}")
+    if np.ndim(audio) > 1:
+        # The filters and impulse responses are applied along the last axis, which would be the channels
+        raise ValueError(f"The degradations only apply to mono signals, got a signal of shape {np.shape(audio)}")
+    if random_state is None:
+        random_state = np.random
+    return DEGRADATIONS[name](np.asarray(audio, dtype=np.float64), sr, random_state)
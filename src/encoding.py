@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+""" Compressed audio files (FLAC, Opus) for the soundscapes.
+The soundscapes are generated as wav files, then encoded by a pool of threads (AudioEncoder) while the next
+soundscapes are generated. The files keep the name of the wav file with the extension of their format, the readers
+find them with find_audio_file.
+The same threads can compute the features of the soundscapes (see features.py), the audio is decoded once for both.
+"""
+import os
+import os.path as osp
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+
+from shards import file_exists
+from features import FeatureWriter, get_features_folder
+
+# {name: (format of soundfile, extension, subtype of the soundscapes)}
+AUDIO_FORMATS = {
+    "wav": ("WAV", ".wav", None),
+    "flac": ("FLAC", ".flac", "PCM_16"),
+    "opus": ("OGG", ".opus", "OPUS"),
+}
+AUDIO_EXTENSIONS = [extension for _, extension, _ in AUDIO_FORMATS.values()]
+# Sample rates accepted by the Opus encoder, the soundscapes are resampled to the closest higher one
+OPUS_SAMPLE_RATES = [8000, 12000, 16000, 24000, 48000]
+
+
+def get_audio_format(audio_file):
+    """ Get the name of the format of an audio file from its extension (see AUDIO_FORMATS) """
+    extension = osp.splitext(audio_file)[1].lower()
+    for name, (_, ext, _) in AUDIO_FORMATS.items():
+        if ext == extension:
+            return name
+    raise ValueError(f"Unknown audio extension {extension}, choose between {AUDIO_EXTENSIONS}")
+
+
+def find_audio_file(audio_file):
+    """ Find the audio file of a soundscape whatever its format (flat or sharded folder)
+    Args:
+        audio_file: str, path of the audio file with any audio extension (ex: folder/7.wav).
+
+    Returns:
+        str, the path of the existing file with the same name (ex: folder/7.flac), audio_file if none exists.
+    """
+    if file_exists(audio_file):
+        return audio_file
+    name = osp.splitext(audio_file)[0]
+    for extension in AUDIO_EXTENSIONS:
+        if file_exists(name + extension):
+            return name + extension
+    return audio_file
+
+
+def write_audio(audio_file, audio, sr, subtype="PCM_16"):
+    """ Write an audio file in the format given by its extension (see AUDIO_FORMATS)
+    Args:
+        audio_file: str, path of the file to write.
+        audio: np.array, the signal, shape (n_samples,) or (n_samples, n_channels).
+        sr: int, sample rate of the signal.
+        subtype: str, subtype of the wav files (the compressed formats use their own subtype).
+
+    Returns:
+        None
+    """
+    audio_format, _, format_subtype = AUDIO_FORMATS[get_audio_format(audio_file)]
+    if format_subtype is None:
+        sf.write(audio_file, audio, sr, subtype=subtype)
+        return None
+    if audio_format == "OGG" and sr not in OPUS_SAMPLE_RATES:
+        from scipy.signal import resample_poly
+        new_sr = min([rate for rate in OPUS_SAMPLE_RATES if rate >= sr], default=OPUS_SAMPLE_RATES[-1])
+        gcd = np.gcd(int(new_sr), int(sr))
+        audio = resample_poly(audio, new_sr // gcd, sr // gcd, axis=0)
+        sr = new_sr
+    sf.write(audio_file, audio, sr, format=audio_format, subtype=format_subtype)
+    return None
+
+
+def encode_file(filename, audio_format="flac", remove=True, feature_writer=None):
+    """ Encode the wav file of a soundscape in another format
+    Args:
+        filename: str, path of a file of the soundscape (same name as the wav file, ex: the JAMS file).
+        audio_format: str, the format (see AUDIO_FORMATS).
+        remove: bool, whether to remove the wav file once encoded.
+        feature_writer: features.FeatureWriter, optional, the features of the soundscape are added to it.
+            With this writer, a soundscape already in another format (no wav file) is read for its features.
+
+    Returns:
+        str, the path of the file encoded, None if the soundscape has no wav file (not generated)
+    """
+    wav_file = osp.splitext(filename)[0] + ".wav"
+    out_file = osp.splitext(filename)[0] + AUDIO_FORMATS[audio_format][1]
+    if not osp.exists(wav_file):
+        if feature_writer is not None and osp.exists(out_file):
+            audio, sr = sf.read(out_file, dtype='float32')
+            feature_writer.add(out_file, audio, sr)
+        return None
+    if out_file == wav_file and feature_writer is None:
+        return wav_file
+    audio, sr = sf.read(wav_file, dtype='float32')
+    if feature_writer is not None:
+        feature_writer.add(wav_file, audio, sr)
+    if out_file == wav_file:
+        return wav_file
+    write_audio(out_file, audio, sr)
+    if remove:
+        os.remove(wav_file)
+    return out_file
+
+
+class AudioEncoder:
+    """ Encode the wav files of soundscapes in a pool of threads, while the next soundscapes are generated
+    (soundfile and numpy release the GIL). Nothing is done with the "wav" format if no features are computed.
+
+    Args:
+        audio_format: str, the format (see AUDIO_FORMATS).
+        n_workers: int, number of threads encoding the files.
+        remove: bool, whether to remove the wav files once encoded.
+        feature_params: dict, optional, the parameters of the log-mel features (see features.FEATURE_PARAMS),
+            the features are then written in a store next to each soundscape (see features.get_features_folder).
+        manifest: manifest.RunManifest, optional, the soundscapes are recorded in the manifest of the run once
+            encoded (an interrupted run generates again the soundscapes not encoded).
+    """
+    def __init__(self, audio_format="flac", n_workers=2, remove=True, feature_params=None, manifest=None):
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f"Unknown audio format {audio_format}, choose between {list(AUDIO_FORMATS)}")
+        self.audio_format = audio_format
+        self.remove = remove
+        self.feature_params = feature_params
+        self.manifest = manifest
+        # {folder of the store: FeatureWriter}, the soundscapes can be in multiple folders (see generate_wav.py)
+        self.feature_writers = {}
+        active = audio_format != "wav" or feature_params is not None
+        self.executor = ThreadPoolExecutor(max_workers=n_workers) if active else None
+        self.futures = []
+
+    def get_feature_writer(self, filename):
+        """ Get the writer of the features of the soundscape of filename, None if no features are computed """
+        if self.feature_params is None:
+            return None
+        folder = get_features_folder(filename)
+        if folder not in self.feature_writers:
+            self.feature_writers[folder] = FeatureWriter(folder, self.feature_params)
+        return self.feature_writers[folder]
+
+    def submit(self, filename):
+        """ Encode the wav file of the soundscape of filename and compute its features (see encode_file)
+        in the background """
+        if self.executor is None:
+            if self.manifest is not None:
+                self.manifest.add_soundscape(filename)
+            return
+        future = self.executor.submit(encode_file, filename, self.audio_format, self.remove,
+                                      self.get_feature_writer(filename))
+        if self.manifest is not None:
+            future.add_done_callback(lambda done: self._record(filename, done))
+        self.futures.append(future)
+
+    def _record(self, filename, future):
+        """ Record an encoded soundscape in the manifest (the errors are raised by close) """
+        if future.exception() is None:
+            self.manifest.add_soundscape(filename)
+
+    def close(self):
+        """ Wait for all the files to be encoded, and write the last features
+        Returns:
+            list, the paths of the files encoded
+        """
+        if self.executor is None:
+            return []
+        self.executor.shutdown(wait=True)
+        encoded = [future.result() for future in self.futures]
+        self.futures = []
+        for writer in self.feature_writers.values():
+            writer.close()
+        self.feature_writers = {}
+        return [audio_file for audio_file in encoded if audio_file is not None]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
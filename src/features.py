@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+""" Log-mel features of the soundscapes, computed during the generation (see encoding.AudioEncoder) and written in a
+store next to the soundscapes (folder/features), so the users of the dataset do not decode all the audio files again.
+
+The store is made of chunks of soundscapes memory-mappable with numpy, keyed by the id of the soundscapes (the name
+of their files without extension):
+    - features-000000.npy: float32 array (n_soundscapes of the chunk, n_frames, n_mels), log-mel (dB)
+    - labels-000000.npy: uint8 array (n_soundscapes of the chunk, n_frames, n_classes), frame-level labels
+    - features_index.tsv: id, chunk (number), row
+    - features_params.json: the parameters of the features, their sample rate, the number of frames and the classes
+    of the labels
+"""
+import glob
+import json
+import os
+import os.path as osp
+import threading
+import numpy as np
+import pandas as pd
+
+# Subfolder (next to the soundscapes) in which the features are saved
+FEATURES_FOLDER = "features"
+FEATURES_INDEX = "features_index.tsv"
+FEATURES_PARAMS = "features_params.json"
+FEATURES_PATTERN = "features-{:06d}.npy"
+LABELS_PATTERN = "labels-{:06d}.npy"
+# Default parameters of the log-mel, sr None keeps the sample rate of the soundscapes, fmax None is sr / 2
+FEATURE_PARAMS = {"sr": None, "n_fft": 2048, "hop_length": 511, "n_mels": 64, "fmin": 0., "fmax": None}
+
+
+def read_feature_params(json_file=None):
+    """ Read the parameters of the features in a json file (the ones missing are the default FEATURE_PARAMS) """
+    params = dict(FEATURE_PARAMS)
+    if json_file is not None:
+        with open(json_file) as f:
+            params.update(json.load(f))
+    return params
+
+
+def get_features_folder(audio_file):
+    """ Get the folder of the features of a soundscape: a features subfolder in the folder of the soundscape """
+    return osp.join(osp.dirname(audio_file), FEATURES_FOLDER)
+
+
+def get_soundscape_id(filename):
+    """ Get the id of a soundscape from the path of one of its files (name without extension) """
+    return osp.splitext(osp.basename(filename))[0]
+
+
+def hz_to_mel(freqs):
+    """ Convert frequencies (Hz) to the mel scale (HTK formula) """
+    return 2595. * np.log10(1. + np.asarray(freqs) / 700.)
+
+
+def mel_to_hz(mels):
+    """ Convert mels to frequencies (Hz) (HTK formula) """
+    return 700. * (10 ** (np.asarray(mels) / 2595.) - 1.)
+
+
+def mel_filterbank(sr, n_fft, n_mels=64, fmin=0., fmax=None):
+    """ Triangular mel filters, each filter has a unit area (the level does not depend on the number of filters)
+    Args:
+        sr: int, sample rate of the signal.
+        n_fft: int, size of the FFT.
+        n_mels: int, number of mel bands.
+        fmin: float, lowest frequency (Hz).
+        fmax: float, optional, highest frequency (Hz), sr / 2 by default.
+
+    Returns:
+        np.array, the filters, shape (n_mels, n_fft // 2 + 1)
+    """
+    if fmax is None:
+        fmax = sr / 2.
+    fft_freqs = np.linspace(0, sr / 2., n_fft // 2 + 1)
+    mel_freqs = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+    lower, center, upper = mel_freqs[:-2, None], mel_freqs[1:-1, None], mel_freqs[2:, None]
+    filters = np.maximum(0, np.minimum((fft_freqs - lower) / (center - lower), (upper - fft_freqs) / (upper - center)))
+    return (filters * (2. / (upper - lower))).astype(np.float32)
+
+
+def power_spectrogram(audio, n_fft=2048, hop_length=511):
+    """ Power spectrogram of signals (centered frames, periodic Hann window), all the frames at once
+    Args:
+        audio: np.array, the signals, shape (..., n_samples).
+        n_fft: int, size of the frames and of the FFT.
+        hop_length: int, number of samples between two frames.
+
+    Returns:
+        np.array, the power spectrogram, shape (..., n_frames, n_fft // 2 + 1), n_frames = 1 + n_samples // hop_length
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    pad = [(0, 0)] * (audio.ndim - 1) + [(n_fft // 2, n_fft // 2)]
+    audio = np.pad(audio, pad, mode='reflect' if audio.shape[-1] > n_fft // 2 else 'constant')
+    frames = np.lib.stride_tricks.sliding_window_view(audio, n_fft, axis=-1)[..., ::hop_length, :]
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+    spectrum = np.fft.rfft(frames * window, axis=-1)
+    return (spectrum.real ** 2 + spectrum.imag ** 2).astype(np.float32)
+
+
+def log_mel(audio, sr, params=None):
+    """ Log-mel features (dB) of signals
+    Args:
+        audio: np.array, the signals, shape (..., n_samples).
+        sr: int, sample rate of the signals.
+        params: dict, optional, the parameters of the features (see FEATURE_PARAMS), resampled if params["sr"]
+            is not the sample rate of the signals.
+
+    Returns:
+        np.array, the features, shape (..., n_frames, n_mels)
+    """
+    params = dict(FEATURE_PARAMS, **(params or {}))
+    if params["sr"] is not None and params["sr"] != sr:
+        from scipy.signal import resample_poly
+        gcd = np.gcd(int(params["sr"]), int(sr))
+        audio = resample_poly(audio, params["sr"] // gcd, sr // gcd, axis=-1)
+        sr = params["sr"]
+    power = power_spectrogram(audio, params["n_fft"], params["hop_length"])
+    mel = power @ mel_filterbank(sr, params["n_fft"], params["n_mels"], params["fmin"], params["fmax"]).T
+    return 10 * np.log10(np.maximum(mel, 1e-10))
+
+
+def frame_times(n_frames, sr, hop_length):
+    """ Time (s) of the center of the frames of the features """
+    return np.arange(n_frames) * hop_length / float(sr)
+
+
+def label_matrix(df, classes, times):
+    """ Frame-level labels of a soundscape: a frame is labelled with the events active at its center
+    Args:
+        df: pd.DataFrame, the annotations of the soundscape (onset, offset, event_label).
+        classes: list, the classes (columns of the matrix).
+        times: np.array, the times of the frames (see frame_times).
+
+    Returns:
+        np.array, the labels, shape (n_frames, n_classes), uint8
+    """
+    labels = np.zeros((len(times), len(classes)), dtype=np.uint8)
+    class_index = {label: cnt for cnt, label in enumerate(classes)}
+    starts = np.searchsorted(times, df["onset"].values, side="left")
+    stops = np.searchsorted(times, df["offset"].values, side="left")
+    for start, stop, label in zip(starts, stops, df["event_label"].values):
+        if label in class_index:
+            labels[start:stop, class_index[label]] = 1
+    return labels
+
+
+class FeatureWriter:
+    """ Write the features of soundscapes in a store (see the module), the chunks are written when they are full.
+    The soundscapes are written by multiple threads (see encoding.AudioEncoder), a soundscape written again replaces
+    the previous one in the index. If the store already exists, the new soundscapes are appended in new chunks.
+
+    Args:
+        folder: str, folder of the store.
+        params: dict, optional, the parameters of the features (see FEATURE_PARAMS).
+        chunk_size: int, number of soundscapes per chunk.
+    """
+    def __init__(self, folder, params=None, chunk_size=256):
+        self.folder = folder
+        self.params = dict(FEATURE_PARAMS, **(params or {}))
+        self.chunk_size = chunk_size
+        os.makedirs(folder, exist_ok=True)
+        self.n_chunk = len(glob.glob(osp.join(folder, FEATURES_PATTERN.replace("{:06d}", "*"))))
+        self.sr, self.n_frames = None, None
+        params_file = osp.join(folder, FEATURES_PARAMS)
+        if osp.exists(params_file):
+            with open(params_file) as f:
+                meta = json.load(f)
+            self.sr, self.n_frames = meta["sr"], meta["n_frames"]
+        self.ids, self.features = [], []
+        self.lock = threading.Lock()
+
+    def add(self, audio_file, audio, sr):
+        """ Compute the features of a soundscape and add them to the store
+        Args:
+            audio_file: str, path of a file of the soundscape (its name is the id of the soundscape).
+            audio: np.array, the signal, shape (n_samples,) or (n_samples, n_channels) (channels averaged).
+            sr: int, sample rate of the signal.
+
+        Returns:
+            np.array, the features, shape (n_frames, n_mels)
+        """
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        features = log_mel(audio, sr, self.params).astype(np.float32)
+        with self.lock:
+            if self.n_frames is None:
+                self.sr = self.params["sr"] if self.params["sr"] is not None else sr
+                self.n_frames = features.shape[0]
+            # All the soundscapes of a store have the same duration, the rounding of the resampling is ignored
+            features = np.pad(features[:self.n_frames], [(0, max(0, self.n_frames - features.shape[0])), (0, 0)],
+                              mode='edge')
+            self.ids.append(get_soundscape_id(audio_file))
+            self.features.append(features)
+            if len(self.ids) >= self.chunk_size:
+                self._write_chunk()
+        return features
+
+    def _write_chunk(self):
+        if len(self.ids) == 0:
+            return
+        np.save(osp.join(self.folder, FEATURES_PATTERN.format(self.n_chunk)), np.stack(self.features))
+        df = pd.DataFrame({"id": self.ids, "chunk": self.n_chunk, "row": np.arange(len(self.ids))})
+        index_file = osp.join(self.folder, FEATURES_INDEX)
+        if osp.exists(index_file):
+            df = pd.concat([pd.read_csv(index_file, sep="\t", dtype={"id": str}), df])
+        df.to_csv(index_file + ".tmp", sep="\t", index=False)
+        os.replace(index_file + ".tmp", index_file)
+        with open(osp.join(self.folder, FEATURES_PARAMS), "w") as f:
+            json.dump({"params": self.params, "sr": self.sr, "n_frames": self.n_frames, "classes": None}, f, indent=2)
+        self.n_chunk += 1
+        self.ids, self.features = [], []
+
+    def close(self):
+        with self.lock:
+            self._write_chunk()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FeatureReader:
+    """ Read the features and labels of a store (memory-mapped)
+    Args:
+        folder: str, folder of the store.
+
+    Example:
+        reader = FeatureReader("../training/soundscapes_generated/features")
+        features, labels = reader.load("7"), reader.labels("7")
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        with open(osp.join(folder, FEATURES_PARAMS)) as f:
+            meta = json.load(f)
+        self.params, self.sr = meta["params"], meta["sr"]
+        self.n_frames, self.classes = meta["n_frames"], meta["classes"]
+        df = pd.read_csv(osp.join(folder, FEATURES_INDEX), sep="\t", dtype={"id": str})
+        self.index = df.drop_duplicates("id", keep="last").set_index("id")
+        self._arrays = {}
+
+    def ids(self):
+        """ Get the ids of the soundscapes of the store """
+        return list(self.index.index)
+
+    def load_chunk(self, pattern, chunk):
+        """ Get a chunk of the store, memory-mapped (pattern: FEATURES_PATTERN or LABELS_PATTERN) """
+        filename = pattern.format(chunk)
+        if filename not in self._arrays:
+            self._arrays[filename] = np.load(osp.join(self.folder, filename), mmap_mode='r')
+        return self._arrays[filename]
+
+    def load(self, soundscape_id):
+        """ Get the features of a soundscape, np.array (n_frames, n_mels) memory-mapped """
+        chunk, row = self.index.loc[soundscape_id, ["chunk", "row"]]
+        return self.load_chunk(FEATURES_PATTERN, chunk)[row]
+
+    def labels(self, soundscape_id):
+        """ Get the frame-level labels of a soundscape (see write_labels), np.array (n_frames, n_classes)
+        memory-mapped """
+        chunk, row = self.index.loc[soundscape_id, ["chunk", "row"]]
+        return self.load_chunk(LABELS_PATTERN, chunk)[row]
+
+    def times(self):
+        """ Get the time (s) of the frames of the features """
+        return frame_times(self.n_frames, self.sr, self.params["hop_length"])
+
+
+def write_labels(folder, annotations=None, classes=None):
+    """ Write the frame-level labels of the soundscapes of a store, from their (post-processed) annotations
+    Args:
+        folder: str, folder of the store (see get_features_folder).
+        annotations: str or pd.DataFrame, optional, the annotations of the soundscapes (filename, onset, offset,
+            event_label, see post_processing_annotations), the txt files next to the store by default.
+        classes: list, optional, the classes of the labels, the sorted classes of the annotations by default.
+
+    Returns:
+        list, the classes of the labels
+    """
+    # Imported here, utils depends on this module (through encoding)
+    from utils import read_annotations, list_files, get_data
+    if annotations is None:
+        txt_files = list_files(osp.dirname(osp.normpath(folder)), ".txt")
+        annotations = pd.concat([get_data(txt_file)[0].assign(filename=txt_file) for txt_file in txt_files]
+                                + [pd.DataFrame(columns=["filename", "onset", "offset", "event_label"])])
+    elif isinstance(annotations, str):
+        annotations = read_annotations(annotations)
+    if classes is None:
+        classes = sorted(annotations["event_label"].dropna().unique())
+    reader = FeatureReader(folder)
+    times = reader.times()
+    by_id = dict(list(annotations.groupby(annotations["filename"].apply(get_soundscape_id))))
+    empty = annotations.iloc[:0]
+    for chunk, df_chunk in reader.index.reset_index().groupby("chunk"):
+        n_rows = reader.load_chunk(FEATURES_PATTERN, chunk).shape[0]
+        labels = np.zeros((n_rows, reader.n_frames, len(classes)), dtype=np.uint8)
+        for soundscape_id, row in zip(df_chunk["id"], df_chunk["row"]):
+            labels[row] = label_matrix(by_id.get(soundscape_id, empty), classes, times)
+        np.save(osp.join(folder, LABELS_PATTERN.format(chunk)), labels)
+    with open(osp.join(folder, FEATURES_PARAMS)) as f:
+        meta = json.load(f)
+    meta["classes"] = list(classes)
+    with open(osp.join(folder, FEATURES_PARAMS), "w") as f:
+        json.dump(meta, f, indent=2)
+    return list(classes)
@@ -6,15 +6,20 @@
 #########################################################################
 import time
 import argparse
-import scaper
-import numpy as np
 import os
 import os.path as osp
 import json
 import glob
-import jams
+import soundfile as sf
 
-from utils import choose_class, add_event, create_folder, pprint, rm_high_polyphony, post_processing_annotations
+from utils import create_folder, add_generation_args, setup_generation, read_jams, write_jams, get_scaper_annotation, \
+    get_jams_events, map_jobs, render_from_jams
+from stems import has_stems, read_stems, write_mix
+from encoding import AudioEncoder, find_audio_file, encode_file, get_audio_format
+from features import write_labels, FEATURES_FOLDER
+from plan import get_run_plan, render_plan
+from manifest import process_generated
+from generate_eval_distortions import generate_distorted_files
 
 
 def modify_bg_snr(new_snr, jam_file):
@@ -24,36 +29,72 @@ def modify_bg_snr(new_snr, jam_file):
         jam_file: str, the name of the JAMS file to change the background SNR
 
     Returns:
-        jams object that has been modified
+        dict, the content of the JAMS that has been modified (see utils.read_jams)
     """
-    jam_obj = jams.load(jam_file)
-    data = jam_obj["annotations"][0].data
-    for cnt, obs in enumerate(data):
-        if obs.value["role"] == "background":
+    jam_dict = read_jams(jam_file)
+    for obs in get_scaper_annotation(jam_dict)['data']:
+        if obs['value']["role"] == "background":
             # Changing manually the jams to have the snr desired
-            jam_obj["annotations"][0].data[cnt].value["snr"] = new_snr
+            obs['value']["snr"] = new_snr
 
-    return jam_obj
+    return jam_dict
 
 
-def generate_new_bg_snr_files(new_snr, in_dir, out_dir):
+def generate_new_bg_snr_file(new_snr, jam_file, out_dir, cache=None, engine="scaper"):
+    """ Generate the new JAMS and audio file of a soundscape with a different background SNR.
+    If the stems of the soundscape have been kept, the audio is only a gain-and-sum of the stems,
+    otherwise the soundscape is generated again, as the original one (see utils.render_from_jams, the reverb
+    with an impulse response is saved in the JAMS). In both cases the background is at ref_db + new_snr.
+
+    Args:
+        new_snr: float, Sound to noise ratio (SNR) of the background from the reference
+        jam_file: str, the JAMS file with the background SNR to be changed
+        out_dir: str, folder where to save the new audio and JAMS
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        engine: str, "scaper" or "numpy", engine generating the audio without stems (see utils.render_from_jams).
+
+    Returns:
+        str, the path of the audio file generated
+    """
+    jam_dict = modify_bg_snr(new_snr, jam_file)
+    out_jams = osp.join(out_dir, os.path.basename(jam_file))
+    write_jams(jam_dict, out_jams)
+
+    # The new soundscape has the format of the original one (see encoding.py)
+    in_audiofile = find_audio_file(osp.splitext(jam_file)[0] + ".wav")
+    audiofile = os.path.join(out_dir, osp.basename(in_audiofile))
+    if has_stems(in_audiofile):
+        df_events = get_jams_events(read_jams(jam_file))
+        old_snr = df_events.loc[df_events.role == "background", "snr"].iloc[0]
+        stems, sr = read_stems(in_audiofile)
+        write_mix(audiofile, stems, sr, gains_db={"background": new_snr - old_snr},
+                  subtype=sf.info(in_audiofile).subtype)
+    else:
+        render_from_jams(out_jams, osp.splitext(audiofile)[0] + ".wav", cache=cache, engine=engine)
+        encode_file(audiofile, get_audio_format(audiofile))
+    return audiofile
+
+
+def generate_new_bg_snr_files(new_snr, in_dir, out_dir, n_jobs=1, encoder=None, cache=None, engine="scaper"):
     """ Generate the new JAMS and audio files with a different background SNR
     Args:
         new_snr: float, Sound to noise ratio (SNR) of the background from the reference
         in_dir: str, folder containing JAMS file with background SNR to be changed
         out_dir: str, folder where to save the new audio and JAMS
+        n_jobs: int, number of processes to use.
+        encoder: encoding.AudioEncoder, optional, computes the features of the soundscapes generated (see features.py)
+            and encodes them if they are wav files, while the next ones are generated.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        engine: str, "scaper" or "numpy", engine generating the audio without stems (see utils.render_from_jams).
 
     Returns:
-
+        list, the paths of the audio files generated
     """
-    for jam_file in sorted(glob.glob(os.path.join(in_dir, "*.jams"))):
-        jams_obj = modify_bg_snr(new_snr, jam_file)
-        out_jams = osp.join(out_dir, os.path.basename(jam_file))
-        jams_obj.save(out_jams)
-
-        audiofile = os.path.join(out_dir, osp.splitext(osp.basename(jam_file))[0] + ".wav")
-        print(audiofile)
-        scaper.generate_from_jams(out_jams, audiofile)
+    list_args = [(new_snr, jam_file, out_dir, cache, engine)
+                 for jam_file in sorted(glob.glob(os.path.join(in_dir, "*.jams")))]
+    print(f"Generating {len(list_args)} soundscapes with a background SNR of {new_snr} in {out_dir}")
+    callback = None if encoder is None else lambda job_args, audiofile: encoder.submit(audiofile)
+    return map_jobs(generate_new_bg_snr_file, list_args, n_jobs, print_every=100, callback=callback)
 
 
 if __name__ == '__main__':
@@ -61,11 +102,16 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--outfolder', type=str, default=osp.join('..', 'eval', 'soundscapes_generated_fbsnr'))
     parser.add_argument('--outcsv', type=str, default=osp.join('..', 'eval', "soundscapes_generated_fbsnr", "XdB.csv"))
-    parser.add_argument('--number', type=int, default=1000)
+    parser.add_argument('--outplan', type=str,
+                        default=osp.join('..', 'eval', "soundscapes_generated_fbsnr", "plan.csv"))
     parser.add_argument('--fgfolder', type=str, default=osp.join("..", "eval", "soundbank", "foreground"))
     parser.add_argument('--bgfolder', type=str, default=osp.join("..", "eval", "soundbank", "background"))
+    parser.add_argument('--distortions', action="store_true", default=False,
+                        help="Also generate the distorted subsets of the 30dB soundscapes (see degradation.py)")
+    add_generation_args(parser, plan=True)
     args = parser.parse_args()
-    pprint(vars(args))
+    # The other subsets are derived from the 30dB soundscapes
+    manifest, cache, feature_params = setup_generation(args, osp.join(args.outfolder, "30dB"))
 
     # General output folder, in args
     out_folder = args.outfolder
@@ -89,63 +135,49 @@ if __name__ == '__main__':
     # FBSNR
     # #######
     # Generate events same way as the training set
-    out_folder_30 = osp.join(out_folder, "30dB")
-    create_folder(out_folder_30)
-    n=0
-    for class_lbl in params.keys():
-        class_params = params[class_lbl]
-        for i in range(int(n_soundscapes * class_params['prob'])):
-
-            print('Generating soundscape: {:d}/{:d}'.format(n+1, n_soundscapes))
-
-            # create a scaper
-            sc = scaper.Scaper(duration, fg_folder, bg_folder)
-            sc.protected_labels = []
-            sc.ref_db = ref_db
-
-            # add background
-            sc.add_background(label=('choose', []),
-                              source_file=('choose', []),
-                              source_time=('const', 0))
-
-            # add main event
-            sc = add_event(sc, class_lbl, duration, fg_folder)
-
-            # add random number of foreground events
-            n_events = np.random.randint(0, class_params['event_max'])
-            for _ in range(n_events):
-                chosen_class = choose_class(class_params)
-                sc = add_event(sc, chosen_class, duration, fg_folder)
-
-            # generate
-            audiofile = osp.join(out_folder_30, f"{n}.wav")
-            jamsfile = osp.join(out_folder_30, f"{n}.jams")
-            txtfile = osp.join(out_folder_30, f"{n}.txt")
-
-            sc.generate(audiofile, jamsfile,
-                        allow_repeated_label=True,
-                        allow_repeated_source=True,
-                        reverb=0.1,
-                        disable_sox_warnings=True,
-                        no_audio=False,
-                        txt_path=txtfile)
-            n += 1
-
-    rm_high_polyphony(out_folder_30, 3)
-    post_processing_annotations(out_folder_30, output_folder=out_folder_30, output_csv=args.outcsv)
+    out_folder_30 = manifest.folder
+    # A resumed run uses the plan of its first run
+    df_plan = get_run_plan(manifest, args.outplan, params, n_soundscapes, fg_folder, bg_folder, duration,
+                           pitch_step=args.pitch_step)
+    pending = manifest.pending(df_plan['soundscape'].unique())
+    print(f"{df_plan.soundscape.nunique() - len(pending)} soundscapes already generated in {out_folder_30}")
+    # The foreground and background stems are kept, the other FBSNR are only a gain-and-sum of them
+    # The other subsets are generated in the format of the 30dB soundscapes
+    with AudioEncoder(args.audio_format, args.encode_jobs, feature_params=feature_params,
+                      manifest=manifest) as encoder:
+        render_plan(df_plan[df_plan['soundscape'].isin(pending)], out_folder_30, fg_folder, bg_folder, duration,
+                    ref_db, n_jobs=args.jobs, keep_stems=True, cache=cache, pitch_step=args.pitch_step,
+                    fft_reverb=args.fft_reverb, ir_bank=args.ir_bank, engine=args.engine, batch_size=args.batch_size,
+                    encoder=encoder)
+
+    # The polyphony is already checked before generating the audio, nothing should be removed here
+    process_generated(manifest, args.outcsv, 3, length_sec=duration, n_jobs=args.jobs)
+    if args.distortions:
+        # The degradations of the toolbox (generate_eval_distortions.m), on the soundscapes just generated
+        generate_distorted_files(out_folder_30, osp.join(out_folder, "distorted"), in_csv=args.outcsv,
+                                 seed=args.seed, duration=duration, n_jobs=args.jobs)
 
     # We create the same dataset with different background SNR
     # Be careful, 6 means the background SNR is 6,
     # so the foreground background snr ratio is between 0dB and 24dB (see utils snr_min (6dB) and snr_max (30dB))
+    # The features of the other FBSNR are computed while they are generated (they have the annotations of 30dB)
+    encoder = AudioEncoder(args.audio_format, args.encode_jobs, feature_params=feature_params)
     out_folder_24 = osp.join(out_folder, "24dB")
     create_folder(out_folder_24)
-    generate_new_bg_snr_files(6, out_folder_30, out_folder_24)
+    generate_new_bg_snr_files(6, out_folder_30, out_folder_24, n_jobs=args.jobs, encoder=encoder, cache=cache,
+                              engine=args.engine)
 
     # Same for 15
     out_folder_15 = osp.join(out_folder, "15dB")
     create_folder(out_folder_15)
-    generate_new_bg_snr_files(15, out_folder_30, out_folder_15)
+    generate_new_bg_snr_files(15, out_folder_30, out_folder_15, n_jobs=args.jobs, encoder=encoder, cache=cache,
+                              engine=args.engine)
 
     out_folder_0 = osp.join(out_folder, "0dB")
     create_folder(out_folder_0)
-    generate_new_bg_snr_files(30, out_folder_30, out_folder_0)
+    generate_new_bg_snr_files(30, out_folder_30, out_folder_0, n_jobs=args.jobs, encoder=encoder, cache=cache,
+                              engine=args.engine)
+    encoder.close()
+    if args.features:
+        for folder in [out_folder_30, out_folder_24, out_folder_15, out_folder_0]:
+            write_labels(osp.join(folder, FEATURES_FOLDER), args.outcsv)
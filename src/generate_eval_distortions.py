@@ -4,5 +4,132 @@
 # Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
 # This software is distributed under the terms of the License MIT
 #########################################################################
+import time
+import argparse
+import numpy as np
+import os.path as osp
+import glob
+import hashlib
+import pandas as pd
+import soundfile as sf
 
-# Todo, replace the matlab code in a python code to integrate it in the package
+from utils import create_folder, pprint, map_jobs, get_random_state, read_annotations, AnnotationWriter
+from generate_eval_var_onset import shift_annotations
+from degradation import DEGRADATIONS, degrade
+from encoding import AUDIO_EXTENSIONS, write_audio
+from features import get_soundscape_id
+
+
+def get_soundscape_index(audio_file):
+    """ Get the index of the random state of a soundscape from its id (see features.get_soundscape_id): its number,
+    or a hash of the id if it is not a number. The noise of a soundscape does not depend on the other files.
+    Args:
+        audio_file: str, path of the soundscape.
+
+    Returns:
+        int, the index of the soundscape
+    """
+    soundscape_id = get_soundscape_id(audio_file)
+    if soundscape_id.isdigit():
+        return int(soundscape_id)
+    return int(hashlib.md5(soundscape_id.encode()).hexdigest()[:8], 16)
+
+
+def generate_distorted_file(audio_file, out_dir, degradations=None, seed=0):
+    """ Generate the degraded versions of a soundscape, the soundscape is read once for all the degradations.
+    If the soundscape has a txt file of annotations, it is saved with each degraded version (shifted by the delay
+    of the degradation).
+
+    Args:
+        audio_file: str, path of the soundscape (wav, FLAC or Opus, the degraded versions have the same format), the
+            noise of the degradations uses get_random_state(seed, get_soundscape_index(audio_file)).
+        out_dir: str, folder of the distorted subsets, a subfolder per degradation.
+        degradations: list, optional, the names of the degradations (see degradation.DEGRADATIONS), all by default.
+        seed: int, base seed of the degradations.
+
+    Returns:
+        dict, the delay in seconds of each degradation, {name: delay}
+    """
+    if degradations is None:
+        degradations = list(DEGRADATIONS)
+    audio, sr = sf.read(audio_file)
+    subtype = sf.info(audio_file).subtype
+    txt_file = osp.splitext(audio_file)[0] + ".txt"
+    df = pd.read_csv(txt_file, sep='\t', names=["onset", "offset", "event_label"]) if osp.exists(txt_file) else None
+    duration = len(audio) / sr
+
+    delays = {}
+    for name in degradations:
+        degraded, delay = degrade(audio, sr, name, get_random_state(seed, get_soundscape_index(audio_file)))
+        write_audio(osp.join(out_dir, name, osp.basename(audio_file)), np.clip(degraded, -1, 1), sr, subtype=subtype)
+        if df is not None:
+            shift_annotations(df, delay, duration).to_csv(osp.join(out_dir, name, osp.basename(txt_file)),
+                                                          header=False, index=False, sep="\t")
+        delays[name] = delay
+    return delays
+
+
+def generate_distorted_files(in_dir, out_dir, in_csv=None, degradations=None, seed=0, duration=10.0, n_jobs=1):
+    """ Generate the distorted subsets of the soundscapes of a folder (replacing generate_eval_distortions.m)
+    Args:
+        in_dir: str, folder of the soundscapes to degrade (audio files of any format of encoding.AUDIO_FORMATS,
+            and their txt files if any).
+        out_dir: str, folder of the distorted subsets, a subfolder per degradation.
+        in_csv: str, optional, annotations of the soundscapes of in_dir (see post_processing_annotations),
+            the annotations of each subset are saved in out_dir/<degradation>.csv (same extension as in_csv).
+        degradations: list, optional, the names of the degradations (see degradation.DEGRADATIONS), all by default.
+        seed: int, base seed of the degradations.
+        duration: float, duration of the soundscapes in seconds.
+        n_jobs: int, number of processes to use.
+
+    Returns:
+        list, the paths of the soundscapes degraded
+    """
+    if degradations is None:
+        degradations = list(DEGRADATIONS)
+    for name in degradations:
+        create_folder(osp.join(out_dir, name))
+    audio_files = sorted(audio_file for extension in AUDIO_EXTENSIONS
+                         for audio_file in glob.glob(osp.join(in_dir, "*" + extension)))
+    list_args = [(audio_file, out_dir, degradations, seed) for audio_file in audio_files]
+    print(f"Generating {len(degradations)} degradations of {len(audio_files)} soundscapes in {out_dir}")
+    list_delays = map_jobs(generate_distorted_file, list_args, n_jobs, print_every=100)
+
+    if in_csv is not None:
+        df = read_annotations(in_csv)
+        delays = pd.DataFrame(list_delays, index=[osp.basename(audio_file) for audio_file in audio_files])
+        for name in degradations:
+            df_name = []
+            for filename, df_file in df.groupby(df["filename"].apply(osp.basename), sort=False):
+                if filename not in delays.index:
+                    continue
+                df_file = shift_annotations(df_file, delays.loc[filename, name], duration)
+                df_file["filename"] = osp.join(out_dir, name, filename)
+                df_name.append(df_file)
+            out_csv = osp.join(out_dir, name + osp.splitext(in_csv)[1])
+            with AnnotationWriter(out_csv, {'filename': str, 'onset': float, 'offset': float, 'event_label': str},
+                                  float_format="%.3f") as writer:
+                for df_file in df_name:
+                    writer.write(df_file)
+    return audio_files
+
+
+if __name__ == '__main__':
+    t = time.time()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--infolder', type=str, default=osp.join('..', 'eval', 'soundscapes_generated_fbsnr', '30dB'))
+    parser.add_argument('--incsv', type=str, default=None,
+                        help="Annotations of the soundscapes of --infolder, shifted for each degradation")
+    parser.add_argument('--outfolder', type=str, default=osp.join('..', 'eval', 'soundscapes_generated_distorted'))
+    parser.add_argument('--degradations', type=str, nargs="+", default=list(DEGRADATIONS), choices=list(DEGRADATIONS))
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    if args.seed is None:
+        # Keep track of the seed used, so the generation can be reproduced
+        args.seed = np.random.randint(2 ** 31)
+    pprint(vars(args))
+
+    generate_distorted_files(args.infolder, args.outfolder, in_csv=args.incsv, degradations=args.degradations,
+                             seed=args.seed, n_jobs=args.jobs)
+    print(f"time of the program: {time.time() - t}")
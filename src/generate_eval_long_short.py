@@ -7,38 +7,41 @@
 import time
 import argparse
 import scaper
-import numpy as np
 import os.path as osp
 
-from utils import create_folder, pprint, rm_high_polyphony, post_processing_annotations
+from utils import create_folder, add_generation_args, setup_generation, get_random_state, map_jobs, \
+    generate_max_polyphony
 from generate_eval_FBSNR import generate_new_bg_snr_files
-
-
-if __name__ == '__main__':
-    t = time.time()
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--outfolder', type=str, default=osp.join('..', 'eval', 'soundscapes_generated_ls'))
-    parser.add_argument('--outcsv', type=str, default=osp.join('..', 'eval', "soundscapes_generated_ls", "XdB.csv"))
-    parser.add_argument('--number', type=int, default=1000)
-    parser.add_argument('--fgfolder', type=str, default=osp.join("..", "eval", "soundbank", "foreground_short"))
-    parser.add_argument('--bgfolder', type=str, default=osp.join("..", "eval", "soundbank", "background_long"))
-    args = parser.parse_args()
-    pprint(vars(args))
-
-    # General output folder, in args
-    out_folder = args.outfolder
-    create_folder(out_folder)
-
-    # Default parameters
-    n_soundscapes = args.number
-    ref_db = -50
-    duration = 10.0
-
-    # ################
-    # Long event as background, short events as foreground
-    # ###########
-    fg_folder = args.fgfolder
-    bg_folder = args.bgfolder
+from encoding import AudioEncoder
+from features import write_labels, FEATURES_FOLDER
+from reverb import get_reverb_params
+from manifest import process_generated
+
+
+def generate_long_short_soundscape(n, outfolder, fg_folder, bg_folder, seed, duration=10.0, ref_db=-50,
+                                   max_polyphony=3, keep_stems=False, cache=None, fft_reverb=False, ir_bank=None,
+                                   engine="scaper", max_resamples=10):
+    """ Generate a soundscape with a long event as background and short events as foreground
+    Args:
+        n: int, index of the soundscape, used to name the files and to derive the random state.
+        outfolder: str, folder in which to save the audio, JAMS and txt files.
+        fg_folder: str, path of the foreground soundbank (short events).
+        bg_folder: str, path of the background soundbank (long events).
+        seed: int, base seed of the generation, the soundscape uses get_random_state(seed, n).
+        duration: float, duration of the soundscape in seconds.
+        ref_db: float, reference loudness of the background.
+        max_polyphony: int, the soundscape is instantiated again while its polyphony is >= max_polyphony, its events
+            are sampled again (number and labels) when no instantiation has a polyphony low enough.
+        keep_stems: bool, whether to save the foreground and background stems (see stems.save_stems).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        fft_reverb: bool, whether to apply the reverb with an impulse response instead of sox (see reverb.py).
+        ir_bank: str, optional, folder of impulse responses used with fft_reverb (synthetic impulse response if None).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+        max_resamples: int, maximum number of times the events are sampled again.
+
+    Returns:
+        str, the path of the JAMS file generated, None if the soundscape is still too polyphonic after all the trials
+    """
     # Generate events same way as the training set
     min_events = 1
     max_events = 5
@@ -67,12 +70,17 @@ if __name__ == '__main__':
     time_stretch_min = 1
     time_stretch_max = 1
 
-    out_folder_ls_30 = osp.join(out_folder, "ls_30dB")
-    create_folder(out_folder_ls_30)
-    for n in range(n_soundscapes):
-        print('Generating soundscape: {:d}/{:d}'.format(n+1, n_soundscapes))
+    # generate
+    audiofile = osp.join(outfolder, f"{n}.wav")
+    jamsfile = osp.join(outfolder, f"{n}.jams")
+    txtfile = osp.join(outfolder, f"{n}.txt")
+    reverb_params = get_reverb_params(n, ir_bank=ir_bank) if fft_reverb else None
+
+    # The events are sampled again with the same random state, the soundscape only depends on the seed and n
+    random_state = get_random_state(seed, n)
+    for _ in range(max_resamples):
         # create a scaper
-        sc = scaper.Scaper(duration, fg_folder, bg_folder)
+        sc = scaper.Scaper(duration, fg_folder, bg_folder, random_state=random_state)
         sc.protected_labels = []
         sc.ref_db = ref_db
 
@@ -82,42 +90,88 @@ if __name__ == '__main__':
                           source_time=('const', 0))
 
         # add random number of foreground events
-        n_events = np.random.randint(min_events, max_events+1)
+        n_events = sc.random_state.randint(min_events, max_events+1)
         for _ in range(n_events):
             sc.add_event(label=('choose', []),
                          source_file=('choose', []),
                          source_time=(source_time_dist, source_time),
-                         event_time=(event_time_dist, event_time_mean, event_time_std, event_time_min, event_time_max),
+                         event_time=(event_time_dist, event_time_mean, event_time_std, event_time_min,
+                                     event_time_max),
                          event_duration=(event_duration_dist, event_duration_min, event_duration_max),
                          snr=(snr_dist, snr),
                          pitch_shift=(pitch_dist, pitch_min, pitch_max),
                          time_stretch=(time_stretch_dist, time_stretch_min, time_stretch_max))
 
-        # generate
-        audiofile = osp.join(out_folder_ls_30, f"{n}.wav")
-        jamsfile = osp.join(out_folder_ls_30, f"{n}.jams")
-        txtfile = osp.join(out_folder_ls_30, f"{n}.txt")
+        # The polyphony is checked before generating the audio, the files are deleted if no instantiation of these
+        # events has a polyphony low enough
+        if generate_max_polyphony(sc, audiofile, jamsfile, txtfile, max_polyphony, keep_stems=keep_stems, cache=cache,
+                                  reverb_params=reverb_params, engine=engine):
+            return jamsfile
+    print(f"Soundscape {n} is still too polyphonic after {max_resamples} samplings of its events, not generated")
+    return None
+
 
-        sc.generate(audiofile, jamsfile,
-                    allow_repeated_label=True,
-                    allow_repeated_source=True,
-                    reverb=0.1,
-                    disable_sox_warnings=True,
-                    no_audio=False,
-                    txt_path=txtfile)
+if __name__ == '__main__':
+    t = time.time()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--outfolder', type=str, default=osp.join('..', 'eval', 'soundscapes_generated_ls'))
+    parser.add_argument('--outcsv', type=str, default=osp.join('..', 'eval', "soundscapes_generated_ls", "XdB.csv"))
+    parser.add_argument('--fgfolder', type=str, default=osp.join("..", "eval", "soundbank", "foreground_short"))
+    parser.add_argument('--bgfolder', type=str, default=osp.join("..", "eval", "soundbank", "background_long"))
+    add_generation_args(parser)
+    args = parser.parse_args()
+    manifest, cache, feature_params = setup_generation(args, osp.join(args.outfolder, "ls_30dB"))
+
+    # General output folder, in args
+    out_folder = args.outfolder
+    create_folder(out_folder)
+
+    # Default parameters
+    n_soundscapes = args.number
+    ref_db = -50
+    duration = 10.0
+
+    # ################
+    # Long event as background, short events as foreground
+    # ###########
+    fg_folder = args.fgfolder
+    bg_folder = args.bgfolder
 
-    rm_high_polyphony(out_folder_ls_30, 3)
-    post_processing_annotations(out_folder_ls_30, output_folder=out_folder_ls_30, output_csv=args.outcsv)
+    out_folder_ls_30 = manifest.folder
+    # Only the soundscapes not generated yet (or with modified files)
+    pending = manifest.pending(range(n_soundscapes))
+    # The foreground and background stems are kept, the other FBSNR are only a gain-and-sum of them
+    list_args = [(n, out_folder_ls_30, fg_folder, bg_folder, args.seed, duration, ref_db, 3, True, cache,
+                  args.fft_reverb, args.ir_bank, args.engine)
+                 for n in pending]
+    print(f'Generating {len(pending)} soundscapes with {args.jobs} job(s)')
+    # The other FBSNR are generated in the format of the 30dB soundscapes
+    with AudioEncoder(args.audio_format, args.encode_jobs, feature_params=feature_params,
+                      manifest=manifest) as encoder:
+        # A soundscape not generated (too polyphonic) is not recorded in the manifest, it stays pending
+        map_jobs(generate_long_short_soundscape, list_args, args.jobs,
+                 callback=lambda job_args, jams_file: jams_file is not None and encoder.submit(jams_file))
+
+    # The polyphony is already checked before generating the audio, nothing should be removed here
+    process_generated(manifest, args.outcsv, 3, length_sec=duration, n_jobs=args.jobs)
 
     # We create the same dataset with different background SNR
     # Be careful, 15 means the background SNR is 15,
     # so the foreground background snr ratio is between -9dB and 15dB
+    # The features of the other FBSNR are computed while they are generated (they have the annotations of 30dB)
+    encoder = AudioEncoder(args.audio_format, args.encode_jobs, feature_params=feature_params)
     out_folder_ls_15 = osp.join(out_folder, "ls_15dB")
     create_folder(out_folder_ls_15)
-    generate_new_bg_snr_files(15, out_folder_ls_30, out_folder_ls_15)
+    generate_new_bg_snr_files(15, out_folder_ls_30, out_folder_ls_15, n_jobs=args.jobs, encoder=encoder,
+                              cache=cache, engine=args.engine)
     
     # Same for 30dB
     out_folder_ls_0 = osp.join(out_folder, "ls_0dB")
     create_folder(out_folder_ls_0)
-    generate_new_bg_snr_files(30, out_folder_ls_30, out_folder_ls_0)
+    generate_new_bg_snr_files(30, out_folder_ls_30, out_folder_ls_0, n_jobs=args.jobs, encoder=encoder,
+                              cache=cache, engine=args.engine)
+    encoder.close()
+    if args.features:
+        for folder in [out_folder_ls_30, out_folder_ls_15, out_folder_ls_0]:
+            write_labels(osp.join(folder, FEATURES_FOLDER), args.outcsv)
 
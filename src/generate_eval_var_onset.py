@@ -7,13 +7,20 @@
 import time
 import argparse
 import scaper
+import numpy as np
 import os
 import os.path as osp
 import glob
-import jams
-import pandas as pd
+import soundfile as sf
 
-from utils import create_folder, pprint, rm_high_polyphony, post_processing_annotations
+from utils import create_folder, add_generation_args, setup_generation, get_random_state, map_jobs, read_jams, \
+    write_jams, get_scaper_annotation, sort_jams_events, read_annotations, AnnotationWriter, render_from_jams, \
+    set_desed_sandbox
+from stems import has_stems, read_stems, write_mix, shift_audio
+from encoding import AudioEncoder, find_audio_file, encode_file, get_audio_format
+from features import write_labels, FEATURES_FOLDER
+from reverb import get_reverb_params
+from manifest import process_generated
 
 
 def modify_fg_onset(added_value, jam_file):
@@ -23,69 +30,121 @@ def modify_fg_onset(added_value, jam_file):
         jam_file: str, the name of the JAMS file to change the background SNR
 
     Returns:
-        jams object that has been modified
+        dict, the content of the JAMS that has been modified (see utils.read_jams)
     """
-    jam_obj = jams.load(jam_file)
-    data = jam_obj["annotations"][0].data
-    for cnt, obs in enumerate(data):
-        if obs.value["role"] == "foreground":
-            onset = obs.value["event_time"]
+    jam_dict = read_jams(jam_file)
+    for obs in get_scaper_annotation(jam_dict)['data']:
+        if obs['value']["role"] == "foreground":
+            onset = obs['value']["event_time"]
             # Change source time by adding the added value specified
-            jam_obj["annotations"][0].data[cnt].value["event_time"] = onset + added_value
-            # Todo, this is tricky, because it is an object, find a better way to do that with Scaper
-            new_obs = jam_obj["annotations"][0].data[cnt]._replace(time=onset + added_value)
-            del jam_obj["annotations"][0].data[cnt]
-            jam_obj["annotations"][0].data.add(new_obs)
+            obs['value']["event_time"] = onset + added_value
+            obs['time'] = onset + added_value
 
-    return jam_obj
+    return sort_jams_events(jam_dict)
 
 
-def generate_new_fg_onset_files(added_value, in_dir, out_dir):
-    """ Generate the new JAMS and audio files adding a value to forground onsets
+def shift_annotations(df, added_value, duration=10.0):
+    """ Add a value to the onsets and offsets of annotations, the events are truncated at the end of the soundscape
+    Args:
+        df: pd.DataFrame, the annotations, with the columns onset and offset.
+        added_value: float, value in seconds, value to be added to the onsets and offsets.
+        duration: float, duration of the soundscapes in seconds.
+
+    Returns:
+        pd.DataFrame, the annotations modified, the events starting after the end of the soundscape are removed.
+    """
+    df = df.copy()
+    df["onset"] += added_value
+    df["offset"] = np.minimum(df["offset"] + added_value, duration)
+    return df[df["onset"] < duration]
+
+
+def generate_new_fg_onset_file(added_value, jam_file, out_dir, cache=None, engine="scaper"):
+    """ Generate the new JAMS and audio file of a soundscape adding a value to its foreground onsets.
+    If the stems of the soundscape have been kept, the foreground stem is only delayed by the number of samples
+    corresponding to the value and mixed with the background stem, otherwise the soundscape is generated again,
+    as the original one (see utils.render_from_jams, the reverb with an impulse response is saved in the JAMS).
+
     Args:
         added_value: float, value in seconds, value to be added to previous onset
-        in_dir: str, folder containing JAMS file with background SNR to be changed
+        jam_file: str, the JAMS file with the foreground onset to be changed
         out_dir: str, folder where to save the new audio and JAMS
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        engine: str, "scaper" or "numpy", engine generating the audio without stems (see utils.render_from_jams).
 
     Returns:
-
+        str, the path of the audio file generated
     """
-    for jam_file in sorted(glob.glob(os.path.join(in_dir, "*.jams"))):
-        jams_obj = modify_fg_onset(added_value, jam_file)
-        out_jams = osp.join(out_dir, os.path.basename(jam_file))
-        jams_obj.save(out_jams)
+    jam_dict = modify_fg_onset(added_value, jam_file)
+    out_jams = osp.join(out_dir, os.path.basename(jam_file))
+    write_jams(jam_dict, out_jams)
 
-        audiofile = os.path.join(out_dir, osp.splitext(osp.basename(jam_file))[0] + ".wav")
-        print(audiofile)
-        scaper.generate_from_jams(out_jams, audiofile)
+    # The new soundscape has the format of the original one (see encoding.py)
+    in_audiofile = find_audio_file(osp.splitext(jam_file)[0] + ".wav")
+    audiofile = os.path.join(out_dir, osp.basename(in_audiofile))
+    if has_stems(in_audiofile):
+        stems, sr = read_stems(in_audiofile)
+        stems["foreground"] = shift_audio(stems["foreground"], int(round(added_value * sr)))
+        write_mix(audiofile, stems, sr, subtype=sf.info(in_audiofile).subtype)
+    else:
+        render_from_jams(out_jams, osp.splitext(audiofile)[0] + ".wav", cache=cache, engine=engine)
+        encode_file(audiofile, get_audio_format(audiofile))
+    return audiofile
 
 
-if __name__ == '__main__':
-    t = time.time()
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--outfolder', type=str, default=osp.join('..', 'eval', 'soundscapes_generated_var_onset'))
-    parser.add_argument('--number', type=int, default=1000)
-    parser.add_argument('--fgfolder', type=str, default=osp.join("..", "eval", "soundbank", "foreground_on_off"))
-    parser.add_argument('--bgfolder', type=str, default=osp.join("..", "eval", "soundbank", "background"))
-    args = parser.parse_args()
-    pprint(vars(args))
+def generate_new_fg_onset_files(added_value, in_dir, out_dir, in_csv=None, out_csv=None, duration=10.0, n_jobs=1,
+                                encoder=None, cache=None, engine="scaper"):
+    """ Generate the new JAMS, audio files and annotations adding a value to forground onsets
+    Args:
+        added_value: float, value in seconds, value to be added to previous onset
+        in_dir: str, folder containing JAMS file with foreground onsets to be changed
+        out_dir: str, folder where to save the new audio and JAMS
+        in_csv: str, optional, annotations of the soundscapes of in_dir (see post_processing_annotations).
+        out_csv: str, optional, where to save the annotations of the new soundscapes (needs in_csv).
+        duration: float, duration of the soundscapes in seconds.
+        n_jobs: int, number of processes to use.
+        encoder: encoding.AudioEncoder, optional, computes the features of the soundscapes generated (see features.py)
+            and encodes them if they are wav files, while the next ones are generated.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        engine: str, "scaper" or "numpy", engine generating the audio without stems (see utils.render_from_jams).
 
-    # General output folder, in args
-    out_folder = args.outfolder
-    create_folder(out_folder)
+    Returns:
+        list, the paths of the audio files generated
+    """
+    list_args = [(added_value, jam_file, out_dir, cache, engine)
+                 for jam_file in sorted(glob.glob(os.path.join(in_dir, "*.jams")))]
+    print(f"Generating {len(list_args)} soundscapes with {added_value}s added to the onsets in {out_dir}")
+    callback = None if encoder is None else lambda job_args, audiofile: encoder.submit(audiofile)
+    audio_files = map_jobs(generate_new_fg_onset_file, list_args, n_jobs, print_every=100, callback=callback)
 
-    # Default parameters
-    n_soundscapes = args.number
-    ref_db = -50
-    duration = 10.0
+    if out_csv is not None:
+        df = shift_annotations(read_annotations(in_csv), added_value, duration)
+        with AnnotationWriter(out_csv, {'filename': str, 'onset': float, 'offset': float, 'event_label': str},
+                              float_format="%.3f") as writer:
+            writer.write(df)
+    return audio_files
 
-    # ################
-    # Varying onset of a single event
-    # ###########
-    # SCAPER SETTINGS
-    fg_folder = args.fgfolder
-    bg_folder = args.bgfolder
 
+def generate_single_event_soundscape(n, outfolder, fg_folder, bg_folder, seed, duration=10.0, ref_db=-50,
+                                     keep_stems=False, cache=None, fft_reverb=False, ir_bank=None, engine="scaper"):
+    """ Generate a soundscape with a single foreground event having an onset between 250ms and 750ms
+    Args:
+        n: int, index of the soundscape, used to name the files and to derive the random state.
+        outfolder: str, folder in which to save the audio, JAMS and txt files.
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        seed: int, base seed of the generation, the soundscape uses get_random_state(seed, n).
+        duration: float, duration of the soundscape in seconds.
+        ref_db: float, reference loudness of the background.
+        keep_stems: bool, whether to save the foreground and background stems (see stems.save_stems).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        fft_reverb: bool, whether to apply the reverb with an impulse response instead of sox (see reverb.py).
+        ir_bank: str, optional, folder of impulse responses used with fft_reverb (synthetic impulse response if None).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+
+    Returns:
+        str, the path of the JAMS file generated
+    """
     source_time_dist = 'const'
     source_time = 0.0
 
@@ -111,67 +170,104 @@ if __name__ == '__main__':
     event_time_min = 0.25
     event_time_max = 0.750
 
-    out_folder_500 = osp.join(out_folder, "500ms")
-    create_folder(out_folder_500)
+    # create a scaper
+    sc = scaper.Scaper(duration, fg_folder, bg_folder, random_state=get_random_state(seed, n))
+    sc.protected_labels = []
+    sc.ref_db = ref_db
+
+    # add background
+    sc.add_background(label=('choose', []),
+                      source_file=('choose', []),
+                      source_time=('const', 0))
+
+    # add a single foreground event to the file
+    sc.add_event(label=('choose', []),
+                 source_file=('choose', []),
+                 source_time=(source_time_dist, source_time),
+                 event_time=(event_time_dist, event_time_mean, event_time_std, event_time_min, event_time_max),
+                 event_duration=(event_duration_dist, event_duration_min, event_duration_max),
+                 snr=(snr_dist, snr_min, snr_max),
+                 pitch_shift=(pitch_dist, pitch_min, pitch_max),
+                 time_stretch=(time_stretch_dist, time_stretch_min, time_stretch_max))
+
+    # generate
+    audiofile = osp.join(outfolder, f"{n}.wav")
+    jamsfile = osp.join(outfolder, f"{n}.jams")
+    txtfile = osp.join(outfolder, f"{n}.txt")
+
+    sc.generate(audiofile, jamsfile,
+                allow_repeated_label=True,
+                allow_repeated_source=True,
+                reverb=0.1,
+                disable_sox_warnings=True,
+                no_audio=True,
+                txt_path=txtfile)
+    if fft_reverb:
+        set_desed_sandbox(jamsfile, reverb=get_reverb_params(n, ir_bank=ir_bank))
+    render_from_jams(jamsfile, audiofile, jams_outfile=jamsfile, keep_stems=keep_stems, cache=cache,
+                     engine=engine)
+    return jamsfile
+
+
+if __name__ == '__main__':
+    t = time.time()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--outfolder', type=str, default=osp.join('..', 'eval', 'soundscapes_generated_var_onset'))
+    parser.add_argument('--fgfolder', type=str, default=osp.join("..", "eval", "soundbank", "foreground_on_off"))
+    parser.add_argument('--bgfolder', type=str, default=osp.join("..", "eval", "soundbank", "background"))
+    add_generation_args(parser)
+    args = parser.parse_args()
+    manifest, cache, feature_params = setup_generation(args, osp.join(args.outfolder, "500ms"))
+
+    # General output folder, in args
+    out_folder = args.outfolder
+    create_folder(out_folder)
+
+    # Default parameters
+    n_soundscapes = args.number
+    ref_db = -50
+    duration = 10.0
+
+    # ################
+    # Varying onset of a single event
+    # ###########
+    # SCAPER SETTINGS
+    fg_folder = args.fgfolder
+    bg_folder = args.bgfolder
+
+    out_folder_500 = manifest.folder
+    # Only the soundscapes not generated yet (or with modified files)
+    pending = manifest.pending(range(n_soundscapes))
     # Generate 1000 soundscapes using a truncated normal distribution of start times
-    for n in range(n_soundscapes):
-        print('Generating soundscape: {:d}/{:d}'.format(n+1, n_soundscapes))
-        # create a scaper
-        sc = scaper.Scaper(duration, fg_folder, bg_folder)
-        sc.protected_labels = []
-        sc.ref_db = ref_db
-
-        # add background
-        sc.add_background(label=('choose', []),
-                          source_file=('choose', []),
-                          source_time=('const', 0))
-
-        # add a single foreground event to the file
-        sc.add_event(label=('choose', []),
-                     source_file=('choose', []),
-                     source_time=(source_time_dist, source_time),
-                     event_time=(event_time_dist, event_time_mean, event_time_std, event_time_min, event_time_max),
-                     event_duration=(event_duration_dist, event_duration_min, event_duration_max),
-                     snr=(snr_dist, snr_min, snr_max),
-                     pitch_shift=(pitch_dist, pitch_min, pitch_max),
-                     time_stretch=(time_stretch_dist, time_stretch_min, time_stretch_max))
-
-        # generate
-        audiofile = osp.join(out_folder_500, f"{n}.wav")
-        jamsfile = osp.join(out_folder_500, f"{n}.jams")
-        txtfile = osp.join(out_folder_500, f"{n}.txt")
-
-        sc.generate(audiofile, jamsfile,
-                    allow_repeated_label=True,
-                    allow_repeated_source=True,
-                    reverb=0.1,
-                    disable_sox_warnings=True,
-                    no_audio=False,
-                    txt_path=txtfile)
-
-    rm_high_polyphony(out_folder_500, 3)
-    out_csv = osp.join('..', 'eval', 'soundscapes_generated_var_onset',
-                                                    "500ms.csv")
-    post_processing_annotations(out_folder_500, output_folder=out_folder_500,
-                                output_csv=out_csv)
-    df = pd.read_csv(out_csv, sep="\t")
+    # The foreground and background stems are kept, the other onsets are only a shift of the foreground stem
+    list_args = [(n, out_folder_500, fg_folder, bg_folder, args.seed, duration, ref_db, True, cache, args.fft_reverb,
+                  args.ir_bank, args.engine)
+                 for n in pending]
+    print(f'Generating {len(pending)} soundscapes with {args.jobs} job(s)')
+    # The other onsets are generated in the format of the 500ms soundscapes
+    with AudioEncoder(args.audio_format, args.encode_jobs, feature_params=feature_params,
+                      manifest=manifest) as encoder:
+        map_jobs(generate_single_event_soundscape, list_args, args.jobs,
+                 callback=lambda job_args, jams_file: encoder.submit(jams_file))
+
+    out_csv = osp.join(out_folder, "500ms.csv")
+    process_generated(manifest, out_csv, 3, length_sec=duration, n_jobs=args.jobs)
     # Be careful, if changing the values of the added onset value,
     # you maybe want to rerun the post_processing_annotations to be sure there is no inconsistency
+    # The features of the other onsets are computed while they are generated
+    encoder = AudioEncoder(args.audio_format, args.encode_jobs, feature_params=feature_params)
     out_folder_5500 = osp.join(out_folder, "5500ms")
     create_folder(out_folder_5500)
-    add_onset = 5.0
-    df["onset"] += add_onset
-    df["offset"] = df["offset"].apply(lambda x: min(x, add_onset))
-    generate_new_fg_onset_files(add_onset, out_folder_500, out_folder_5500)
-    df.to_csv(osp.join('..', 'eval', 'soundscapes_generated_var_onset', "5500ms.csv"),
-              sep="\t", float_format="%.3f", index=False)
+    generate_new_fg_onset_files(5.0, out_folder_500, out_folder_5500, in_csv=out_csv,
+                                out_csv=osp.join(out_folder, "5500ms.csv"), duration=duration, n_jobs=args.jobs,
+                                encoder=encoder, cache=cache, engine=args.engine)
 
     out_folder_9500 = osp.join(out_folder, "9500ms")
     create_folder(out_folder_9500)
-    add_onset = 9.0
-    df = pd.read_csv(out_csv, sep="\t")
-    df["onset"] += add_onset
-    df["offset"] = df["offset"].apply(lambda x: min(x, add_onset))
-    generate_new_fg_onset_files(add_onset, out_folder_500, out_folder_9500)
-    df.to_csv(osp.join('..', 'eval', 'soundscapes_generated_var_onset', "9500ms.csv"),
-              sep="\t", float_format="%.3f", index=False)
+    generate_new_fg_onset_files(9.0, out_folder_500, out_folder_9500, in_csv=out_csv,
+                                out_csv=osp.join(out_folder, "9500ms.csv"), duration=duration, n_jobs=args.jobs,
+                                encoder=encoder, cache=cache, engine=args.engine)
+    encoder.close()
+    if args.features:
+        for folder, name in [(out_folder_500, "500ms"), (out_folder_5500, "5500ms"), (out_folder_9500, "9500ms")]:
+            write_labels(osp.join(folder, FEATURES_FOLDER), osp.join(out_folder, name + ".csv"))
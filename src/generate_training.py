@@ -6,25 +6,30 @@
 #########################################################################
 import time
 import argparse
-import scaper
-import numpy as np
 import os.path as osp
 import json
-from utils import choose_class, add_event, create_folder, pprint, rm_high_polyphony, post_processing_annotations
+from utils import add_generation_args, setup_generation
+from plan import get_run_plan, load_plan, render_plan
+from encoding import AudioEncoder
+from features import write_labels, FEATURES_FOLDER
+from manifest import process_generated
+
 
-            
 if __name__ == '__main__':
     t = time.time()
     parser = argparse.ArgumentParser()
     parser.add_argument('--outfolder', type=str, default=osp.join('..', 'training', 'soundscapes_generated'))
     parser.add_argument('--outcsv', type=str, default=osp.join('..', 'training', "synthetic_generated.csv"))
-    parser.add_argument('--number', type=int, default=1000)
+    parser.add_argument('--outplan', type=str, default=osp.join('..', 'training', "synthetic_generated_plan.csv"))
+    parser.add_argument('--plan', type=str, default=None,
+                        help="Render the soundscapes of an existing plan instead of sampling a new one")
+    parser.add_argument('--plan-only', action="store_true", default=False,
+                        help="Only sample and save the plan, do not generate the soundscapes")
+    add_generation_args(parser, plan=True)
     args = parser.parse_args()
-    pprint(vars(args))
-    
     # Output folder, in args
     outfolder = args.outfolder
-    create_folder(outfolder)
+    manifest, cache, feature_params = setup_generation(args, outfolder)
     out_csv = args.outcsv
 
     # SCAPER SETTINGS
@@ -41,45 +46,26 @@ if __name__ == '__main__':
     with open(param_file) as json_file:
         params = json.load(json_file)
 
-    n = 0
-    for class_lbl in params.keys():
-        class_params = params[class_lbl]
-        for i in range(int(n_soundscapes * class_params['prob'])):
-
-            print(f'Generating soundscape: {n + 1}/{n_soundscapes}')
-
-            # create a scaper
-            sc = scaper.Scaper(duration, fg_folder, bg_folder)
-            sc.protected_labels = []
-            sc.ref_db = ref_db
-
-            # add background
-            sc.add_background(label=('choose', []),
-                              source_file=('choose', []),
-                              source_time=('const', 0))
-
-            # add main event
-            sc = add_event(sc, class_lbl, duration, fg_folder)
-
-            # add random number of foreground events
-            n_events = np.random.randint(0, class_params['event_max'])
-            for _ in range(n_events):
-                chosen_class = choose_class(class_params)
-                sc = add_event(sc, chosen_class, duration, fg_folder)
+    # Sample all the events before generating the audio, a resumed run uses the plan of its first run
+    if args.plan is None:
+        df_plan = get_run_plan(manifest, args.outplan, params, n_soundscapes, fg_folder, bg_folder, duration,
+                               pitch_step=args.pitch_step)
+    else:
+        df_plan = load_plan(args.plan)
 
-            # generate
-            audiofile = osp.join(outfolder, f"{n}.wav")
-            jamsfile = osp.join(outfolder, f"{n}.jams")
-            txtfile = osp.join(outfolder, f"{n}.txt")
-            sc.generate(audiofile, jamsfile,
-                        allow_repeated_label=True,
-                        allow_repeated_source=True,
-                        reverb=0.1,
-                        disable_sox_warnings=True,
-                        no_audio=False,
-                        txt_path=txtfile)
-            n += 1
+    if not args.plan_only:
+        # Only the soundscapes not generated yet (or with modified files)
+        pending = manifest.pending(df_plan['soundscape'].unique())
+        print(f"{df_plan.soundscape.nunique() - len(pending)} soundscapes already generated in {outfolder}")
+        with AudioEncoder(args.audio_format, args.encode_jobs, feature_params=feature_params,
+                          manifest=manifest) as encoder:
+            render_plan(df_plan[df_plan['soundscape'].isin(pending)], outfolder, fg_folder, bg_folder, duration, ref_db,
+                        n_jobs=args.jobs, cache=cache, pitch_step=args.pitch_step, fft_reverb=args.fft_reverb,
+                        ir_bank=args.ir_bank, engine=args.engine, batch_size=args.batch_size, encoder=encoder)
 
-    rm_high_polyphony(outfolder, 3)
-    post_processing_annotations(outfolder, output_folder=outfolder, output_csv=out_csv)
+        # The polyphony is already checked before generating the audio, nothing should be removed here
+        # Only the soundscapes generated since the last run are processed, their annotations are added to out_csv
+        process_generated(manifest, out_csv, 3, length_sec=duration, n_jobs=args.jobs)
+        if args.features:
+            write_labels(osp.join(outfolder, FEATURES_FOLDER), out_csv)
     print(f"time of the program: {time.time() - t}")
@@ -6,60 +6,553 @@
 #########################################################################
 import time
 import argparse
-import numpy as np
 import os
 import os.path as osp
 import json
-import glob
-import soundfile as sf
-import re
-import jams
-import csv
+import shutil
+import tempfile
+import hashlib
+import pandas as pd
 
-from scaper import generate_from_jams
-from utils import create_folder, pprint
+from utils import pprint, map_jobs, is_valid_audio, read_jams, get_scaper_annotation, render_from_jams, \
+    get_desed_sandbox, md5sum
+from audio_cache import AudioCache
+from mixer import render_jams_batch
+from shards import ShardWriter, is_sharded, get_reader, open_file, file_exists, list_files
+from encoding import AudioEncoder, AUDIO_FORMATS, find_audio_file, encode_file
+from features import read_feature_params, write_labels, FEATURES_FOLDER
 
+# Name of the index of the keys of the soundscapes rendered in a folder (see get_render_key)
+RENDER_INDEX = "render_index.tsv"
+# Parameters of the scaper sandbox changing the audio of a soundscape
+RENDER_SETTINGS = ['sr', 'duration', 'original_duration', 'ref_db', 'fade_in_len', 'fade_out_len', 'reverb']
 
-def generate_files(list_jams, outfolder, fg_path=None, bg_path=None, overwrite_jams=False):
-    n = 0
+
+def get_expected_n_samples(jam_file):
+    """ Get the number of samples of the soundscape described by a JAMS file generated by scaper
+    Args:
+        jam_file: str, path of the JAMS file.
+
+    Returns:
+        int, the number of samples of the audio file generated from this JAMS.
+    """
+    sandbox = get_scaper_annotation(read_jams(jam_file))['sandbox']['scaper']
+    duration = sandbox.get('original_duration', sandbox['duration'])
+    return int(duration * sandbox.get('sr', 44100))
+
+
+def is_valid_soundscape(jam_file, audiofile):
+    """ Check if the audio file of a JAMS file exists and is valid, in any format (see encoding.py)
+    Args:
+        jam_file: str, path of the JAMS file.
+        audiofile: str, path of the wav file of the soundscape.
+
+    Returns:
+        bool, True if the file (or its compressed version) is valid.
+    """
+    sr = get_scaper_annotation(read_jams(jam_file))['sandbox']['scaper'].get('sr', 44100)
+    return is_valid_audio(find_audio_file(audiofile), get_expected_n_samples(jam_file), sr)
+
+
+class SourceHashes:
+    """ Content hashes (md5) of the source files of the soundscapes. They are kept in a file with the size and the
+    modification time of the source files, a source file is only read again when it is modified.
+
+    Args:
+        hash_file: str, optional, tab separated file in which the hashes are kept (only in memory if None).
+    """
+    def __init__(self, hash_file=None):
+        self.hash_file = hash_file
+        # {absolute path: (mtime_ns, size, md5)}
+        self.hashes = {}
+        if hash_file is not None and osp.exists(hash_file):
+            df = pd.read_csv(hash_file, sep="\t", dtype={"md5": str})
+            self.hashes = {row.filename: (row.mtime_ns, row.size, row.md5) for row in df.itertuples(index=False)}
+
+    def update(self, filenames, n_jobs=1):
+        """ Compute the hashes of the files new or modified since their hash was computed
+        Args:
+            filenames: list, paths of the files.
+            n_jobs: int, number of processes reading the files.
+
+        Returns:
+            int, the number of files read (the files missing are skipped, and their hash forgotten)
+        """
+        to_hash = {}
+        for filename in filenames:
+            key = osp.abspath(filename)
+            try:
+                stat = os.stat(key)
+            except FileNotFoundError:
+                # Removed or renamed since the JAMS has been generated
+                self.hashes.pop(key, None)
+                continue
+            if key not in to_hash and self.hashes.get(key, (None, None))[:2] != (stat.st_mtime_ns, stat.st_size):
+                to_hash[key] = (stat.st_mtime_ns, stat.st_size)
+        keys = list(to_hash)
+        for key, md5 in zip(keys, map_jobs(md5sum, [(key,) for key in keys], n_jobs)):
+            self.hashes[key] = to_hash[key] + (md5,)
+        return len(keys)
+
+    def get(self, filename):
+        """ Get the hash of a file (computed if the file is new or modified), None if the file does not exist """
+        self.update([filename])
+        return self.hashes.get(osp.abspath(filename), (None, None, None))[2]
+
+    def save(self):
+        if self.hash_file is None:
+            return
+        df = pd.DataFrame([(filename,) + values for filename, values in sorted(self.hashes.items())],
+                          columns=["filename", "mtime_ns", "size", "md5"])
+        df.to_csv(self.hash_file + ".tmp", sep="\t", index=False)
+        os.replace(self.hash_file + ".tmp", self.hash_file)
+
+
+def get_source_files(jam_file, fg_path=None, bg_path=None):
+    """ Get the source files of a JAMS file (the impulse response of its reverb included)
+    Args:
+        jam_file: str, path of the JAMS file.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+
+    Returns:
+        list, the paths of the source files, in the order of the events
+    """
+    jam_dict = read_jams(jam_file)
+    source_files = []
+    for obs in get_scaper_annotation(jam_dict)['data']:
+        # Same as scaper.generate_from_jams
+        new_path = fg_path if obs['value']['role'] == 'foreground' else bg_path
+        source_file = obs['value']['source_file']
+        if new_path is not None:
+            source_file = osp.join(new_path, osp.basename(osp.dirname(source_file)), osp.basename(source_file))
+        source_files.append(source_file)
+    reverb_params = get_desed_sandbox(jam_dict).get('reverb')
+    if reverb_params is not None and reverb_params['ir'] != 'synthetic':
+        source_files.append(reverb_params['ir'])
+    return source_files
+
+
+def get_render_key(jam_file, hashes, fg_path=None, bg_path=None, engine="scaper", audio_format="wav"):
+    """ Get the key of the soundscape of a JAMS file: a hash of everything its audio depends on, the events and the
+    settings of the JAMS, and the content of the source files (not their path, the soundbank can be moved).
+    Args:
+        jam_file: str, path of the JAMS file.
+        hashes: SourceHashes, the hashes of the source files.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+        audio_format: str, format of the audio file (see encoding.AUDIO_FORMATS).
+
+    Returns:
+        str, the key (sha1, hexadecimal)
+    """
+    jam_dict = read_jams(jam_file)
+    ann = get_scaper_annotation(jam_dict)
+    source_hashes = [hashes.get(source_file) for source_file in get_source_files(jam_file, fg_path, bg_path)]
+    events = [dict(obs['value'], source_file=source_hash) for obs, source_hash in zip(ann['data'], source_hashes)]
+    desed_sandbox = dict(get_desed_sandbox(jam_dict))
+    if len(source_hashes) > len(events):
+        desed_sandbox['reverb'] = dict(desed_sandbox['reverb'], ir=source_hashes[-1])
+    content = {'events': events,
+               'settings': {key: ann['sandbox']['scaper'].get(key) for key in RENDER_SETTINGS},
+               'desed_sandbox': desed_sandbox,
+               'engine': engine,
+               'audio_format': audio_format}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def read_render_index(folder):
+    """ Read the keys of the soundscapes rendered in a folder, {name: key} (empty if the folder has no index) """
+    index_file = osp.join(folder, RENDER_INDEX)
+    if not osp.exists(index_file):
+        return {}
+    df = pd.read_csv(index_file, sep="\t", dtype=str)
+    return dict(zip(df["name"], df["key"]))
+
+
+def update_render_index(folder, keys):
+    """ Add the keys of soundscapes rendered in a folder to its index (see get_render_key)
+    Args:
+        folder: str, the folder of the soundscapes.
+        keys: dict, {name: key}, name of the soundscapes (name of their JAMS without extension) and their key.
+
+    Returns:
+        None
+    """
+    index = read_render_index(folder)
+    index.update(keys)
+    df = pd.DataFrame(sorted(index.items()), columns=["name", "key"])
+    tmp_file = osp.join(folder, RENDER_INDEX + ".tmp")
+    df.to_csv(tmp_file, sep="\t", index=False)
+    os.replace(tmp_file, osp.join(folder, RENDER_INDEX))
+
+
+def _is_rendered(jam_file, outfolder, sharded):
+    """ Check if the audio file of a JAMS file is in outfolder (and valid for a flat folder) """
+    audiofile = osp.join(outfolder, osp.splitext(osp.basename(jam_file))[0] + ".wav")
+    return file_exists(find_audio_file(audiofile)) if sharded else is_valid_soundscape(jam_file, audiofile)
+
+
+def select_changed(list_jams, outfolder, hashes, fg_path=None, bg_path=None, engine="scaper", audio_format="wav",
+                   n_jobs=1):
+    """ Select the soundscapes to render again (content-addressed rebuild): the key of their JAMS (see get_render_key)
+    is not the one of their last rendering in outfolder, or their audio file is missing.
+    If outfolder has no index yet (first incremental rendering), the soundscapes already rendered (valid audio file)
+    are assumed to be up to date: they are added to the index instead of being rendered again.
+    Args:
+        list_jams: list, paths of the JAMS files.
+        outfolder: str, folder of the audio files (flat or sharded folder).
+        hashes: SourceHashes, the hashes of the source files, the new source files are hashed.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+        audio_format: str, format of the audio files (see encoding.AUDIO_FORMATS).
+        n_jobs: int, number of processes reading the new source files.
+
+    Returns:
+        list, [(jam_file, reason), ...] the soundscapes to render, reason is "new" (never rendered), "changed"
+        (events, settings or source files changed), "missing" (no valid audio file) or "missing_source" (a source
+        file does not exist anymore, the soundscape cannot be rendered)
+    """
+    source_files = {jam_file: get_source_files(jam_file, fg_path, bg_path) for jam_file in list_jams}
+    hashes.update(set(source_file for sources in source_files.values() for source_file in sources), n_jobs)
+    missing_sources = {jam_file for jam_file, sources in source_files.items()
+                       if any(osp.abspath(source_file) not in hashes.hashes for source_file in sources)}
+    sharded = is_sharded(outfolder)
+    if not osp.exists(osp.join(outfolder, RENDER_INDEX)):
+        index_rendered([jam_file for jam_file in list_jams
+                        if jam_file not in missing_sources and _is_rendered(jam_file, outfolder, sharded)],
+                       outfolder, hashes, fg_path, bg_path, engine, audio_format)
+    index = read_render_index(outfolder)
+    changed = []
     for jam_file in list_jams:
-        audiofile = osp.join(outfolder, f"{osp.splitext(osp.basename(jam_file))[0]}.wav")
-        if overwrite_jams:
-            jams_outfile = jam_file
-        else:
-            jams_outfile = None
-        generate_from_jams(jam_file, audiofile, fg_path=fg_path, bg_path=bg_path, jams_outfile=jams_outfile)
+        name = osp.splitext(osp.basename(jam_file))[0]
+        if jam_file in missing_sources:
+            changed.append((jam_file, "missing_source"))
+        elif name not in index:
+            changed.append((jam_file, "new"))
+        elif get_render_key(jam_file, hashes, fg_path, bg_path, engine, audio_format) != index[name]:
+            changed.append((jam_file, "changed"))
+        elif not _is_rendered(jam_file, outfolder, sharded):
+            changed.append((jam_file, "missing"))
+    return changed
 
-        n += 1
-        if n % 500 == 0:
-            print(f"generating {n} / {len(list_jams)} files")
-    print("Done")
+
+def index_rendered(list_jams, outfolder, hashes, fg_path=None, bg_path=None, engine="scaper", audio_format="wav"):
+    """ Add the soundscapes rendered in outfolder to its index, their key is computed with the JAMS of outfolder
+    (the JAMS written with the rendering, see overwrite_jams).
+    Args:
+        list_jams: list, paths of the JAMS files rendered (of any folder, only their name is used).
+        (see select_changed for the other arguments)
+
+    Returns:
+        None
+    """
+    keys = {}
+    for jam_file in list_jams:
+        name = osp.splitext(osp.basename(jam_file))[0]
+        keys[name] = get_render_key(osp.join(outfolder, name + ".jams"), hashes, fg_path, bg_path, engine,
+                                    audio_format)
+    update_render_index(outfolder, keys)
+
+
+def generate_file(jam_file, outfolder, fg_path=None, bg_path=None, overwrite_jams=False, skip_valid=False, cache=None,
+                  engine="scaper"):
+    """ Generate the audio file associated with a JAMS file
+    Args:
+        jam_file: str, path of the JAMS file.
+        outfolder: str, folder in which to save the audio file.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        overwrite_jams: bool, whether to overwrite the JAMS with the new paths of the soundbank.
+        skip_valid: bool, do not regenerate the audio file if it already exists and is valid.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+
+    Returns:
+        bool, True if the file has been generated, False if it has been skipped.
+    """
+    audiofile = osp.join(outfolder, f"{osp.splitext(osp.basename(jam_file))[0]}.wav")
+    if skip_valid and is_valid_soundscape(jam_file, audiofile):
+        return False
+    if overwrite_jams:
+        jams_outfile = jam_file
+    else:
+        jams_outfile = None
+    render_from_jams(jam_file, audiofile, fg_path=fg_path, bg_path=bg_path, jams_outfile=jams_outfile, cache=cache,
+                     engine=engine)
+    return True
+
+
+def generate_block(list_jams, outfolder, fg_path=None, bg_path=None, overwrite_jams=False, skip_valid=False,
+                   cache=None):
+    """ Generate the audio files associated with a block of JAMS files in a single batch, in python
+    (see mixer.render_jams_batch)
+    Args:
+        list_jams: list, paths of the JAMS files (same duration).
+        outfolder: str, folder in which to save the audio files.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        overwrite_jams: bool, whether to overwrite the JAMS with the new paths of the soundbank.
+        skip_valid: bool, do not regenerate the audio files already existing and valid.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+
+    Returns:
+        list, for each JAMS file, True if the file has been generated, False if it has been skipped.
+    """
+    audio_files = [osp.join(outfolder, f"{osp.splitext(osp.basename(jam_file))[0]}.wav") for jam_file in list_jams]
+    generated = [not (skip_valid and is_valid_soundscape(jam_file, audiofile))
+                 for jam_file, audiofile in zip(list_jams, audio_files)]
+    to_generate = [cnt for cnt, gen in enumerate(generated) if gen]
+    if len(to_generate) > 0:
+        list_jams = [list_jams[cnt] for cnt in to_generate]
+        render_jams_batch(list_jams, [audio_files[cnt] for cnt in to_generate], fg_path=fg_path, bg_path=bg_path,
+                          jams_outfiles=list_jams if overwrite_jams else None, cache=cache)
+    return generated
+
+
+def generate_files(list_jams, outfolder, fg_path=None, bg_path=None, overwrite_jams=False, n_jobs=1,
+                   skip_valid=False, cache=None, engine="scaper", batch_size=1, encoder=None):
+    """ Generate the audio files associated with a list of JAMS files
+    Args:
+        list_jams: list, paths of the JAMS files.
+        outfolder: str, folder in which to save the audio files.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        overwrite_jams: bool, whether to overwrite the JAMS with the new paths of the soundbank.
+        n_jobs: int, number of processes to use.
+        skip_valid: bool, do not regenerate the audio files already existing and valid (resume a generation).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+        batch_size: int, number of files generated in a single batch by each job (see generate_block),
+            only with the "numpy" engine.
+        encoder: encoding.AudioEncoder, optional, encodes the files generated while the next ones are generated.
+
+    Returns:
+        None
+    """
+    list_args = [(jam_file, outfolder, fg_path, bg_path, overwrite_jams, skip_valid, cache, engine)
+                 for jam_file in list_jams]
+    generate_all_files(list_args, n_jobs, batch_size, encoder)
+
+
+def generate_file_content(jam_file, fg_path=None, bg_path=None, overwrite_jams=False, cache=None, engine="scaper",
+                          audio_format="wav"):
+    """ Generate the audio file associated with a JAMS file (of a flat or a sharded folder, see shards.py) in a
+    temporary folder, and get the files of the soundscape (audio, JAMS and txt if any).
+    Args:
+        jam_file: str, path of the JAMS file.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        overwrite_jams: bool, whether the JAMS returned has the new paths of the soundbank.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+        audio_format: str, format of the audio file (see encoding.AUDIO_FORMATS).
+
+    Returns:
+        dict, {name: bytes} the files of the soundscape
+    """
+    name = osp.splitext(osp.basename(jam_file))[0]
+    files = {}
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        tmp_jams = osp.join(tmp_folder, name + ".jams")
+        with open_file(jam_file) as f, open(tmp_jams, "wb") as out:
+            shutil.copyfileobj(f, out)
+        audiofile = osp.join(tmp_folder, name + ".wav")
+        render_from_jams(tmp_jams, audiofile, fg_path=fg_path, bg_path=bg_path,
+                         jams_outfile=tmp_jams if overwrite_jams else None, cache=cache, engine=engine)
+        audiofile = encode_file(audiofile, audio_format)
+        for filename in [audiofile, tmp_jams]:
+            with open(filename, "rb") as f:
+                files[osp.basename(filename)] = f.read()
+    txt_file = osp.splitext(jam_file)[0] + ".txt"
+    if file_exists(txt_file):
+        with open_file(txt_file) as f:
+            files[name + ".txt"] = f.read()
+    return files
+
+
+def generate_files_sharded(list_jams, outfolder, fg_path=None, bg_path=None, overwrite_jams=False, n_jobs=1,
+                           skip_valid=False, cache=None, engine="scaper", shard_size=1e9, block_size=256,
+                           audio_format="wav"):
+    """ Generate the audio files associated with a list of JAMS files in a sharded folder (see shards.py):
+    the audio, JAMS and txt files of each soundscape are written in the same shard.
+    Args:
+        list_jams: list, paths of the JAMS files (of a flat or a sharded folder).
+        outfolder: str, the sharded folder in which to write the files (can be the folder of the JAMS files).
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        overwrite_jams: bool, whether to write the JAMS with the new paths of the soundbank.
+        n_jobs: int, number of processes to use.
+        skip_valid: bool, do not regenerate the audio files already in outfolder (resume a generation).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+        shard_size: float, size (bytes) after which a new shard is started.
+        block_size: int, the index is updated every block_size files (a generation interrupted resumes from there).
+        audio_format: str, format of the audio files (see encoding.AUDIO_FORMATS), encoded by the jobs.
+
+    Returns:
+        None
+    """
+    if skip_valid and is_sharded(outfolder):
+        reader = get_reader(outfolder)
+        n_jams = len(list_jams)
+        extension = AUDIO_FORMATS[audio_format][1]
+        list_jams = [jam_file for jam_file in list_jams
+                     if f"{osp.splitext(osp.basename(jam_file))[0]}{extension}" not in reader]
+        print(f"{n_jams - len(list_jams)} valid files skipped")
+    with ShardWriter(outfolder, shard_size) as writer:
+        for cnt in range(0, len(list_jams), block_size):
+            list_args = [(jam_file, fg_path, bg_path, overwrite_jams, cache, engine, audio_format)
+                         for jam_file in list_jams[cnt:cnt + block_size]]
+            for files in map_jobs(generate_file_content, list_args, n_jobs):
+                writer.write(files)
+            writer.flush()
+            print(f"{min(cnt + block_size, len(list_jams))} / {len(list_jams)} files generated in {outfolder}")
+
+
+def generate_all_files(list_args, n_jobs=1, batch_size=1, encoder=None):
+    """ Generate the audio files of multiple folders in the same pool of processes
+    Args:
+        list_args: list of tuples, the arguments of generate_file for each JAMS file.
+        n_jobs: int, number of processes to use.
+        batch_size: int, number of files generated in a single batch by each job (see generate_block),
+            only with the "numpy" engine.
+        encoder: encoding.AudioEncoder, optional, encodes the files generated while the next ones are generated.
+
+    Returns:
+        None
+    """
+    if batch_size > 1:
+        if any(args[-1] != "numpy" for args in list_args):
+            raise ValueError("Only the numpy engine generates the soundscapes by batch")
+        # The files of a block share all the other arguments (same folder)
+        list_blocks = []
+        for args in list_args:
+            if len(list_blocks) == 0 or list_blocks[-1][1:] != args[1:-1] or len(list_blocks[-1][0]) == batch_size:
+                list_blocks.append(([],) + tuple(args[1:-1]))
+            list_blocks[-1][0].append(args[0])
+        if encoder is None:
+            callback = None
+        else:
+            def callback(block, block_generated):
+                for jam_file, gen in zip(block[0], block_generated):
+                    if gen:
+                        encoder.submit(osp.join(block[1], osp.basename(jam_file)))
+        generated = [gen for block in map_jobs(generate_block, list_blocks, n_jobs, print_every=50, callback=callback)
+                     for gen in block]
+    else:
+        if encoder is None:
+            callback = None
+        else:
+            def callback(args, gen):
+                if gen:
+                    encoder.submit(osp.join(args[1], osp.basename(args[0])))
+        generated = map_jobs(generate_file, list_args, n_jobs, print_every=500, callback=callback)
+    print(f"Done, {sum(generated)} files generated, {len(generated) - sum(generated)} valid files skipped")
 
 
 if __name__ == '__main__':
     t = time.time()
     parser = argparse.ArgumentParser()
     parser.add_argument('--overwrite-jams', action="store_true", default=False)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--resume', action="store_true", default=False,
+                        help="Do not regenerate the audio files already existing and valid")
+    parser.add_argument('--engine', type=str, default="scaper", choices=["scaper", "numpy"],
+                        help="Generate the audio with scaper (sox) or in python (see mixer.py)")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="With --engine numpy, number of files generated in a single batch by each job")
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help="Folder of the cache of decoded source files, shared by the jobs (no cache if not given)")
+    parser.add_argument('--cache-size', type=float, default=20,
+                        help="Maximum size of the cache in GB, the least recently used files are deleted")
+    parser.add_argument('--shard-folder', type=str, default=None,
+                        help="Write the soundscapes in tar shards with an index (see shards.py), in this folder "
+                             "(same subfolders as ..). The sharded folders of JAMS are always generated in place")
+    parser.add_argument('--shard-size', type=float, default=1,
+                        help="Size of the shards in GB")
+    parser.add_argument('--audio-format', type=str, default="wav", choices=list(AUDIO_FORMATS),
+                        help="Format of the audio files, the compressed formats are encoded during the generation")
+    parser.add_argument('--encode-jobs', type=int, default=2,
+                        help="Number of threads encoding the audio files (with --audio-format flac or opus)")
+    parser.add_argument('--features', action="store_true", default=False,
+                        help="Compute the log-mel features of the soundscapes during the generation (see features.py)")
+    parser.add_argument('--feature-params', type=str, default=None,
+                        help="json file of the parameters of the features (default: features.FEATURE_PARAMS)")
+    parser.add_argument('--incremental', action="store_true", default=False,
+                        help="Only render the soundscapes whose events or source files changed since their last "
+                             "rendering (a hash of the JAMS and of the content of the sources is kept in each folder)")
+    parser.add_argument('--hash-file', type=str, default=osp.join('..', 'source_hashes.tsv'),
+                        help="With --incremental, file keeping the hashes of the source files")
+    parser.add_argument('--report', type=str, default=None,
+                        help="With --incremental, tab separated file listing the soundscapes rendered and why")
     args = parser.parse_args()
     pprint(vars(args))
-    
+    cache = AudioCache(args.cache_dir, args.cache_size * 1e9) if args.cache_dir is not None else None
+    feature_params = read_feature_params(args.feature_params) if args.features else None
+
     # Training
     train_folder = osp.join('..', 'training', 'soundscapes')
-    list_jams = glob.glob(osp.join(train_folder, "*.jams"))
     fg_path_train = osp.join("..", "training", "soundbank", "foreground")
     bg_path_train = osp.join("..", "training", "soundbank", "background")
-    generate_files(list_jams, train_folder, fg_path=fg_path_train, bg_path=bg_path_train, 
-                   overwrite_jams=args.overwrite_jams)
-    
+    subsets = [(train_folder, fg_path_train, bg_path_train)]
+
     # Eval
     # In the evaluation part, there multiple subsets which allows to check robustness of systems
     eval_folder = osp.join('..', 'eval', 'soundscapes')
     list_folders = [osp.join(eval_folder, dI) for dI in os.listdir(eval_folder) if osp.isdir(osp.join(eval_folder, dI))]
     fg_path_eval = osp.join("..", "eval", "soundbank", "foreground")
     bg_path_eval = osp.join("..", "eval", "soundbank", "background")
-    
-    for folder in list_folders:
+
+    subsets += [(folder, fg_path_eval, bg_path_eval) for folder in list_folders]
+
+    # The soundscapes selected by --incremental are rendered again even if their audio file is valid
+    skip_valid = args.resume and not args.incremental
+    hashes = SourceHashes(args.hash_file) if args.incremental else None
+    # [(jam_file, reason)], and the soundscapes of the flat folders to add to the index of their folder
+    report, flat_rendered = [], []
+    # All the flat folders (training and eval) are generated in the same pool of processes
+    list_args = []
+    for folder, fg_path, bg_path in subsets:
         print(folder)
-        list_jams = glob.glob(osp.join(folder, "*.jams"))
-        generate_files(list_jams, folder, fg_path=fg_path_eval, bg_path=bg_path_eval, 
-                       overwrite_jams=args.overwrite_jams)
+        list_jams = list_files(folder, ".jams")
+        sharded = args.shard_folder is not None or is_sharded(folder)
+        out_folder = folder if args.shard_folder is None else osp.join(args.shard_folder, osp.relpath(folder, ".."))
+        if args.incremental:
+            changed = select_changed(list_jams, out_folder if sharded else folder, hashes, fg_path, bg_path,
+                                     args.engine, args.audio_format, args.jobs)
+            counts = {reason: sum(r == reason for _, r in changed)
+                      for reason in ["new", "changed", "missing", "missing_source"]}
+            print(f"{len(changed)} / {len(list_jams)} soundscapes to render in {folder} {counts}")
+            report += changed
+            list_jams = [jam_file for jam_file, reason in changed if reason != "missing_source"]
+        if sharded:
+            generate_files_sharded(list_jams, out_folder, fg_path, bg_path, args.overwrite_jams, args.jobs, skip_valid,
+                                   cache, args.engine, args.shard_size * 1e9, audio_format=args.audio_format)
+            if args.incremental:
+                index_rendered(list_jams, out_folder, hashes, fg_path, bg_path, args.engine, args.audio_format)
+        else:
+            list_args += [(jam_file, folder, fg_path, bg_path, args.overwrite_jams, skip_valid, cache, args.engine)
+                          for jam_file in list_jams]
+            flat_rendered.append((list_jams, folder, fg_path, bg_path))
+
+    with AudioEncoder(args.audio_format, args.encode_jobs, feature_params=feature_params) as encoder:
+        generate_all_files(list_args, args.jobs, args.batch_size, encoder)
+    if args.incremental:
+        for list_jams, folder, fg_path, bg_path in flat_rendered:
+            index_rendered(list_jams, folder, hashes, fg_path, bg_path, args.engine, args.audio_format)
+        hashes.save()
+        for jam_file, reason in report:
+            if reason == "changed":
+                print(f"{jam_file} rendered again, its events or source files changed")
+            elif reason == "missing_source":
+                print(f"{jam_file} not rendered, one of its source files does not exist")
+        if args.report is not None:
+            pd.DataFrame(report, columns=["jams", "reason"]).to_csv(args.report, sep="\t", index=False)
+    if args.features:
+        # The frame-level labels come from the txt files of the soundscapes
+        for folder in sorted(set(job_args[1] for job_args in list_args)):
+            write_labels(osp.join(folder, FEATURES_FOLDER))
+    print(f"time of the program: {time.time() - t}")
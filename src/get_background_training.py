@@ -7,54 +7,189 @@
 import time
 import argparse
 import pandas as pd
-import glob
 import os
 import shutil
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 import zipfile
-import io
 
-from utils import create_folder, pprint
+from utils import create_folder, pprint, md5sum
+
+ZENODO_RECORD = "https://zenodo.org/api/records/1247102"
+META_URL = "https://zenodo.org/record/1247102/files/DCASE2018-task5-dev.meta.zip?download=1"
+AUDIO_URLS = [f"https://zenodo.org/record/1247102/files/DCASE2018-task5-dev.audio.{i}.zip?download=1"
+              for i in range(1, 24)]
+
+
+def get_zenodo_checksums(record_url=ZENODO_RECORD):
+    """ Get the md5 checksums of the files of a zenodo record
+    Args:
+        record_url: str, url of the record in the zenodo API.
+
+    Returns:
+        dict, {filename: md5}, empty if the checksums cannot be downloaded (the files are then not checked)
+    """
+    try:
+        r = requests.get(record_url, timeout=30)
+        r.raise_for_status()
+        files = r.json()["files"]
+        return {f["key"]: f["checksum"].split(":")[-1] for f in files if f["checksum"].startswith("md5:")}
+    except (requests.RequestException, ValueError, KeyError) as e:
+        warnings.warn(f"Cannot get the checksums of {record_url}, the downloads are not checked: {e}")
+        return {}
+
+
+def get_url_filename(url):
+    """ Get the name of the file of an url (without the query) """
+    return os.path.basename(url.split("?")[0])
+
+
+def is_valid_download(filename, md5=None):
+    """ Check that a file has been downloaded (and has the md5 checksum given) """
+    return os.path.exists(filename) and (md5 is None or md5sum(filename) == md5)
+
+
+def download_file(url, outfile, md5=None, chunk_size=1 << 20, retries=1):
+    """ Download a file by chunks, directly to the disk. An interrupted download is resumed: the bytes already
+    downloaded are in outfile + ".part", only the rest is asked to the server (if it accepts range requests).
+
+    Args:
+        url: str, url of the file.
+        outfile: str, path of the file to write.
+        md5: str, optional, the md5 checksum of the file, the file is downloaded again if it does not match.
+        chunk_size: int, number of bytes written at once.
+        retries: int, number of times the whole file is downloaded again if the checksum does not match.
+
+    Returns:
+        str, the path of the file downloaded
+    """
+    if is_valid_download(outfile, md5):
+        return outfile
+    part_file = outfile + ".part"
+    for _ in range(retries + 1):
+        n_bytes = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+        headers = {"Range": f"bytes={n_bytes}-"} if n_bytes > 0 else {}
+        with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+            # 416: the part file is already complete, nothing left to download
+            if r.status_code != 416:
+                r.raise_for_status()
+                # The server does not accept range requests: the whole file is sent
+                mode = "ab" if r.status_code == 206 else "wb"
+                with open(part_file, mode) as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+        if md5 is None or md5sum(part_file) == md5:
+            os.replace(part_file, outfile)
+            return outfile
+        os.remove(part_file)
+    raise IOError(f"The checksum of {outfile} downloaded from {url} is not {md5}")
+
+
+def extract_members(zip_file, filenames, destination_folder):
+    """ Extract the members of a zip file having given names, in a folder (without the folders of the zip)
+    Args:
+        zip_file: str, path of the zip file.
+        filenames: set, the names (without folders) of the members to extract.
+        destination_folder: str, folder in which to extract the members.
+
+    Returns:
+        list, the paths of the files extracted
+    """
+    extracted = []
+    with zipfile.ZipFile(zip_file) as z:
+        for member in z.infolist():
+            filename = os.path.basename(member.filename)
+            if member.is_dir() or filename not in filenames:
+                continue
+            outfile = os.path.join(destination_folder, filename)
+            if not os.path.exists(outfile) or os.path.getsize(outfile) != member.file_size:
+                with z.open(member) as source, open(outfile + ".tmp", "wb") as dest:
+                    shutil.copyfileobj(source, dest)
+                os.replace(outfile + ".tmp", outfile)
+            extracted.append(outfile)
+    return extracted
+
+
+def download_and_extract(url, download_folder, filenames, destination_folder, md5=None, keep_zip=False):
+    """ Download a zip file and extract some of its members (see download_file and extract_members)
+    Args:
+        url: str, url of the zip file.
+        download_folder: str, folder in which to download the zip file.
+        filenames: set, the names (without folders) of the members to extract.
+        destination_folder: str, folder in which to extract the members.
+        md5: str, optional, the md5 checksum of the zip file.
+        keep_zip: bool, whether to keep the zip file after the extraction.
+
+    Returns:
+        list, the paths of the files extracted
+    """
+    zip_file = download_file(url, os.path.join(download_folder, get_url_filename(url)), md5)
+    extracted = extract_members(zip_file, filenames, destination_folder)
+    if not keep_zip:
+        os.remove(zip_file)
+    return extracted
+
+
+def get_background_training(destination_folder, meta_url=META_URL, audio_urls=None, checksums=None, n_jobs=3,
+                            keep_zips=False, label="other"):
+    """ Download the background files of the training soundbank: the SINS files labelled "other"
+    Args:
+        destination_folder: str, the soundbank folder, the files are saved in destination_folder/background/sins.
+        meta_url: str, url of the zip containing meta.txt (list of the files and their label).
+        audio_urls: list, urls of the zip files of audio, AUDIO_URLS by default.
+        checksums: dict, optional, {filename: md5} of the zip files (see get_zenodo_checksums).
+        n_jobs: int, number of concurrent downloads.
+        keep_zips: bool, whether to keep the zip files (in destination_folder/DCASE2018-task5-dev).
+        label: str, label of the files to keep.
+
+    Returns:
+        list, the paths of the files extracted
+    """
+    if audio_urls is None:
+        audio_urls = AUDIO_URLS
+    if checksums is None:
+        checksums = {}
+    download_folder = os.path.join(destination_folder, "DCASE2018-task5-dev")
+    final_path = os.path.join(destination_folder, "background", "sins")
+    create_folder(download_folder)
+    create_folder(final_path)
+
+    meta_zip = download_file(meta_url, os.path.join(download_folder, get_url_filename(meta_url)),
+                             checksums.get(get_url_filename(meta_url)))
+    with zipfile.ZipFile(meta_zip) as z:
+        meta_member = [name for name in z.namelist() if os.path.basename(name) == "meta.txt"][0]
+        with z.open(meta_member) as f:
+            df = pd.read_csv(f, sep="\t", header=None)
+    filenames = set(df.loc[df[1] == label, 0].apply(os.path.basename))
+    print(f"{len(filenames)} files labelled {label} in {len(audio_urls)} zip files")
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(download_and_extract, url, download_folder, filenames, final_path,
+                                   checksums.get(get_url_filename(url)), keep_zips)
+                   for url in audio_urls]
+        extracted = []
+        for cnt, future in enumerate(futures):
+            extracted += future.result()
+            print(f"zip {cnt + 1} / {len(audio_urls)} done")
+    if not keep_zips:
+        shutil.rmtree(download_folder)
+    return extracted
+
 
 if __name__ == '__main__':
     t = time.time()
     parser = argparse.ArgumentParser()
-    parser.add_argument('--keep-sins', action="store_true", default=False)
+    parser.add_argument('--keep-sins', action="store_true", default=False,
+                        help="Keep the zip files of SINS (all the files) after the extraction")
+    parser.add_argument('--jobs', type=int, default=3, help="Number of concurrent downloads")
+    parser.add_argument('--no-checksum', action="store_true", default=False,
+                        help="Do not check the md5 checksums of the files downloaded")
     args = parser.parse_args()
     pprint(vars(args))
-    
-    zip_file_url_meta = "https://zenodo.org/record/1247102/files/DCASE2018-task5-dev.meta.zip?download=1"
+
     destination_folder = os.path.join("..", "training", "soundbank")
-    r = requests.get(zip_file_url_meta)
-    z = zipfile.ZipFile(io.BytesIO(r.content))
-    z.extractall(destination_folder)
-    
-    extract_path = os.path.join(destination_folder, "DCASE2018-task5-dev")
-    final_path = os.path.join(destination_folder, "background", "sins")
-    create_folder(final_path)
-    df = pd.read_csv(os.path.join(extract_path, "meta.txt"), sep="\t", header=None)
-    df["filename"] = df[0].apply(lambda x: os.path.basename(x))
-    df = df[df[1] == "other"]
-    
-    for i in range(1, 24):
-        print(f"downloading zip {i} / 23 ...")
-        # Download the first zip, and keep only other
-        zip_file_url = f"https://zenodo.org/record/1247102/files/DCASE2018-task5-dev.audio.{i}.zip?download=1"
-        r = requests.get(zip_file_url)
-        z = zipfile.ZipFile(io.BytesIO(r.content))
-        z.extractall(destination_folder)
-    
-        df_files = pd.DataFrame(glob.glob(os.path.join(extract_path, "audio", "*")), 
-                                          columns=["filename"])
-        df_files["filename"] = df_files.filename.apply(lambda x: os.path.basename(x))
-    
-        merged = df.merge(df_files, on='filename')
-        merged.apply(lambda x: shutil.copy(os.path.join(extract_path, x[0]), os.path.join(final_path, x["filename"])), 
-                     axis=1)
-    
-        if not args.keep_sins:
-            shutil.rmtree(os.path.join(extract_path, "audio"))
-    if not args.keep_sins:
-        shutil.rmtree(extract_path)
+    checksums = {} if args.no_checksum else get_zenodo_checksums()
+    get_background_training(destination_folder, checksums=checksums, n_jobs=args.jobs, keep_zips=args.keep_sins)
     print(f"time of the program: {time.time() - t}")
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+""" Manifest of a generation run, so an interrupted generation can be resumed.
+The manifest is a tab separated file in the output folder, only appended: one line per change of status of a
+soundscape (index, status, seed of the run, md5 checksums of its files, time). The last line of an index gives its
+status:
+- generated: the files of the soundscape are written (and encoded, see encoding.AudioEncoder)
+- rejected: no instantiation had a polyphony low enough (utils.generate_max_polyphony), there is no file
+- removed: removed by the polyphony filter (utils.rm_high_polyphony)
+- post_processed: its annotations are post-processed (utils.post_processing_annotations) and in the csv file
+A restarted generation only generates the soundscapes without status, or whose files do not have their checksums.
+"""
+import os
+import os.path as osp
+import json
+import time
+import threading
+
+from utils import md5sum, rm_high_polyphony, post_processing_annotations, read_annotations, AnnotationWriter
+from shards import list_soundscape_files, file_exists, is_sharded
+
+MANIFEST_FILENAME = "run_manifest.tsv"
+MANIFEST_COLUMNS = ["index", "status", "seed", "checksums", "time"]
+STATUSES = ["generated", "rejected", "removed", "post_processed"]
+
+
+def get_soundscape_index(filename):
+    """ Get the index of a soundscape from the name of one of its files (ex: folder/7.jams -> 7) """
+    return int(osp.splitext(osp.basename(filename))[0])
+
+
+def get_run_seed(folder, filename=MANIFEST_FILENAME):
+    """ Get the seed of the run of a folder, None if it has no manifest (or an empty one) """
+    manifest_file = osp.join(folder, filename)
+    if not osp.exists(manifest_file):
+        return None
+    records = _read_records(manifest_file)
+    return records[0]["seed"] if records else None
+
+
+def _read_records(manifest_file):
+    """ Read the lines of a manifest, a line not completely written (interrupted run) is ignored """
+    records = []
+    with open(manifest_file) as f:
+        lines = f.read().split("\n")
+    for line in lines[1:]:
+        fields = line.split("\t")
+        if len(fields) != len(MANIFEST_COLUMNS) or fields[1] not in STATUSES:
+            continue
+        try:
+            records.append({"index": int(fields[0]), "status": fields[1], "seed": int(fields[2]),
+                            "checksums": json.loads(fields[3]), "time": float(fields[4])})
+        except ValueError:
+            continue
+    return records
+
+
+class RunManifest:
+    """ Append-only manifest of the soundscapes of an output folder (see the statuses above), flat or sharded
+    (see shards.py, the manifest itself is a file of the folder, not in the shards).
+    Args:
+        folder: str, the output folder of the soundscapes.
+        seed: int, seed of the run, saved with each record: the plan-based scripts sample the whole plan with
+            np.random.RandomState(seed) (see plan.get_run_plan), a resumed run must use the same seed.
+        restart: bool, whether to start a new run, the existing manifest is removed.
+        filename: str, name of the manifest in the folder.
+    """
+    def __init__(self, folder, seed, restart=False, filename=MANIFEST_FILENAME):
+        self.folder = folder
+        self.seed = seed
+        self.manifest_file = osp.join(folder, filename)
+        self.lock = threading.Lock()
+        if restart and osp.exists(self.manifest_file):
+            os.remove(self.manifest_file)
+        self.records = {}
+        if osp.exists(self.manifest_file):
+            for record in _read_records(self.manifest_file):
+                if record["seed"] != seed:
+                    raise ValueError(f"The run of {folder} used the seed {record['seed']}, not {seed}, "
+                                     f"resume it with the same seed or restart it")
+                self.records[record["index"]] = record
+        else:
+            os.makedirs(folder, exist_ok=True)
+            with open(self.manifest_file, "w") as f:
+                f.write("\t".join(MANIFEST_COLUMNS) + "\n")
+
+    def record(self, index, status, files=()):
+        """ Append the new status of a soundscape to the manifest
+        Args:
+            index: int, index of the soundscape.
+            status: str, the status (see STATUSES).
+            files: list, the files of the soundscape, their checksums are saved.
+
+        Returns:
+            dict, the record
+        """
+        checksums = {osp.basename(filename): md5sum(filename) for filename in sorted(files)}
+        record = {"index": int(index), "status": status, "seed": self.seed, "checksums": checksums,
+                  "time": round(time.time(), 3)}
+        with self.lock:
+            # A whole line per write, an interrupted run leaves at most one partial line
+            with open(self.manifest_file, "a") as f:
+                f.write("\t".join([str(record["index"]), status, str(self.seed), json.dumps(checksums),
+                                   str(record["time"])]) + "\n")
+            self.records[record["index"]] = record
+        return record
+
+    def add_soundscape(self, filename):
+        """ Record a soundscape generated, from any of its files (ex: its JAMS file)
+        Returns:
+            dict, the record, the status is "rejected" if the soundscape has no file
+        """
+        files = [f for f in list_soundscape_files(filename) if file_exists(f)]
+        return self.record(get_soundscape_index(filename), "generated" if files else "rejected", files)
+
+    def status(self, index):
+        """ Get the status of a soundscape, None if it has no status """
+        record = self.records.get(index)
+        return None if record is None else record["status"]
+
+    def indexes(self, status):
+        """ Get the indexes of the soundscapes having a status, sorted """
+        return sorted(index for index, record in self.records.items() if record["status"] == status)
+
+    def is_complete(self, index):
+        """ Check if a soundscape does not have to be generated again: rejected or removed, or all its files have
+        the checksums of the manifest (the files of a flat folder are not read again if their modification time is
+        older than the record, the files of a sharded folder are always read) """
+        record = self.records.get(index)
+        if record is None:
+            return False
+        sharded = is_sharded(self.folder)
+        for name, checksum in record["checksums"].items():
+            filename = osp.join(self.folder, name)
+            if not file_exists(filename):
+                return False
+            if (sharded or osp.getmtime(filename) > record["time"]) and md5sum(filename) != checksum:
+                return False
+        return True
+
+    def pending(self, indexes):
+        """ Get the soundscapes of indexes to generate (not complete, see is_complete) """
+        return [index for index in indexes if not self.is_complete(index)]
+
+
+def _drop_annotations(annotation_file, indexes):
+    """ Remove the annotations of soundscapes from an annotation file (see utils.AnnotationWriter), written again
+    atomically if some are removed
+    Args:
+        annotation_file: str, the annotation file (tab separated csv or parquet file).
+        indexes: list, the indexes of the soundscapes.
+
+    Returns:
+        int, the number of annotations removed
+    """
+    df = read_annotations(annotation_file)
+    dropped = df["filename"].apply(get_soundscape_index).isin(indexes)
+    if dropped.any():
+        # Same extension, the format of the file depends on it
+        tmp_file = "{}.tmp{}".format(*osp.splitext(annotation_file))
+        with AnnotationWriter(tmp_file, {'filename': str, 'onset': float, 'offset': float, 'event_label': str},
+                              float_format="%.3f") as writer:
+            writer.write(df[~dropped])
+        os.replace(tmp_file, annotation_file)
+    return int(dropped.sum())
+
+
+def process_generated(manifest, output_csv=None, max_polyphony=3, length_sec=None, n_jobs=1):
+    """ Run the polyphony filter and the post-processing of the annotations on the soundscapes generated since the
+    last time (status "generated"), the annotations are added to output_csv (written again if no soundscape is
+    post-processed yet). It can be called while the generation is running, on the soundscapes finished so far.
+
+    Args:
+        manifest: RunManifest, the manifest of the folder of the soundscapes.
+        output_csv: str, optional, csv with all the annotations concatenated (see utils.post_processing_annotations).
+        max_polyphony: int, the soundscapes having a polyphony >= max_polyphony are removed.
+        length_sec: float, optional in sec, fixed length of all the files.
+        n_jobs: int, number of processes used to read the JAMS files.
+
+    Returns:
+        list, the indexes of the soundscapes post-processed
+    """
+    folder = manifest.folder
+    indexes = manifest.indexes("generated")
+    if len(indexes) == 0:
+        return []
+    append = len(manifest.indexes("post_processed")) > 0
+    if append and output_csv is not None and osp.exists(output_csv):
+        # The annotations of soundscapes processed again (the run was interrupted before their "post_processed"
+        # record, or they have been generated again since) are replaced, not added twice
+        _drop_annotations(output_csv, indexes)
+    list_jams = [osp.join(folder, f"{index}.jams") for index in indexes]
+    removed = set(rm_high_polyphony(folder, max_polyphony, n_jobs=n_jobs, list_jams=list_jams))
+    for jams_file in removed:
+        manifest.record(get_soundscape_index(jams_file), "removed")
+    kept = [jams_file for jams_file in list_jams if jams_file not in removed]
+    post_processing_annotations(folder, output_folder=folder, output_csv=output_csv, length_sec=length_sec,
+                                list_txt=[osp.splitext(jams_file)[0] + ".txt" for jams_file in kept], append=append)
+    for jams_file in kept:
+        files = [f for f in list_soundscape_files(jams_file) if file_exists(f)]
+        manifest.record(get_soundscape_index(jams_file), "post_processed", files)
+    return [get_soundscape_index(jams_file) for jams_file in kept]
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+""" Generation of the audio of scaper JAMS in python (NumPy), without sox nor temporary files.
+
+The steps of scaper (1.3) are reproduced: the background is looped, trimmed and normalized to ref_db + its snr,
+the foreground events are trimmed, pitch shifted, time stretched, faded in/out (10ms), normalized to ref_db + snr
+and placed at their onset, then everything is summed, the reverb is applied and the soundscape is clipped.
+Soundscapes with the same duration (10s in DESED) can be generated by batch (see render_jams_batch): they are mixed in
+a single (batch, n_samples) array, with the gains of all the events computed at once.
+The loudness is the integrated loudness of ITU-R BS.1770 (as the ebur128 filter used by scaper).
+
+The placement, trimming, fades and gains follow scaper, except that scaper ignores the snr of the backgrounds (0 in
+the soundscapes it generates, not in the FBSNR variants): utils.render_from_jams applies it with scaper too (see
+utils.move_background_snr), so both engines give the same gains. The pitch shift (phase vocoder instead of sox
+pitch) and the reverb (FFT convolution with an impulse response instead of sox reverb, see reverb.py) are different
+algorithms: the soundscapes are similar to the ones of scaper, not identical. The tolerance and the speed-up compared
+to scaper are not validated yet: tests/test_generation.py (test_engines, needs sox) prints the loudness, rms and
+sample differences of both engines and checks them against 0.5 dB, tests/benchmark.py (render_scaper, render_numpy)
+times the generation of a clip with each engine.
+"""
+import os.path as osp
+import json
+import numpy as np
+import soundfile as sf
+
+from reverb import get_ir, get_reverb_params, apply_reverb_batch
+from stems import write_stems, ROLES
+
+# Filters of ITU-R BS.1770 (K-weighting): high shelf then high pass, (gain dB, Q, fc Hz)
+K_SHELF = (4.0, 1 / np.sqrt(2), 1500.)
+K_HIGH_PASS = (0., 0.5, 38.)
+
+
+def _k_weighting(audio, sr):
+    """ Apply the K-weighting filters of ITU-R BS.1770 (biquads at the sample rate of the signal) """
+    from scipy.signal import lfilter
+    gain, q, fc = K_SHELF
+    a = 10 ** (gain / 40.)
+    w0 = 2 * np.pi * fc / sr
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    b = [a * ((a + 1) + (a - 1) * cos_w0 + 2 * np.sqrt(a) * alpha),
+         -2 * a * ((a - 1) + (a + 1) * cos_w0),
+         a * ((a + 1) + (a - 1) * cos_w0 - 2 * np.sqrt(a) * alpha)]
+    den = [(a + 1) - (a - 1) * cos_w0 + 2 * np.sqrt(a) * alpha,
+           2 * ((a - 1) - (a + 1) * cos_w0),
+           (a + 1) - (a - 1) * cos_w0 - 2 * np.sqrt(a) * alpha]
+    audio = lfilter(b, den, audio)
+
+    _, q, fc = K_HIGH_PASS
+    w0 = 2 * np.pi * fc / sr
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    den = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    return lfilter(b, den, audio)
+
+
+def integrated_loudness(audio, sr, min_duration=0.5):
+    """ Integrated loudness (LUFS) of a mono signal, ITU-R BS.1770 (400ms blocks, absolute and relative gates).
+    As in scaper, signals shorter than min_duration are repeated until they reach min_duration.
+
+    Args:
+        audio: np.array, the signal, shape (n_samples,).
+        sr: int, sample rate of the signal.
+        min_duration: float, minimum duration in seconds.
+
+    Returns:
+        float, the integrated loudness in LUFS (-70 for silent signals).
+    """
+    if len(audio) == 0:
+        return -70.
+    if len(audio) < min_duration * sr:
+        audio = np.tile(audio, int(np.ceil(min_duration * sr / len(audio))))
+    filtered = _k_weighting(audio.astype(np.float64), sr)
+    block, step = int(0.4 * sr), int(0.1 * sr)
+    if len(filtered) < block:
+        return -70.
+    # Mean square of the blocks, with a cumulative sum
+    cumsum = np.concatenate([[0.], np.cumsum(filtered ** 2)])
+    starts = np.arange(0, len(filtered) - block + 1, step)
+    power = (cumsum[starts + block] - cumsum[starts]) / block
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(power)
+    power = power[loudness > -70]
+    if len(power) == 0:
+        return -70.
+    relative_gate = -0.691 + 10 * np.log10(power.mean()) - 10
+    with np.errstate(divide='ignore'):
+        power = power[-0.691 + 10 * np.log10(power) > relative_gate]
+    return -0.691 + 10 * np.log10(power.mean())
+
+
+def time_stretch(audio, rate, n_fft=2048, hop_length=512):
+    """ Change the speed of a signal without changing its pitch (phase vocoder)
+    Args:
+        audio: np.array, the signal, shape (n_samples,).
+        rate: float, speed factor, > 1 to speed up (shorter signal).
+        n_fft: int, size of the frames.
+        hop_length: int, hop between the frames.
+
+    Returns:
+        np.array, the signal, round(n_samples / rate) samples.
+    """
+    n_out = int(round(len(audio) / rate))
+    window = np.hanning(n_fft + 1)[:-1]
+    padded = np.pad(audio, (n_fft // 2, n_fft // 2 + n_fft))
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length] * window
+    spec = np.fft.rfft(frames, axis=1)
+
+    steps = np.arange(0, len(spec) - 1, rate)
+    index = steps.astype(int)
+    alpha = (steps - index)[:, None]
+    magnitude = (1 - alpha) * np.abs(spec[index]) + alpha * np.abs(spec[index + 1])
+    # Expected phase advance of each bin in a hop, plus the deviation measured between the two frames
+    advance = 2 * np.pi * hop_length * np.arange(spec.shape[1]) / n_fft
+    delta = np.angle(spec[index + 1]) - np.angle(spec[index]) - advance
+    delta -= 2 * np.pi * np.round(delta / (2 * np.pi))
+    phase = np.angle(spec[0]) + np.concatenate([np.zeros((1, spec.shape[1])),
+                                                np.cumsum(advance + delta, axis=0)[:-1]])
+    frames = np.fft.irfft(magnitude * np.exp(1j * phase), n_fft, axis=1) * window
+
+    # Overlap-add, normalized by the sum of the squared windows
+    n_total = n_fft + hop_length * (len(frames) - 1)
+    out = np.zeros(n_total)
+    norm = np.zeros(n_total)
+    for i, frame in enumerate(frames):
+        out[i * hop_length:i * hop_length + n_fft] += frame
+        norm[i * hop_length:i * hop_length + n_fft] += window ** 2
+    out = out / np.maximum(norm, 1e-8)
+    out = out[n_fft // 2:n_fft // 2 + n_out]
+    return np.pad(out, (0, n_out - len(out)))
+
+
+def pitch_shift(audio, sr, n_semitones):
+    """ Shift the pitch of a signal without changing its duration (time stretch then resampling)
+    Args:
+        audio: np.array, the signal, shape (n_samples,).
+        sr: int, sample rate of the signal.
+        n_semitones: float, the pitch shift in semitones.
+
+    Returns:
+        np.array, the signal, same length as audio.
+    """
+    from scipy.signal import resample
+    if len(audio) == 0:
+        return audio
+    rate = 2 ** (-n_semitones / 12.)
+    return resample(time_stretch(audio, rate), len(audio))
+
+
+def load_source(source_file, sr, cache=None):
+    """ Read a source file (mono, at the sample rate of the soundscape)
+    Args:
+        source_file: str, path of the source file.
+        sr: int, sample rate of the soundscape.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+
+    Returns:
+        np.array, the samples, shape (n_samples,).
+    """
+    if cache is not None:
+        audio = cache.load(source_file, sr)
+    else:
+        audio, file_sr = sf.read(source_file, dtype='float32')
+        if file_sr != sr:
+            from scipy.signal import resample_poly
+            gcd = np.gcd(file_sr, sr)
+            audio = resample_poly(audio, sr // gcd, file_sr // gcd, axis=0)
+    if audio.ndim > 1:
+        # sox averages the channels
+        audio = audio.mean(axis=1)
+    return np.asarray(audio, dtype=np.float64)
+
+
+def _fade(audio, n_fade_in, n_fade_out):
+    """ Quarter sine fade in and fade out (default shape of sox fade) """
+    audio = audio.copy()
+    n_fade_in, n_fade_out = min(n_fade_in, len(audio)), min(n_fade_out, len(audio))
+    if n_fade_in > 0:
+        audio[:n_fade_in] *= np.sin(np.pi / 2 * np.arange(n_fade_in) / n_fade_in)
+    if n_fade_out > 0:
+        audio[len(audio) - n_fade_out:] *= np.sin(np.pi / 2 * np.arange(n_fade_out, 0, -1) / n_fade_out)
+    return audio
+
+
+def event_segment(event, sr, duration, fade_in_len=0.01, fade_out_len=0.01, cache=None):
+    """ Get the samples of an event of a soundscape before its gain, as scaper does before mixing
+    Args:
+        event: namedtuple or pd.Series, the event (see utils.get_jams_events).
+        sr: int, sample rate of the soundscape.
+        duration: float, duration of the soundscape in seconds.
+        fade_in_len: float, duration of the fade in of the foreground events.
+        fade_out_len: float, duration of the fade out of the foreground events.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+
+    Returns:
+        tuple, (np.array the samples, int the first sample of the event in the soundscape)
+    """
+    source = load_source(event.source_file, sr, cache)
+    start, stop = int(round(event.source_time * sr)), int(round((event.source_time + event.event_duration) * sr))
+    if event.role == 'background':
+        # Looped to cover the soundscape (at least twice, as scaper)
+        n_tiles = int(max(duration // (len(source) / sr) + 1, 2))
+        return np.tile(source, n_tiles)[start:stop], 0
+
+    audio = source[start:stop]
+    if event.pitch_shift is not None and not np.isnan(event.pitch_shift) and event.pitch_shift != 0:
+        audio = pitch_shift(audio, sr, event.pitch_shift)
+    if event.time_stretch is not None and not np.isnan(event.time_stretch) and event.time_stretch != 1:
+        audio = time_stretch(audio, 1. / event.time_stretch)
+    audio = _fade(audio, int(round(fade_in_len * sr)), int(round(fade_out_len * sr)))
+    return audio, int(round(event.event_time * sr))
+
+
+def get_gains(snr, loudness, ref_db):
+    """ Linear gains normalizing events to ref_db + snr, backgrounds included (scaper alone normalizes the backgrounds
+    to ref_db, utils.render_from_jams moves their snr to ref_db so they get the same gain)
+    Args:
+        snr: np.array, the SNR of the events (NaN for the backgrounds without SNR).
+        loudness: np.array, the loudness of the events before the gain (see integrated_loudness).
+        ref_db: float, reference loudness of the background.
+
+    Returns:
+        np.array, the gains
+    """
+    return 10 ** ((ref_db + np.nan_to_num(np.asarray(snr, dtype=float)) - np.asarray(loudness)) / 20.)
+
+
+def process_event(event, sr, duration, ref_db, fade_in_len=0.01, fade_out_len=0.01, cache=None):
+    """ Get the samples of an event of a soundscape, as scaper does before mixing
+    Args:
+        event: namedtuple or pd.Series, the event (see utils.get_jams_events).
+        sr: int, sample rate of the soundscape.
+        duration: float, duration of the soundscape in seconds.
+        ref_db: float, reference loudness of the background.
+        fade_in_len: float, duration of the fade in of the foreground events.
+        fade_out_len: float, duration of the fade out of the foreground events.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+
+    Returns:
+        tuple, (np.array the samples with the gain applied, int the first sample of the event in the soundscape)
+    """
+    audio, onset = event_segment(event, sr, duration, fade_in_len, fade_out_len, cache)
+    snr = np.nan if event.snr is None else event.snr
+    return audio * get_gains(snr, integrated_loudness(audio, sr), ref_db), onset
+
+
+def render_batch(list_events, sr=44100, duration=10.0, ref_db=-50, fade_in_len=0.01, fade_out_len=0.01, cache=None):
+    """ Mix the events of multiple soundscapes of the same duration into foreground and background stems
+    (without reverb). The gains of all the events are computed at once, and the events are added to a single
+    (batch, n_samples) array per stem.
+
+    Args:
+        list_events: list of pd.DataFrame, the events of each soundscape (see utils.get_jams_events).
+        sr: int, sample rate of the soundscapes.
+        duration: float, duration of the soundscapes in seconds.
+        ref_db: float, reference loudness of the background.
+        fade_in_len: float, duration of the fade in of the foreground events.
+        fade_out_len: float, duration of the fade out of the foreground events.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+
+    Returns:
+        dict, {'foreground': np.array, 'background': np.array} the stems, float32, shape (batch, int(duration * sr)).
+    """
+    n_samples = int(duration * sr)
+    segments, rows, onsets, roles, snr, loudness = [], [], [], [], [], []
+    for row, df_events in enumerate(list_events):
+        for event in df_events.itertuples():
+            audio, onset = event_segment(event, sr, duration, fade_in_len, fade_out_len, cache)
+            # The loudness is measured before truncating the events at the end of the soundscape, as scaper
+            loudness.append(integrated_loudness(audio, sr))
+            segments.append(audio[:max(0, n_samples - onset)])
+            rows.append(row)
+            onsets.append(onset)
+            roles.append(event.role)
+            snr.append(np.nan if event.snr is None else event.snr)
+
+    stems = {role: np.zeros((len(list_events), n_samples), dtype=np.float32) for role in ROLES}
+    if len(segments) == 0:
+        return stems
+    gains = get_gains(snr, loudness, ref_db)
+    for segment, gain, row, onset, role in zip(segments, gains, rows, onsets, roles):
+        stems[role][row, onset:onset + len(segment)] += segment * np.float32(gain)
+    return stems
+
+
+def render_events(df_events, sr=44100, duration=10.0, ref_db=-50, fade_in_len=0.01, fade_out_len=0.01, cache=None):
+    """ Mix the events of a soundscape into a foreground and a background stem (without reverb)
+    Args:
+        df_events: pd.DataFrame, the events of the soundscape (see utils.get_jams_events).
+        sr: int, sample rate of the soundscape.
+        duration: float, duration of the soundscape in seconds.
+        ref_db: float, reference loudness of the background.
+        fade_in_len: float, duration of the fade in of the foreground events.
+        fade_out_len: float, duration of the fade out of the foreground events.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+
+    Returns:
+        dict, {'foreground': np.array, 'background': np.array} the stems, float32, int(duration * sr) samples.
+    """
+    stems = render_batch([df_events], sr, duration, ref_db, fade_in_len, fade_out_len, cache)
+    return {role: stem[0] for role, stem in stems.items()}
+
+
+def write_batch(audio_files, audio, sr, subtype='PCM_16'):
+    """ Write a batch of soundscapes
+    Args:
+        audio_files: list, paths of the audio files, one per line of audio.
+        audio: np.array, the soundscapes, shape (batch, n_samples).
+        sr: int, sample rate of the soundscapes.
+        subtype: str, subtype of the audio files (see soundfile.write).
+
+    Returns:
+        list, the paths of the audio files written
+    """
+    for audio_file, soundscape in zip(audio_files, audio):
+        sf.write(audio_file, soundscape, sr, subtype=subtype)
+    return list(audio_files)
+
+
+def render_jams_batch(list_jams, audio_files, fg_path=None, bg_path=None, jams_outfiles=None, keep_stems=False,
+                      cache=None, subtype='PCM_16'):
+    """ Generate the audio of multiple JAMS files generated by scaper in a single (batch, n_samples) array.
+    The soundscapes must have the same sample rate, duration, ref_db and fades (the settings of the generate_*
+    scripts). The reverb is applied with an impulse response (one FFT convolution per impulse response): the one
+    saved in the JAMS (see reverb.get_reverb_params), or a synthetic impulse response with the reverberance of scaper.
+    The synthetic impulse response is not saved in the JAMS, the JAMS saved are still generated with sox by scaper.
+
+    Args:
+        list_jams: list, paths of the JAMS files.
+        audio_files: list, paths of the audio files to generate, one per JAMS file.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        jams_outfiles: list, optional, where to save the JAMS after the generation (None to not save a JAMS).
+        keep_stems: bool, whether to save the foreground and background stems (see stems.write_stems).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+        subtype: str, subtype of the audio files written (see soundfile.write).
+
+    Returns:
+        np.array, the soundscapes written, shape (batch, n_samples)
+    """
+    from utils import read_jams, write_jams, get_scaper_annotation, get_jams_events, get_desed_sandbox
+    jam_dicts, list_events, list_reverbs = [], [], []
+    settings = None
+    for jam_file in list_jams:
+        jam_dict = read_jams(jam_file)
+        ann = get_scaper_annotation(jam_dict)
+        sandbox = ann['sandbox']['scaper']
+        for obs in ann['data']:
+            # Same as scaper.generate_from_jams
+            new_path = fg_path if obs['value']['role'] == 'foreground' else bg_path
+            if new_path is not None:
+                source_file = obs['value']['source_file']
+                obs['value']['source_file'] = osp.join(new_path, osp.basename(osp.dirname(source_file)),
+                                                       osp.basename(source_file))
+        sandbox['fg_path'] = fg_path or sandbox['fg_path']
+        sandbox['bg_path'] = bg_path or sandbox['bg_path']
+
+        jam_settings = (sandbox.get('sr', 44100), sandbox.get('original_duration', sandbox['duration']),
+                        sandbox['ref_db'], sandbox['fade_in_len'], sandbox['fade_out_len'])
+        if settings is None:
+            settings = jam_settings
+        elif jam_settings != settings:
+            raise ValueError(f"{jam_file} does not have the same sample rate, duration, ref_db or fades "
+                             f"as {list_jams[0]}, they cannot be generated in the same batch")
+
+        reverb_params = get_desed_sandbox(jam_dict).get('reverb')
+        if reverb_params is None and sandbox['reverb'] is not None:
+            reverb_params = get_reverb_params(0, reverberance=sandbox['reverb'])
+        jam_dicts.append(jam_dict)
+        list_events.append(get_jams_events(jam_dict))
+        list_reverbs.append(reverb_params)
+
+    sr = settings[0]
+    stems = render_batch(list_events, *settings, cache=cache)
+    # The reverb is linear, without stems to save only the mix is convolved
+    if keep_stems:
+        block = np.stack([stems[role] for role in ROLES])
+    else:
+        block = (stems['foreground'] + stems['background'])[np.newaxis]
+    reverb_keys = [json.dumps(params, sort_keys=True) for params in list_reverbs]
+    for key, reverb_params in dict(zip(reverb_keys, list_reverbs)).items():
+        if reverb_params is not None:
+            rows = [row for row, row_key in enumerate(reverb_keys) if row_key == key]
+            block[:, rows] = apply_reverb_batch(block[:, rows], get_ir(reverb_params, sr))
+    mixes = np.clip(block.sum(axis=0), -1, 1)
+    write_batch(audio_files, mixes, sr, subtype=subtype)
+    if keep_stems:
+        for row, audio_file in enumerate(audio_files):
+            write_stems(audio_file, {role: block[cnt, row] for cnt, role in enumerate(ROLES)}, sr)
+
+    if jams_outfiles is not None:
+        # The impulse responses requested are already in the sandbox, the synthetic ones are not added: the reverb of
+        # the JAMS stays the one of scaper (sox) with render_from_jams
+        for jam_dict, jams_outfile in zip(jam_dicts, jams_outfiles):
+            if jams_outfile is not None:
+                write_jams(jam_dict, jams_outfile)
+    return mixes
+
+
+def render_jams(jam_file, audio_file, fg_path=None, bg_path=None, jams_outfile=None, keep_stems=False, cache=None,
+                subtype='PCM_16'):
+    """ Generate the audio of a JAMS file generated by scaper, in python (same arguments as utils.render_from_jams)
+    The reverb is always applied with an impulse response: the one saved in the JAMS (see reverb.get_reverb_params),
+    or a synthetic impulse response with the reverberance of scaper (not saved in the JAMS, see render_jams_batch).
+
+    Args:
+        jam_file: str, path of the JAMS file.
+        audio_file: str, path of the audio file to generate.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        jams_outfile: str, optional, where to save the JAMS after the generation.
+        keep_stems: bool, whether to save the foreground and background stems (see stems.write_stems).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+        subtype: str, subtype of the audio file written (see soundfile.write).
+
+    Returns:
+        np.array, the soundscape written
+    """
+    return render_jams_batch([jam_file], [audio_file], fg_path, bg_path, [jams_outfile], keep_stems, cache, subtype)[0]
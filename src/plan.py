@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+import os.path as osp
+import warnings
+import numpy as np
+import pandas as pd
+import scaper
+
+from soundbank import get_soundbank_index
+from utils import map_jobs, render_from_jams, quantize_pitch, set_desed_sandbox
+from reverb import get_reverb_params
+from mixer import render_jams_batch
+
+PLAN_COLUMNS = ['soundscape', 'role', 'label', 'source_file', 'source_time', 'event_time', 'event_duration', 'snr',
+                'pitch_shift', 'time_stretch']
+
+
+def _uniform(random_state, low, high):
+    """ Vectorized uniform distribution with different bounds for each sample (same convention as np.random.uniform)
+    """
+    return low + (high - low) * random_state.uniform(size=len(low))
+
+
+def _choose_files(df_index, labels, folder, random_state):
+    """ Choose a file uniformly in the folder of each label of the soundbank
+    Args:
+        df_index: pd.DataFrame, index of the soundbank (see soundbank.get_soundbank_index)
+        labels: np.array, label of each file to choose.
+        folder: str, path of the soundbank.
+        random_state: np.random.RandomState, the random state to use.
+
+    Returns:
+        tuple, (np.array of the paths of the files chosen, np.array of their duration)
+    """
+    counts = df_index.groupby('label').size()
+    missing = set(labels) - set(counts.index)
+    if missing:
+        raise ValueError(f"No file in the soundbank {folder} for the labels: {missing}")
+    # Index is sorted by label then filename, the files of a label are contiguous
+    offsets = counts.cumsum() - counts
+    n_files = counts.reindex(labels).values
+    rows = offsets.reindex(labels).values + (random_state.uniform(size=len(labels)) * n_files).astype(int)
+    basenames = df_index['filename'].apply(osp.basename).values[rows]
+    files = np.array([osp.join(folder, lbl, fname) for lbl, fname in zip(labels, basenames)], dtype=object)
+    return files, df_index['duration'].values[rows]
+
+
+def _sample_events(params, main_labels, fg_folder, bg_folder, duration, random_state, event_duration_min, snr_min,
+                   snr_max, pitch_min, pitch_max, pitch_step=None):
+    """ Sample the events of soundscapes having main_labels as main classes (see sample_plan for the arguments).
+    Returns:
+        pd.DataFrame, the plan, soundscapes are numbered from 0 to len(main_labels) - 1
+    """
+    n_total = len(main_labels)
+    soundscapes = np.arange(n_total)
+
+    # Random number of co-occurring events: randint(0, event_max)
+    event_max = np.array([params[class_lbl]['event_max'] for class_lbl in main_labels])
+    n_events = (random_state.uniform(size=n_total) * event_max).astype(int)
+    event_soundscapes = np.repeat(soundscapes, n_events)
+    event_main_labels = main_labels[event_soundscapes]
+
+    # Class of the co-occurring events (choose_class)
+    event_labels = np.empty(len(event_soundscapes), dtype=object)
+    u_class = random_state.uniform(size=len(event_soundscapes)) * 100
+    for class_lbl in params.keys():
+        mask = event_main_labels == class_lbl
+        cum_prob = np.cumsum(params[class_lbl]['event_prob'])
+        ind = np.searchsorted(cum_prob, u_class[mask], side='right')
+        ind[ind == len(cum_prob)] = 0
+        event_labels[mask] = np.asarray(params[class_lbl]['event_class'], dtype=object)[ind]
+
+    # Main event first, then the co-occurring events
+    fg_soundscapes = np.concatenate([soundscapes, event_soundscapes])
+    order = np.argsort(fg_soundscapes, kind='stable')
+    fg_soundscapes = fg_soundscapes[order]
+    fg_labels = np.concatenate([main_labels.astype(object), event_labels])[order]
+    n_fg = len(fg_labels)
+
+    fg_files, file_duration = _choose_files(get_soundbank_index(fg_folder), fg_labels, fg_folder, random_state)
+    file_duration = np.round(file_duration, 6)  # round because Scaper uses sox with round 6 digits
+
+    # Onset and duration, depending on the events without onset and/or offset
+    no_on_off = np.array(["_nOn_nOff" in lbl for lbl in fg_labels])
+    no_on = np.array(["_nOn" in lbl for lbl in fg_labels]) & ~no_on_off
+    no_off = np.array(["_nOf" in lbl for lbl in fg_labels]) & ~no_on_off & ~no_on
+    regular = ~(no_on_off | no_on | no_off)
+
+    zeros = np.zeros(n_fg)
+    source_time = np.select(
+        [no_on_off, no_on],
+        [_uniform(random_state, zeros, np.maximum(file_duration - duration, 0)),
+         _uniform(random_state, zeros, file_duration - event_duration_min)],
+        0.)
+    event_time = np.select(
+        [no_off, regular],
+        [_uniform(random_state, np.maximum(0, duration - file_duration), zeros + duration - event_duration_min),
+         _uniform(random_state, zeros, zeros + duration - event_duration_min)],
+        0.)
+    event_duration = np.select(
+        [no_on_off, no_on, no_off],
+        [zeros + duration, np.minimum(duration, file_duration - source_time), duration - event_time],
+        np.minimum(file_duration, duration - event_time))
+
+    pitch_shift = _uniform(random_state, zeros + pitch_min, zeros + pitch_max)
+    if pitch_step is not None:
+        pitch_shift = quantize_pitch(pitch_shift, pitch_step)
+
+    df_fg = pd.DataFrame({'soundscape': fg_soundscapes,
+                          'role': 'foreground',
+                          'label': fg_labels,
+                          'source_file': fg_files,
+                          'source_time': source_time,
+                          'event_time': event_time,
+                          'event_duration': event_duration,
+                          'snr': _uniform(random_state, zeros + snr_min, zeros + snr_max),
+                          'pitch_shift': pitch_shift,
+                          'time_stretch': 1.})
+
+    # Background, a label is chosen, then a file of this label (same as scaper 'choose')
+    df_bg_index = get_soundbank_index(bg_folder)
+    bg_labels = np.unique(df_bg_index['label'].values)
+    bg_labels = bg_labels[(random_state.uniform(size=n_total) * len(bg_labels)).astype(int)]
+    bg_files, _ = _choose_files(df_bg_index, bg_labels, bg_folder, random_state)
+    df_bg = pd.DataFrame({'soundscape': soundscapes,
+                          'role': 'background',
+                          'label': bg_labels,
+                          'source_file': bg_files,
+                          'source_time': 0.,
+                          'event_time': 0.,
+                          'event_duration': duration,
+                          'snr': 0.,
+                          'pitch_shift': np.nan,
+                          'time_stretch': np.nan})
+
+    df = pd.concat([df_bg, df_fg], ignore_index=True)
+    df = df.sort_values('soundscape', kind='mergesort').reset_index(drop=True)
+    return df[PLAN_COLUMNS]
+
+
+def plan_polyphony(df_plan):
+    """ Compute the maximum polyphony of each soundscape of a plan (only foreground events, like scaper polyphony_max)
+    Events ending exactly when another one starts are not overlapping.
+
+    Args:
+        df_plan: pd.DataFrame, the plan (see sample_plan).
+
+    Returns:
+        pd.Series, the maximum polyphony, indexed by soundscape.
+    """
+    df_fg = df_plan[df_plan['role'] == 'foreground']
+    soundscapes = np.concatenate([df_fg['soundscape'].values] * 2)
+    times = np.concatenate([df_fg['event_time'].values, (df_fg['event_time'] + df_fg['event_duration']).values])
+    deltas = np.concatenate([np.ones(len(df_fg)), -np.ones(len(df_fg))])
+    # Sorted by soundscape, then time, with offsets before onsets
+    order = np.lexsort((deltas, times, soundscapes))
+    # Each soundscape sums to 0, so a global cumulative sum gives the number of active events in each soundscape
+    active = np.cumsum(deltas[order])
+    polyphony = pd.Series(active).groupby(soundscapes[order]).max().astype(int)
+    return polyphony.reindex(np.unique(df_plan['soundscape']), fill_value=0)
+
+
+def sample_plan(params, n_soundscapes, fg_folder, bg_folder, duration=10.0, random_state=None,
+                event_duration_min=0.25, snr_min=6, snr_max=30, pitch_min=-3.0, pitch_max=3.0, max_polyphony=None,
+                max_trials=100, pitch_step=None):
+    """ Sample all the events of all the soundscapes of a dataset (same distributions as utils.add_event)
+    The plan can be saved (save_plan) and inspected before rendering the audio (render_plan).
+
+    Args:
+        params: dict, occurrences of events (event_occurences_XXX.json), keys are the main classes.
+        n_soundscapes: int, number of soundscapes (shared between the main classes using their 'prob').
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        duration: float, duration of the soundscapes in seconds.
+        random_state: np.random.RandomState, optional, the random state to use.
+        event_duration_min: float, minimum duration of an event (sec).
+        snr_min: float, minimum SNR of a foreground event.
+        snr_max: float, maximum SNR of a foreground event.
+        pitch_min: float, minimum pitch shift of a foreground event (semitones).
+        pitch_max: float, maximum pitch shift of a foreground event (semitones).
+        max_polyphony: int, optional, the soundscapes having a polyphony >= max_polyphony are sampled again
+            (same rule as rm_high_polyphony, but before generating any audio).
+        max_trials: int, maximum number of times a soundscape is sampled again, it is removed after.
+        pitch_step: float, optional, the pitch shifts are rounded to a grid of this step (see utils.quantize_pitch).
+
+    Returns:
+        pd.DataFrame, the plan, one line per event (background included) with the columns PLAN_COLUMNS
+    """
+    # Main class of each soundscape, in the order of the json file
+    main_labels = np.concatenate([[class_lbl] * int(n_soundscapes * params[class_lbl]['prob'])
+                                  for class_lbl in params.keys()])
+    return sample_soundscapes(params, main_labels, fg_folder, bg_folder, duration, random_state, event_duration_min,
+                              snr_min, snr_max, pitch_min, pitch_max, max_polyphony, max_trials, pitch_step)
+
+
+def sample_soundscapes(params, main_labels, fg_folder, bg_folder, duration=10.0, random_state=None,
+                       event_duration_min=0.25, snr_min=6, snr_max=30, pitch_min=-3.0, pitch_max=3.0,
+                       max_polyphony=None, max_trials=100, pitch_step=None):
+    """ Sample the events of soundscapes having main_labels as main classes, the too polyphonic soundscapes are
+    sampled again (see sample_plan for the arguments).
+
+    Args:
+        main_labels: np.array, the main class of each soundscape.
+
+    Returns:
+        pd.DataFrame, the plan, soundscapes are numbered from 0 to len(main_labels) - 1 (the removed ones are missing)
+    """
+    if random_state is None:
+        random_state = np.random
+    main_labels = np.asarray(main_labels, dtype=object)
+    sample_args = (fg_folder, bg_folder, duration, random_state, event_duration_min, snr_min, snr_max, pitch_min,
+                   pitch_max, pitch_step)
+    df = _sample_events(params, main_labels, *sample_args)
+    if max_polyphony is None:
+        return df
+
+    for _ in range(max_trials):
+        polyphony = plan_polyphony(df)
+        rejected = polyphony.index[polyphony >= max_polyphony].values
+        if len(rejected) == 0:
+            break
+        # Sample again the rejected soundscapes with the same main class
+        df_new = _sample_events(params, main_labels[rejected], *sample_args)
+        df_new['soundscape'] = rejected[df_new['soundscape'].values]
+        df = pd.concat([df[~df['soundscape'].isin(rejected)], df_new], ignore_index=True)
+        df = df.sort_values('soundscape', kind='mergesort').reset_index(drop=True)
+    else:
+        warnings.warn(f"{len(rejected)} soundscapes still have a polyphony >= {max_polyphony} after {max_trials} "
+                      f"trials, they are removed from the plan")
+        df = df[~df['soundscape'].isin(rejected)].reset_index(drop=True)
+    return df
+
+
+def save_plan(df_plan, plan_file):
+    """ Save a plan in a tab separated csv file
+    Args:
+        df_plan: pd.DataFrame, the plan (see sample_plan).
+        plan_file: str, path of the csv file.
+
+    Returns:
+        None
+    """
+    df_plan.to_csv(plan_file, sep="\t", index=False)
+
+
+def load_plan(plan_file):
+    """ Load a plan saved with save_plan
+    Args:
+        plan_file: str, path of the csv file.
+
+    Returns:
+        pd.DataFrame, the plan
+    """
+    return pd.read_csv(plan_file, sep="\t")
+
+
+def get_run_plan(manifest, plan_file, params, n_soundscapes, fg_folder, bg_folder, duration=10.0, max_polyphony=3,
+                 pitch_step=None):
+    """ Get the plan of a generation run: a resumed run (its manifest has records) uses the plan saved by its first
+    run, otherwise a plan is sampled with the seed of the run and saved.
+    Args:
+        manifest: manifest.RunManifest, the manifest of the run.
+        plan_file: str, path of the plan of the run (see save_plan).
+        params: dict, occurrences of events (event_occurences_XXX.json), keys are the main classes.
+        n_soundscapes: int, number of soundscapes (see sample_plan).
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        duration: float, duration of the soundscapes in seconds.
+        max_polyphony: int, optional, the soundscapes having a polyphony >= max_polyphony are sampled again.
+        pitch_step: float, optional, the pitch shifts are rounded to a grid of this step (see utils.quantize_pitch).
+
+    Returns:
+        pd.DataFrame, the plan
+    """
+    if len(manifest.records) > 0 and osp.exists(plan_file):
+        return load_plan(plan_file)
+    df_plan = sample_plan(params, n_soundscapes, fg_folder, bg_folder, duration,
+                          random_state=np.random.RandomState(manifest.seed), max_polyphony=max_polyphony,
+                          pitch_step=pitch_step)
+    save_plan(df_plan, plan_file)
+    print(f"Plan of {df_plan.soundscape.nunique()} soundscapes saved in {plan_file}")
+    return df_plan
+
+
+def instantiate_soundscape(df_soundscape, outfolder, fg_folder, bg_folder, duration=10.0, ref_db=-50, pitch_step=None,
+                           fft_reverb=False, ir_bank=None):
+    """ Generate the JAMS and txt files of a soundscape of a plan, without the audio
+    Args:
+        df_soundscape: pd.DataFrame, the lines of the plan of a single soundscape.
+        outfolder: str, folder in which to save the JAMS and txt files.
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        duration: float, duration of the soundscape in seconds.
+        ref_db: float, reference loudness of the background.
+        pitch_step: float, optional, step of the grid of the pitch shifts of the plan (see sample_plan),
+            saved in the JAMS.
+        fft_reverb: bool, whether to apply the reverb with an impulse response instead of sox (see reverb.py).
+        ir_bank: str, optional, folder of impulse responses used with fft_reverb (synthetic impulse response if None).
+
+    Returns:
+        tuple, (str the path of the JAMS file generated, str the path of the audio file to generate)
+    """
+    n = df_soundscape['soundscape'].iloc[0]
+    sc = scaper.Scaper(duration, fg_folder, bg_folder)
+    sc.protected_labels = []
+    sc.ref_db = ref_db
+    for event in df_soundscape.itertuples():
+        if event.role == 'background':
+            sc.add_background(label=('const', event.label),
+                              source_file=('const', event.source_file),
+                              source_time=('const', event.source_time))
+        else:
+            sc.add_event(label=('const', event.label),
+                         source_file=('const', event.source_file),
+                         source_time=('const', event.source_time),
+                         event_time=('const', event.event_time),
+                         event_duration=('const', event.event_duration),
+                         snr=('const', event.snr),
+                         pitch_shift=('const', event.pitch_shift),
+                         time_stretch=('const', event.time_stretch))
+
+    audiofile = osp.join(outfolder, f"{n}.wav")
+    jamsfile = osp.join(outfolder, f"{n}.jams")
+    txtfile = osp.join(outfolder, f"{n}.txt")
+    sc.generate(audiofile, jamsfile,
+                allow_repeated_label=True,
+                allow_repeated_source=True,
+                reverb=0.1,
+                disable_sox_warnings=True,
+                no_audio=True,
+                txt_path=txtfile)
+    reverb_params = get_reverb_params(n, ir_bank=ir_bank) if fft_reverb else None
+    set_desed_sandbox(jamsfile, pitch_step=pitch_step, reverb=reverb_params)
+    return jamsfile, audiofile
+
+
+def render_soundscape(df_soundscape, outfolder, fg_folder, bg_folder, duration=10.0, ref_db=-50, keep_stems=False,
+                      cache=None, pitch_step=None, fft_reverb=False, ir_bank=None, engine="scaper"):
+    """ Generate a soundscape of a plan, all the parameters are fixed by the plan
+    Args:
+        df_soundscape: pd.DataFrame, the lines of the plan of a single soundscape.
+        outfolder: str, folder in which to save the audio, JAMS and txt files.
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        duration: float, duration of the soundscape in seconds.
+        ref_db: float, reference loudness of the background.
+        keep_stems: bool, whether to save the foreground and background stems (see stems.save_stems).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        pitch_step: float, optional, step of the grid of the pitch shifts of the plan (see sample_plan),
+            saved in the JAMS.
+        fft_reverb: bool, whether to apply the reverb with an impulse response instead of sox (see reverb.py).
+        ir_bank: str, optional, folder of impulse responses used with fft_reverb (synthetic impulse response if None).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+
+    Returns:
+        str, the path of the JAMS file generated
+    """
+    jamsfile, audiofile = instantiate_soundscape(df_soundscape, outfolder, fg_folder, bg_folder, duration, ref_db,
+                                                 pitch_step, fft_reverb, ir_bank)
+    render_from_jams(jamsfile, audiofile, jams_outfile=jamsfile, keep_stems=keep_stems, cache=cache,
+                     engine=engine)
+    return jamsfile
+
+
+def render_block(list_df_soundscapes, outfolder, fg_folder, bg_folder, duration=10.0, ref_db=-50, keep_stems=False,
+                 cache=None, pitch_step=None, fft_reverb=False, ir_bank=None):
+    """ Generate a block of soundscapes of a plan in a single batch, in python (see mixer.render_jams_batch)
+    Args:
+        list_df_soundscapes: list of pd.DataFrame, the lines of the plan of each soundscape of the block.
+        outfolder: str, folder in which to save the audio, JAMS and txt files.
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        duration: float, duration of the soundscapes in seconds.
+        ref_db: float, reference loudness of the background.
+        keep_stems: bool, whether to save the foreground and background stems (see stems.write_stems).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+        pitch_step: float, optional, step of the grid of the pitch shifts of the plan (see sample_plan),
+            saved in the JAMS.
+        fft_reverb: bool, whether to apply the reverb with an impulse response of the bank (see reverb.py).
+        ir_bank: str, optional, folder of impulse responses used with fft_reverb (synthetic impulse response if None).
+
+    Returns:
+        list, the paths of the JAMS files generated
+    """
+    files = [instantiate_soundscape(df_soundscape, outfolder, fg_folder, bg_folder, duration, ref_db, pitch_step,
+                                    fft_reverb, ir_bank)
+             for df_soundscape in list_df_soundscapes]
+    list_jams, audio_files = [list(elem) for elem in zip(*files)]
+    render_jams_batch(list_jams, audio_files, jams_outfiles=list_jams, keep_stems=keep_stems, cache=cache)
+    return list_jams
+
+
+def render_plan(df_plan, outfolder, fg_folder, bg_folder, duration=10.0, ref_db=-50, n_jobs=1, keep_stems=False,
+                cache=None, pitch_step=None, fft_reverb=False, ir_bank=None, engine="scaper", batch_size=1,
+                encoder=None):
+    """ Generate all the soundscapes of a plan
+    Args:
+        df_plan: pd.DataFrame, the plan (see sample_plan).
+        outfolder: str, folder in which to save the audio, JAMS and txt files.
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        duration: float, duration of the soundscapes in seconds.
+        ref_db: float, reference loudness of the background.
+        n_jobs: int, number of processes to use.
+        keep_stems: bool, whether to save the foreground and background stems (see stems.save_stems).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see utils.render_from_jams).
+        pitch_step: float, optional, step of the grid of the pitch shifts of the plan (see sample_plan),
+            saved in the JAMS.
+        fft_reverb: bool, whether to apply the reverb with an impulse response instead of sox (see reverb.py).
+        ir_bank: str, optional, folder of impulse responses used with fft_reverb (synthetic impulse response if None).
+        engine: str, "scaper" or "numpy", engine generating the audio (see utils.render_from_jams).
+        batch_size: int, number of soundscapes generated in a single batch by each job (see render_block),
+            only with the "numpy" engine.
+        encoder: encoding.AudioEncoder, optional, encodes the soundscapes generated while the next ones are generated.
+
+    Returns:
+        list, the paths of the JAMS files generated
+    """
+    list_df_soundscapes = [df_soundscape for _, df_soundscape in df_plan.groupby('soundscape', sort=True)]
+    if batch_size > 1:
+        if engine != "numpy":
+            raise ValueError("Only the numpy engine generates the soundscapes by batch")
+        list_args = [(list_df_soundscapes[cnt:cnt + batch_size], outfolder, fg_folder, bg_folder, duration, ref_db,
+                      keep_stems, cache, pitch_step, fft_reverb, ir_bank)
+                     for cnt in range(0, len(list_df_soundscapes), batch_size)]
+        print(f'Generating {len(list_df_soundscapes)} soundscapes in {len(list_args)} batches with {n_jobs} job(s)')
+        if encoder is None:
+            callback = None
+        else:
+            def callback(args, list_jams):
+                for jams_file in list_jams:
+                    encoder.submit(jams_file)
+        return [jams_file for list_jams in map_jobs(render_block, list_args, n_jobs, print_every=10, callback=callback)
+                for jams_file in list_jams]
+
+    list_args = [(df_soundscape, outfolder, fg_folder, bg_folder, duration, ref_db, keep_stems, cache, pitch_step,
+                  fft_reverb, ir_bank, engine)
+                 for df_soundscape in list_df_soundscapes]
+    print(f'Generating {len(list_args)} soundscapes with {n_jobs} job(s)')
+    if encoder is None:
+        callback = None
+    else:
+        def callback(args, jams_file):
+            encoder.submit(jams_file)
+    return map_jobs(render_soundscape, list_args, n_jobs, print_every=100, callback=callback)
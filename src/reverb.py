@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+import glob
+import os.path as osp
+import numpy as np
+import soundfile as sf
+
+# Impulse responses already computed or loaded in this process, {(ir, sr): np.array}
+_irs = {}
+
+
+def synthetic_ir(reverberance, sr, seed=0, damping=0.5, pre_delay=0.005):
+    """ Impulse response approximating the reverb of scaper (sox reverb) for a reverberance setting.
+    It is the direct sound followed by an exponentially decaying noise tail (same energy as the direct sound,
+    as the 0dB wet gain of sox), low-pass filtered to damp the high frequencies. The reverberation time grows with
+    the reverberance, from 0.1s (reverberance 0) to 2s (reverberance 1).
+    This is an approximation: the soundscapes are not the same as with sox, only the amount of reverb is comparable.
+
+    Args:
+        reverberance: float, amount of reverb between 0 and 1 (the reverb argument of scaper.Scaper.generate).
+        sr: int, sample rate of the impulse response.
+        seed: int, seed of the noise tail.
+        damping: float, coefficient of the one-pole low-pass filter of the tail, between 0 (no damping) and 1.
+        pre_delay: float, delay in seconds between the direct sound and the tail.
+
+    Returns:
+        np.array, the impulse response, float32.
+    """
+    from scipy.signal import lfilter
+    rt60 = 0.1 + 1.9 * reverberance
+    n_delay = int(pre_delay * sr)
+    t = np.arange(int(rt60 * sr)) / sr
+    tail = np.random.RandomState(seed).randn(len(t)) * np.exp(-np.log(1000) * t / rt60)
+    tail = lfilter([1 - damping], [1, -damping], tail)
+    tail /= np.sqrt(np.sum(tail ** 2))
+    ir = np.zeros(n_delay + len(tail))
+    ir[0] = 1.
+    ir[n_delay:] += tail
+    return ir.astype(np.float32)
+
+
+def list_ir_bank(ir_bank):
+    """ List the impulse responses of a bank (wav files of the folder, recursively)
+    Args:
+        ir_bank: str, folder of the impulse responses.
+
+    Returns:
+        list, the paths of the impulse responses, sorted.
+    """
+    return sorted(glob.glob(osp.join(ir_bank, "**", "*.wav"), recursive=True))
+
+
+def get_reverb_params(index, reverberance=0.1, ir_bank=None):
+    """ Get the reverb of a soundscape, to save in its JAMS (see utils.set_desed_sandbox)
+    Args:
+        index: int, index of the soundscape, the impulse responses of the bank are used in turn.
+        reverberance: float, amount of reverb of the synthetic impulse response (see synthetic_ir).
+        ir_bank: str, optional, folder of impulse responses, a synthetic impulse response is used if None.
+
+    Returns:
+        dict, the parameters of the reverb, {'ir': 'synthetic' or path of the impulse response, ...}
+    """
+    if ir_bank is None:
+        return {'ir': 'synthetic', 'reverberance': reverberance, 'seed': 0}
+    irs = list_ir_bank(ir_bank)
+    if len(irs) == 0:
+        raise ValueError(f"No impulse response (wav file) in {ir_bank}")
+    return {'ir': irs[index % len(irs)]}
+
+
+def get_ir(reverb_params, sr):
+    """ Get the impulse response described by reverb parameters (see get_reverb_params)
+    Args:
+        reverb_params: dict, the parameters of the reverb.
+        sr: int, sample rate of the impulse response.
+
+    Returns:
+        np.array, the impulse response, float32 (first channel if the file has multiple channels).
+    """
+    if reverb_params['ir'] == 'synthetic':
+        key = (reverb_params['reverberance'], reverb_params.get('seed', 0), sr)
+        if key not in _irs:
+            _irs[key] = synthetic_ir(reverb_params['reverberance'], sr, seed=reverb_params.get('seed', 0))
+    else:
+        key = (reverb_params['ir'], sr)
+        if key not in _irs:
+            ir, ir_sr = sf.read(reverb_params['ir'], dtype='float32', always_2d=True)
+            ir = ir[:, 0]
+            if ir_sr != sr:
+                from scipy.signal import resample_poly
+                gcd = np.gcd(ir_sr, sr)
+                ir = resample_poly(ir, sr // gcd, ir_sr // gcd).astype(np.float32)
+            _irs[key] = ir
+    return _irs[key]
+
+
+def apply_reverb_batch(audio, ir):
+    """ Convolve a batch of signals with an impulse response, with FFT. The signals keep their length.
+    Args:
+        audio: np.array, the signals, shape (batch, n_samples) (or (n_samples,) for a single signal).
+        ir: np.array, the impulse response.
+
+    Returns:
+        np.array, the signals with reverb, same shape as audio, float32.
+    """
+    n_samples = audio.shape[-1]
+    n_fft = 1 << int(np.ceil(np.log2(n_samples + len(ir) - 1)))
+    spectrum = np.fft.rfft(audio, n_fft, axis=-1) * np.fft.rfft(ir, n_fft)
+    return np.fft.irfft(spectrum, n_fft, axis=-1)[..., :n_samples].astype(np.float32)
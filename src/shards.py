@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+""" Sharded folders: the files of the soundscapes (wav, JAMS, txt) are written in sequential tar shards instead of
+one file per file in a flat folder, with an index (name, shard, offset, size) for random access.
+The shards are only appended: a file written again is added to a new shard (the index refers to the last version),
+and a file removed is only removed from the index (its bytes stay in the shard until the folder is packed again).
+The paths of the files of a sharded folder are folder/name, as in a flat folder: open_file, file_exists and
+list_files work with both.
+"""
+import glob
+import io
+import os
+import os.path as osp
+import tarfile
+import time
+import pandas as pd
+
+SHARD_INDEX = "shards_index.tsv"
+SHARD_PATTERN = "shard-{:06d}.tar"
+INDEX_COLUMNS = ["name", "shard", "offset", "size"]
+
+# Readers opened, {(folder, pid): (version of the index, ShardReader)}, forked processes do not share the file offsets
+_readers = {}
+
+
+def is_sharded(folder):
+    """ Check if a folder is a sharded folder (it has an index of shards) """
+    return osp.exists(osp.join(folder, SHARD_INDEX))
+
+
+def _read_index(folder):
+    """ Read the index of a sharded folder, only the last version of each file """
+    df = pd.read_csv(osp.join(folder, SHARD_INDEX), sep="\t", dtype={"name": str})
+    return df.drop_duplicates("name", keep="last").set_index("name")
+
+
+def _write_index(folder, df):
+    """ Write the index of a sharded folder (atomically, the readers never see a partial index) """
+    tmp_file = osp.join(folder, SHARD_INDEX + ".tmp")
+    df.reset_index()[INDEX_COLUMNS].to_csv(tmp_file, sep="\t", index=False)
+    os.replace(tmp_file, osp.join(folder, SHARD_INDEX))
+
+
+class ShardWriter:
+    """ Write files in the tar shards of a sharded folder. The files of a soundscape (see write) are always in the
+    same shard. If the folder is already sharded, the new files are appended in new shards.
+
+    Args:
+        folder: str, the sharded folder.
+        shard_size: float, size (bytes) after which a new shard is started.
+    """
+    def __init__(self, folder, shard_size=1e9):
+        self.folder = folder
+        self.shard_size = shard_size
+        os.makedirs(folder, exist_ok=True)
+        self.shards = sorted(glob.glob(osp.join(folder, SHARD_PATTERN.replace("{:06d}", "*"))))
+        self.n_shard = len(self.shards)
+        self.tar = None
+        self.lines = []
+
+    def _next_shard(self):
+        self._close_shard()
+        self.shard = SHARD_PATTERN.format(self.n_shard)
+        self.n_shard += 1
+        self.tar = tarfile.open(osp.join(self.folder, self.shard), "w")
+
+    def _close_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+            self.flush()
+
+    def write(self, files):
+        """ Write the files of a soundscape in the current shard
+        Args:
+            files: dict, {name: bytes}, the names are the names of the files in a flat folder (ex: 7.wav).
+
+        Returns:
+            None
+        """
+        if self.tar is None or self.tar.offset >= self.shard_size:
+            self._next_shard()
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self.tar.addfile(info, io.BytesIO(data))
+            # The data of the file is just before the end of the archive (padded to a block)
+            offset_data = self.tar.offset - -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            self.lines.append([name, self.shard, offset_data, info.size])
+
+    def write_files(self, filenames):
+        """ Write files of the disk in the current shard (see write), with the same names (without their folder) """
+        files = {}
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                files[osp.basename(filename)] = f.read()
+        self.write(files)
+
+    def flush(self):
+        """ Add the files written to the index (done when a shard is closed) """
+        if len(self.lines) == 0:
+            return
+        if self.tar is not None:
+            # The files of the index must be on the disk for the readers
+            self.tar.fileobj.flush()
+        df = pd.DataFrame(self.lines, columns=INDEX_COLUMNS)
+        if is_sharded(self.folder):
+            df = pd.concat([pd.read_csv(osp.join(self.folder, SHARD_INDEX), sep="\t", dtype={"name": str}), df])
+        _write_index(self.folder, df.set_index("name"))
+        self.lines = []
+
+    def close(self):
+        self._close_shard()
+        if not is_sharded(self.folder):
+            # Empty sharded folder
+            _write_index(self.folder, pd.DataFrame(columns=INDEX_COLUMNS).set_index("name"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ShardReader:
+    """ Read the files of a sharded folder (random access with the index)
+    Args:
+        folder: str, the sharded folder.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.index = _read_index(folder)
+        self._files = {}
+
+    def names(self, extension=None):
+        """ Get the names of the files (sorted), optionally only the ones with an extension (ex: .jams) """
+        names = sorted(self.index.index)
+        if extension is not None:
+            names = [name for name in names if name.endswith(extension)]
+        return names
+
+    def __contains__(self, name):
+        return name in self.index.index
+
+    def read(self, name):
+        """ Get the content (bytes) of a file """
+        shard, offset, size = self.index.loc[name, ["shard", "offset", "size"]]
+        if shard not in self._files:
+            self._files[shard] = open(osp.join(self.folder, shard), "rb")
+        f = self._files[shard]
+        f.seek(offset)
+        return f.read(size)
+
+    def open(self, name):
+        """ Get a file object (in memory) of a file """
+        return io.BytesIO(self.read(name))
+
+    def remove(self, names):
+        """ Remove files from the index (the shards are not modified) """
+        self.index = self.index.drop([name for name in names if name in self.index.index])
+        _write_index(self.folder, self.index)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+def get_reader(folder):
+    """ Get a reader of a sharded folder, kept open in this process while the index is not modified """
+    # The index is replaced when it is modified (new inode)
+    stat = os.stat(osp.join(folder, SHARD_INDEX))
+    version = (stat.st_ino, stat.st_mtime_ns)
+    key = (folder, os.getpid())
+    if key not in _readers or _readers[key][0] != version:
+        if key in _readers:
+            _readers[key][1].close()
+        _readers[key] = (version, ShardReader(folder))
+    return _readers[key][1]
+
+
+def open_file(filename):
+    """ Open a file (binary mode) of a flat folder or of a sharded folder
+    Args:
+        filename: str, path of the file (folder/name).
+
+    Returns:
+        file object
+    """
+    folder = osp.dirname(filename)
+    if is_sharded(folder):
+        return get_reader(folder).open(osp.basename(filename))
+    return open(filename, "rb")
+
+
+def file_exists(filename):
+    """ Check if a file of a flat folder or of a sharded folder exists """
+    folder = osp.dirname(filename)
+    if is_sharded(folder):
+        return osp.basename(filename) in get_reader(folder)
+    return osp.exists(filename)
+
+
+def list_files(folder, extension):
+    """ List the files with an extension (ex: .jams) of a flat folder or of a sharded folder
+    Args:
+        folder: str, the folder.
+        extension: str, the extension of the files.
+
+    Returns:
+        list, the paths of the files (folder/name), sorted
+    """
+    if is_sharded(folder):
+        return [osp.join(folder, name) for name in get_reader(folder).names(extension)]
+    return sorted(glob.glob(osp.join(folder, "*" + extension)))
+
+
+def list_soundscape_files(filename):
+    """ List the files of the soundscape of a file (same name, any extension) in a flat folder or a sharded folder """
+    folder, stem = osp.dirname(filename), osp.splitext(osp.basename(filename))[0]
+    if is_sharded(folder):
+        return [osp.join(folder, name) for name in get_reader(folder).names() if osp.splitext(name)[0] == stem]
+    return glob.glob(osp.join(folder, stem + ".*"))
+
+
+def remove_files(filenames):
+    """ Remove files of flat folders or of sharded folders (removed from the index) """
+    by_folder = {}
+    for filename in filenames:
+        by_folder.setdefault(osp.dirname(filename), []).append(osp.basename(filename))
+    for folder, names in by_folder.items():
+        if is_sharded(folder):
+            get_reader(folder).remove(names)
+        else:
+            for name in names:
+                os.remove(osp.join(folder, name))
+
+
+def pack_folder(folder, out_folder, shard_size=1e9, extensions=(".wav", ".jams", ".txt")):
+    """ Write the soundscapes of a flat folder in a sharded folder, the files of a soundscape in the same shard
+    Args:
+        folder: str, the flat folder.
+        out_folder: str, the sharded folder.
+        shard_size: float, size (bytes) after which a new shard is started.
+        extensions: tuple, the extensions of the files of the soundscapes.
+
+    Returns:
+        int, the number of soundscapes written
+    """
+    soundscapes = {}
+    for extension in extensions:
+        for filename in sorted(glob.glob(osp.join(folder, "*" + extension))):
+            soundscapes.setdefault(osp.splitext(osp.basename(filename))[0], []).append(filename)
+    with ShardWriter(out_folder, shard_size) as writer:
+        for name in sorted(soundscapes):
+            writer.write_files(soundscapes[name])
+    return len(soundscapes)
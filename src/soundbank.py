@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+import os
+import os.path as osp
+import pandas as pd
+import soundfile as sf
+
+INDEX_FILENAME = "soundbank_index.csv"
+INDEX_COLUMNS = ['filename', 'label', 'duration', 'samplerate', 'channels', 'mtime', 'size']
+
+# Indexes already loaded in this process, {abspath of the folder: pd.DataFrame}
+_indexes = {}
+
+
+def _list_files(folder):
+    """ List the audio files of a soundbank, (one subfolder per label, as used by scaper)
+    Args:
+        folder: str, path of the soundbank.
+
+    Returns:
+        list of tuples, (filename, label, mtime, size) of the files, sorted by label then filename.
+    """
+    files = []
+    for label in sorted(os.listdir(folder)):
+        class_path = osp.join(folder, label)
+        if label[0] == '.' or not osp.isdir(class_path):
+            continue
+        for entry in os.scandir(class_path):
+            if entry.name[0] != '.' and entry.is_file():
+                stat = entry.stat()
+                files.append((osp.join(class_path, entry.name), label, stat.st_mtime_ns, stat.st_size))
+    return sorted(files, key=lambda x: (x[1], x[0]))
+
+
+def build_soundbank_index(folder, index_file=None):
+    """ Build (or update) the index of a soundbank and save it to disk.
+    The audio files already in the index and not modified since (same mtime and size) are not read again.
+
+    Args:
+        folder: str, path of the soundbank (containing a subfolder per label).
+        index_file: str, optional, path of the index file, default to folder/soundbank_index.csv
+
+    Returns:
+        pd.DataFrame, the index, one line per file with the columns INDEX_COLUMNS
+    """
+    if index_file is None:
+        index_file = osp.join(folder, INDEX_FILENAME)
+    old_info = {}
+    if osp.exists(index_file):
+        df_old = pd.read_csv(index_file, sep="\t")
+        # Paths are relative to the soundbank in the index, so the soundbank can be moved
+        for row in df_old.itertuples(index=False):
+            old_info[(osp.join(folder, row.filename), row.mtime, row.size)] = (row.duration, row.samplerate,
+                                                                               row.channels)
+
+    rows = []
+    n_updated = 0
+    for filename, label, mtime, size in _list_files(folder):
+        if (filename, mtime, size) in old_info:
+            duration, samplerate, channels = old_info[(filename, mtime, size)]
+        else:
+            info = sf.info(filename)
+            duration, samplerate, channels = info.duration, info.samplerate, info.channels
+            n_updated += 1
+        rows.append((filename, label, duration, samplerate, channels, mtime, size))
+    df = pd.DataFrame(rows, columns=INDEX_COLUMNS)
+    if n_updated > 0:
+        print(f"Read the header of {n_updated} new or modified files in {folder}")
+
+    if n_updated > 0 or len(df) != len(old_info):
+        df_save = df.copy()
+        df_save['filename'] = df_save['filename'].apply(lambda x: osp.relpath(x, folder))
+        # Written under another name then renamed, the processes building the index at the same time (pool of jobs)
+        # never read a partial file
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        df_save.to_csv(tmp_file, sep="\t", index=False)
+        os.replace(tmp_file, index_file)
+    return df
+
+
+def get_soundbank_index(folder, index_file=None):
+    """ Get the index of a soundbank, it is built (or updated) only the first time it is asked in a process.
+    Args:
+        folder: str, path of the soundbank (containing a subfolder per label).
+        index_file: str, optional, path of the index file, default to folder/soundbank_index.csv
+
+    Returns:
+        pd.DataFrame, the index, one line per file with the columns INDEX_COLUMNS (absolute paths of the files,
+        whatever the spelling of folder)
+    """
+    key = osp.abspath(folder)
+    if key not in _indexes:
+        _indexes[key] = build_soundbank_index(key, index_file)
+    return _indexes[key]
+
+
+def get_class_files(class_path):
+    """ Get the files (and their information) of a class of a soundbank
+    Args:
+        class_path: str, path of the class folder, in a soundbank.
+
+    Returns:
+        pd.DataFrame, the lines of the index of this class, sorted by filename.
+    """
+    class_path = osp.normpath(class_path)
+    df = get_soundbank_index(osp.dirname(class_path))
+    return df[df['label'] == osp.basename(class_path)]
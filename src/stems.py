@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+import os
+import os.path as osp
+import glob
+import shutil
+import numpy as np
+import soundfile as sf
+
+from reverb import apply_reverb_batch
+from encoding import write_audio
+
+# Subfolder (next to the soundscapes) in which the foreground and background stems are saved
+STEMS_FOLDER = "stems"
+ROLES = ['foreground', 'background']
+
+
+def get_stem_file(audio_file, role):
+    """ Get the path of a stem of a soundscape
+    Args:
+        audio_file: str, path of the audio file of the soundscape.
+        role: str, 'foreground' or 'background'.
+
+    Returns:
+        str, path of the stem, outfolder/stems/<name>_<role>.wav
+    """
+    folder, name = osp.split(audio_file)
+    return osp.join(folder, STEMS_FOLDER, f"{osp.splitext(name)[0]}_{role}.wav")
+
+
+def get_events_folder(audio_file):
+    """ Get the folder where scaper saves the isolated events of a soundscape (before they are summed into stems)
+    Args:
+        audio_file: str, path of the audio file of the soundscape.
+
+    Returns:
+        str, path of the folder, outfolder/stems/<name>_events
+    """
+    folder, name = osp.split(audio_file)
+    return osp.join(folder, STEMS_FOLDER, f"{osp.splitext(name)[0]}_events")
+
+
+def has_stems(audio_file):
+    """ Check if the stems of a soundscape have been saved """
+    return all(osp.exists(get_stem_file(audio_file, role)) for role in ROLES)
+
+
+def apply_reverb(audio, sr, reverb):
+    """ Apply the reverb of scaper (sox reverb) to an audio signal
+    Args:
+        audio: np.array, the audio signal.
+        sr: int, sample rate of the signal.
+        reverb: float, amount of reverb between 0 and 1 (see scaper.Scaper.generate).
+
+    Returns:
+        np.array, the signal with reverb, same length as the input.
+    """
+    import sox
+    tfm = sox.Transformer()
+    tfm.reverb(reverberance=reverb * 100)
+    out = tfm.build_array(input_array=audio, sample_rate_in=sr)[:len(audio)]
+    if len(out) < len(audio):
+        out = np.concatenate([out, np.zeros((len(audio) - len(out),) + audio.shape[1:], dtype=out.dtype)])
+    return out
+
+
+def save_stems(audio_file, events_folder=None, reverb=None, ir=None):
+    """ Sum the isolated events saved by scaper into a foreground and a background stem, and delete them.
+    The reverb is linear, so it is applied to each stem, the soundscape being the sum of the stems.
+
+    Args:
+        audio_file: str, path of the audio file of the soundscape.
+        events_folder: str, folder of the isolated events (scaper isolated_events_path),
+            default to get_events_folder(audio_file).
+        reverb: float, reverb applied to the soundscape with sox (None if no reverb).
+        ir: np.array, optional, impulse response of the reverb applied to the soundscape instead of sox
+            (see reverb.apply_reverb_batch).
+
+    Returns:
+        list, the paths of the stems saved.
+    """
+    if events_folder is None:
+        events_folder = get_events_folder(audio_file)
+    stems = {}
+    sr = None
+    for event_file in sorted(glob.glob(osp.join(events_folder, "*.wav"))):
+        audio, sr = sf.read(event_file, dtype='float32')
+        role = [r for r in ROLES if osp.basename(event_file).startswith(r)][0]
+        stems[role] = stems[role] + audio if role in stems else audio
+
+    for role in ROLES:
+        # A soundscape can have no foreground event
+        audio = stems.get(role, np.zeros_like(next(iter(stems.values()))))
+        if ir is not None:
+            audio = apply_reverb_batch(audio.T, ir).T
+        elif reverb is not None:
+            audio = apply_reverb(audio, sr, reverb)
+        stems[role] = audio
+    shutil.rmtree(events_folder)
+    return write_stems(audio_file, stems, sr)
+
+
+def write_stems(audio_file, stems, sr):
+    """ Save the stems of a soundscape (float32 wav files, see get_stem_file)
+    Args:
+        audio_file: str, path of the audio file of the soundscape.
+        stems: dict, {role: np.array} the stems.
+        sr: int, sample rate of the stems.
+
+    Returns:
+        list, the paths of the stems saved.
+    """
+    stem_files = []
+    for role in ROLES:
+        stem_file = get_stem_file(audio_file, role)
+        os.makedirs(osp.dirname(stem_file), exist_ok=True)
+        sf.write(stem_file, stems[role], sr, subtype='FLOAT')
+        stem_files.append(stem_file)
+    return stem_files
+
+
+def read_stems(audio_file):
+    """ Read the stems of a soundscape
+    Args:
+        audio_file: str, path of the audio file of the soundscape.
+
+    Returns:
+        tuple, (dict {role: np.array}, sample rate)
+    """
+    stems = {}
+    sr = None
+    for role in ROLES:
+        stems[role], sr = sf.read(get_stem_file(audio_file, role), dtype='float32')
+    return stems, sr
+
+
+def write_mix(audio_file, stems, sr, gains_db=None, subtype='PCM_16'):
+    """ Mix the stems of a soundscape with a gain per stem, and save the mixture
+    Args:
+        audio_file: str, path of the audio file to write, in the format of its extension (see encoding.write_audio).
+        stems: dict, {role: np.array} the stems (see read_stems).
+        sr: int, sample rate of the stems.
+        gains_db: dict, {role: float} gain in dB applied to the stems, the stems not in it are mixed as is.
+        subtype: str, subtype of the audio file written (see soundfile.write).
+
+    Returns:
+        np.array, the mixture written
+    """
+    if gains_db is None:
+        gains_db = {}
+    mix = sum(stems[role] * np.float32(10 ** (gains_db.get(role, 0) / 20.)) for role in ROLES)
+    # Clip as sox does when writing integer samples
+    mix = np.clip(mix, -1, 1)
+    write_audio(audio_file, mix, sr, subtype=subtype)
+    return mix
+
+
+def shift_audio(audio, n_shift):
+    """ Delay an audio signal by a number of samples, keeping its length (the end of the signal is truncated)
+    Args:
+        audio: np.array, the audio signal.
+        n_shift: int, number of samples of the delay (>= 0).
+
+    Returns:
+        np.array, the delayed signal.
+    """
+    shifted = np.zeros_like(audio)
+    if n_shift < len(audio):
+        shifted[n_shift:] = audio[:len(audio) - n_shift]
+    return shifted
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+""" Soundscapes generated on the fly, without writing any file (audio, JAMS or annotations).
+The events are sampled as in generate_training.py (same distributions as utils.add_event and utils.choose_class,
+see plan.sample_soundscapes), the too polyphonic soundscapes are sampled again, the audio is mixed in python
+(see mixer.py) and the annotations are post-processed in memory (see utils.post_process_events).
+The soundscapes are generated by a pool of processes in bounded queues, a training job can use fresh soundscapes
+indefinitely:
+
+    with SoundscapeStream(params, fg_folder, bg_folder, seed=2019, n_workers=4) as stream:
+        for audio, labels in stream:
+            ...
+"""
+import multiprocessing
+import queue
+import traceback
+import numpy as np
+import pandas as pd
+
+from soundbank import get_soundbank_index
+from utils import get_random_state, post_process_events
+from plan import sample_soundscapes
+from mixer import render_batch
+from reverb import get_reverb_params, get_ir, apply_reverb_batch
+
+
+def choose_main_classes(params, n_soundscapes, random_state=None):
+    """ Choose the main class of soundscapes following the 'prob' of the classes (as choose_class with 'event_prob')
+    Args:
+        params: dict, occurrences of events (event_occurences_XXX.json), keys are the main classes.
+        n_soundscapes: int, number of soundscapes.
+        random_state: np.random.RandomState, optional, the random state to use.
+
+    Returns:
+        np.array, the main class of each soundscape
+    """
+    if random_state is None:
+        random_state = np.random
+    classes = list(params.keys())
+    cum_prob = np.cumsum([params[class_lbl]['prob'] for class_lbl in classes])
+    ind = np.searchsorted(cum_prob / cum_prob[-1], random_state.uniform(size=n_soundscapes), side='right')
+    return np.asarray(classes, dtype=object)[np.minimum(ind, len(classes) - 1)]
+
+
+def get_strong_labels(df_soundscape, duration=10.0, min_dur_event=0.250, min_dur_inter=0.150):
+    """ Get the post-processed annotations of a soundscape of a plan, the same as the txt files post-processed
+    (see utils.post_processing_annotations)
+    Args:
+        df_soundscape: pd.DataFrame, the lines of the plan of a single soundscape (see plan.sample_plan).
+        duration: float, duration of the soundscape in seconds.
+        min_dur_event: float, optional in sec, minimum duration of an event
+        min_dur_inter: float, optional in sec, minimum duration between 2 events
+
+    Returns:
+        pd.DataFrame, the annotations (onset, offset, event_label) sorted by onset
+    """
+    df_fg = df_soundscape[df_soundscape['role'] == 'foreground']
+    df = pd.DataFrame({'onset': df_fg['event_time'].values,
+                       'offset': (df_fg['event_time'] + df_fg['event_duration']).values,
+                       'event_label': df_fg['label'].values})
+    df, _ = post_process_events(df, duration, min_dur_event, min_dur_inter)
+    return df.reset_index(drop=True)
+
+
+def generate_block(params, index, n_soundscapes, fg_folder, bg_folder, seed=0, duration=10.0, sr=44100, ref_db=-50,
+                   max_polyphony=3, pitch_step=None, reverb=0.1, ir_bank=None, cache=None, min_dur_event=0.250,
+                   min_dur_inter=0.150):
+    """ Generate a block of soundscapes in memory
+    Args:
+        params: dict, occurrences of events (event_occurences_XXX.json), keys are the main classes.
+        index: int, index of the block, the block only depends on the seed and its index (see utils.get_random_state).
+        n_soundscapes: int, number of soundscapes of the block.
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        seed: int, base seed of the stream.
+        duration: float, duration of the soundscapes in seconds.
+        sr: int, sample rate of the soundscapes.
+        ref_db: float, reference loudness of the background.
+        max_polyphony: int, optional, the soundscapes having a polyphony >= max_polyphony are sampled again.
+        pitch_step: float, optional, the pitch shifts are rounded to a grid of this step (see utils.quantize_pitch).
+        reverb: float, optional, reverberance of the synthetic impulse response (no reverb if None).
+        ir_bank: str, optional, folder of impulse responses used instead of the synthetic impulse response.
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files.
+        min_dur_event: float, optional in sec, minimum duration of an event (post-processing of the annotations)
+        min_dur_inter: float, optional in sec, minimum duration between 2 events (post-processing of the annotations)
+
+    Returns:
+        list, [(np.array the soundscape, float32, pd.DataFrame the annotations), ...] (the soundscapes still too
+        polyphonic after the trials are missing)
+    """
+    random_state = get_random_state(seed, index)
+    main_labels = choose_main_classes(params, n_soundscapes, random_state)
+    df_plan = sample_soundscapes(params, main_labels, fg_folder, bg_folder, duration, random_state,
+                                 max_polyphony=max_polyphony, pitch_step=pitch_step)
+    list_df_soundscapes = [df_soundscape for _, df_soundscape in df_plan.groupby('soundscape', sort=True)]
+    if len(list_df_soundscapes) == 0:
+        return []
+    stems = render_batch(list_df_soundscapes, sr, duration, ref_db, cache=cache)
+    mixes = stems['foreground'] + stems['background']
+    if reverb is not None or ir_bank is not None:
+        reverb_params = get_reverb_params(index, reverberance=reverb, ir_bank=ir_bank)
+        mixes = apply_reverb_batch(mixes, get_ir(reverb_params, sr))
+    mixes = np.clip(mixes, -1, 1)
+    return [(mix, get_strong_labels(df_soundscape, duration, min_dur_event, min_dur_inter))
+            for mix, df_soundscape in zip(mixes, list_df_soundscapes)]
+
+
+def _put(out_queue, item, stop_event):
+    """ Put an item in a bounded queue, waiting while it is full unless the stream is closed """
+    while not stop_event.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _worker(worker, n_workers, n_blocks, out_queue, stop_event, block_kwargs):
+    """ Generate the blocks worker, worker + n_workers, ... of a stream and put their soundscapes in the queue """
+    index = worker
+    try:
+        while (n_blocks is None or index < n_blocks) and not stop_event.is_set():
+            for audio, labels in generate_block(index=index, **block_kwargs):
+                if not _put(out_queue, (audio, labels), stop_event):
+                    break
+            index += n_workers
+    except Exception:
+        _put(out_queue, RuntimeError(f"Worker {worker} of the stream failed:\n{traceback.format_exc()}"), stop_event)
+    _put(out_queue, None, stop_event)
+    if stop_event.is_set():
+        # The stream is closed, the soundscapes still in the queue are not read
+        out_queue.cancel_join_thread()
+
+
+class SoundscapeStream:
+    """ Iterator of soundscapes generated on the fly by a pool of processes, yields (audio, labels) pairs:
+    the soundscape (np.array, float32, int(duration * sr) samples) and its post-processed annotations
+    (pd.DataFrame with the columns onset, offset, event_label).
+    Each worker generates blocks of batch_size soundscapes (see generate_block), the soundscapes wait in a queue of
+    at most prefetch soundscapes, the workers wait when it is full. The soundscapes are yielded as soon as they are
+    generated, so their order depends on the speed of the workers, the set of soundscapes only depends on the seed.
+
+    Args:
+        params: dict, occurrences of events (event_occurences_XXX.json), keys are the main classes.
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        n_soundscapes: int, optional, number of soundscapes to generate (fewer if soundscapes are still too
+            polyphonic after the trials), no limit if None.
+        seed: int, optional, base seed of the stream (random if None).
+        n_workers: int, number of processes generating the soundscapes.
+        prefetch: int, maximum number of soundscapes generated in advance.
+        batch_size: int, number of soundscapes generated in a single batch by a worker (see mixer.render_batch).
+        **kwargs: the parameters of the soundscapes (see generate_block): duration, sr, ref_db, max_polyphony,
+            pitch_step, reverb, ir_bank, cache, min_dur_event, min_dur_inter.
+    """
+    def __init__(self, params, fg_folder, bg_folder, n_soundscapes=None, seed=None, n_workers=2, prefetch=32,
+                 batch_size=1, **kwargs):
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        self.seed = seed
+        self.n_soundscapes = n_soundscapes
+        self.n_yielded = 0
+        # The indexes of the soundbanks are built once, the forked workers inherit them
+        get_soundbank_index(fg_folder)
+        get_soundbank_index(bg_folder)
+        n_blocks = None if n_soundscapes is None else -(-n_soundscapes // batch_size)
+        n_workers = n_workers if n_blocks is None else max(1, min(n_workers, n_blocks))
+        block_kwargs = dict(params=params, n_soundscapes=batch_size, fg_folder=fg_folder, bg_folder=bg_folder,
+                            seed=seed, **kwargs)
+        self.queue = multiprocessing.Queue(maxsize=prefetch)
+        self.stop_event = multiprocessing.Event()
+        self.workers = [multiprocessing.Process(target=_worker, daemon=True,
+                                                args=(worker, n_workers, n_blocks, self.queue, self.stop_event,
+                                                      block_kwargs))
+                        for worker in range(n_workers)]
+        self.n_running = n_workers
+        for process in self.workers:
+            process.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.n_running > 0 and (self.n_soundscapes is None or self.n_yielded < self.n_soundscapes):
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.workers):
+                    self.close()
+                    raise RuntimeError("The workers of the stream stopped without finishing")
+                continue
+            if item is None:
+                self.n_running -= 1
+                continue
+            if isinstance(item, Exception):
+                self.close()
+                raise item
+            self.n_yielded += 1
+            return item
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        """ Stop the workers (the soundscapes generated in advance are lost) """
+        self.stop_event.set()
+        for process in self.workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+        self.n_running = 0
+        self.queue.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
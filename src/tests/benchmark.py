@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+""" Benchmarks of the generation and of the processing of the annotations, on a synthetic soundbank (noise files
+with the labels of event_occurences_train.json) built offline.
+Each benchmark is timed at each dataset size, the results are appended to a json lines file (one line per benchmark
+and size, with the commit and the settings of the run), so the runs can be compared (--compare).
+
+    python benchmark.py --sizes 10 100 1000 --output benchmark.jsonl
+    python benchmark.py --compare old.jsonl benchmark.jsonl
+"""
+import os
+import os.path as osp
+import io
+import sys
+import copy
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+import scaper
+
+from utils import create_folder, pprint, get_random_state, choose_file, choose_class, add_event, read_jams, \
+    write_jams, get_scaper_annotation, rm_high_polyphony, post_processing_annotations, render_from_jams
+from plan import sample_soundscapes, plan_polyphony
+from mixer import render_jams_batch
+from generate_wav import generate_files
+from generate_eval_FBSNR import generate_new_bg_snr_files
+from generate_eval_var_onset import generate_new_fg_onset_files
+from stream import choose_main_classes
+from test_generation import create_soundbank
+
+BENCHMARKS = ["choose_file", "add_event", "sc_generate", "sample_soundscapes", "rm_high_polyphony",
+              "post_processing_annotations", "generate_files", "bg_snr_files", "fg_onset_files", "render_scaper",
+              "render_numpy"]
+# Benchmarks generating the audio with scaper, skipped without sox
+SOX_BENCHMARKS = ["sc_generate", "render_scaper"]
+
+
+def create_plan_jams(df_plan, outfolder, fg_folder, bg_folder, template_jams, duration=10.0, sr=16000):
+    """ Write the JAMS and txt files of the soundscapes of a plan, as scaper does (without sox)
+    Args:
+        df_plan: pd.DataFrame, the plan (see plan.sample_soundscapes).
+        outfolder: str, folder in which to write the files.
+        fg_folder: str, path of the foreground soundbank.
+        bg_folder: str, path of the background soundbank.
+        template_jams: str, a JAMS file generated by scaper, its annotation is filled with the events of the plan.
+        duration: float, duration of the soundscapes in seconds.
+        sr: int, sample rate of the soundscapes.
+
+    Returns:
+        list, the paths of the JAMS files
+    """
+    create_folder(outfolder)
+    template = read_jams(template_jams)
+    polyphony = plan_polyphony(df_plan)
+    list_jams = []
+    for n, df_soundscape in df_plan.groupby("soundscape"):
+        jam_dict = copy.deepcopy(template)
+        ann = get_scaper_annotation(jam_dict)
+        ann['data'] = []
+        for event in df_soundscape.itertuples():
+            value = {key: getattr(event, key) for key in ['label', 'source_file', 'source_time', 'event_time',
+                                                          'event_duration', 'snr', 'role']}
+            for key in ['pitch_shift', 'time_stretch']:
+                value[key] = None if pd.isnull(getattr(event, key)) else getattr(event, key)
+            ann['data'].append({'time': event.event_time, 'duration': event.event_duration, 'value': value,
+                                'confidence': 1.0})
+        ann['sandbox']['scaper'].update({'duration': duration, 'sr': sr, 'fg_path': fg_folder, 'bg_path': bg_folder,
+                                         'n_events': len(df_soundscape) - 1,
+                                         'polyphony_max': int(polyphony[n])})
+        jam_file = osp.join(outfolder, f"{n}.jams")
+        write_jams(jam_dict, jam_file)
+        df_fg = df_soundscape[df_soundscape['role'] == 'foreground']
+        pd.DataFrame({'onset': df_fg['event_time'], 'offset': df_fg['event_time'] + df_fg['event_duration'],
+                      'label': df_fg['label']}).to_csv(osp.splitext(jam_file)[0] + ".txt", header=False, index=False,
+                                                       sep="\t")
+        list_jams.append(jam_file)
+    return list_jams
+
+
+def create_dense_annotations(folder, n_files, n_events=50, labels=("Speech", "Dishes", "Dog"), duration=10.0,
+                             random_state=None):
+    """ Write txt annotation files with many short and overlapping events (worst case of the post-processing)
+    Args:
+        folder: str, folder in which to write the files.
+        n_files: int, number of files.
+        n_events: int, number of events per file.
+        labels: tuple, the labels of the events.
+        duration: float, duration of the files in seconds.
+        random_state: np.random.RandomState, optional, the random state to use.
+
+    Returns:
+        None
+    """
+    if random_state is None:
+        random_state = np.random.RandomState(0)
+    create_folder(folder)
+    for n in range(n_files):
+        onsets = random_state.uniform(0, duration, n_events)
+        df = pd.DataFrame({'onset': onsets, 'offset': onsets + random_state.exponential(0.5, n_events),
+                           'event_label': random_state.choice(labels, n_events)})
+        df.to_csv(osp.join(folder, f"{n}.txt"), header=False, index=False, sep="\t", float_format="%.3f")
+
+
+def add_events(params, n, fg_folder, bg_folder, seed, duration=10.0, ref_db=-50):
+    """ Specify the events of a soundscape with scaper, as the generation scripts before the plans (add_event)
+    Returns:
+        scaper.Scaper, the scaper object with the events specified
+    """
+    sc = scaper.Scaper(duration, fg_folder, bg_folder, random_state=get_random_state(seed, n))
+    sc.protected_labels = []
+    sc.ref_db = ref_db
+    sc.add_background(label=('choose', []), source_file=('choose', []), source_time=('const', 0))
+    class_lbl = choose_main_classes(params, 1, sc.random_state)[0]
+    add_event(sc, class_lbl, duration, fg_folder)
+    for _ in range(sc.random_state.randint(0, params[class_lbl]['event_max'])):
+        add_event(sc, choose_class(params[class_lbl], sc.random_state), duration, fg_folder)
+    return sc
+
+
+def run_benchmark(name, size, fixtures, n_jobs=1):
+    """ Run a benchmark (the fixtures it modifies are copied before, the copy is not timed)
+    Args:
+        name: str, the benchmark (see BENCHMARKS).
+        size: int, number of soundscapes (or annotation files) of the dataset.
+        fixtures: dict, the fixtures of this size (see create_fixtures).
+        n_jobs: int, number of processes of the functions having a n_jobs argument.
+
+    Returns:
+        float, the time in seconds
+    """
+    folder = fixtures["folder"]
+    params, fg_folder, bg_folder, seed = fixtures["params"], fixtures["fg_folder"], fixtures["bg_folder"], 2019
+    work_folder = osp.join(folder, "work")
+    if osp.exists(work_folder):
+        shutil.rmtree(work_folder)
+    shutil.copytree(fixtures["jams_folder"], work_folder)
+    labels = list(params.keys())
+    t = time.perf_counter()
+    if name == "choose_file":
+        random_state = np.random.RandomState(seed)
+        for cnt in range(size):
+            choose_file(osp.join(fg_folder, labels[cnt % len(labels)]), random_state)
+    elif name == "add_event":
+        for n in range(size):
+            add_events(params, n, fg_folder, bg_folder, seed)
+    elif name == "sc_generate":
+        for n in range(size):
+            sc = add_events(params, n, fg_folder, bg_folder, seed)
+            sc.generate(osp.join(work_folder, f"sc_{n}.wav"), osp.join(work_folder, f"sc_{n}.jams"),
+                        allow_repeated_label=True, allow_repeated_source=True, reverb=0.1,
+                        disable_sox_warnings=True, txt_path=osp.join(work_folder, f"sc_{n}.txt"))
+    elif name == "sample_soundscapes":
+        random_state = np.random.RandomState(seed)
+        sample_soundscapes(params, choose_main_classes(params, size, random_state), fg_folder, bg_folder,
+                           random_state=random_state, max_polyphony=3)
+    elif name == "rm_high_polyphony":
+        rm_high_polyphony(work_folder, 3, n_jobs=n_jobs)
+    elif name == "post_processing_annotations":
+        post_processing_annotations(fixtures["dense_folder"], output_folder=osp.join(folder, "dense_processed"),
+                                    output_csv=osp.join(folder, "dense.tsv"), length_sec=10.)
+    elif name == "generate_files":
+        generate_files(fixtures["list_jams"], work_folder, fg_folder, bg_folder, n_jobs=n_jobs,
+                       engine=fixtures["engine"])
+    elif name in ["render_scaper", "render_numpy"]:
+        # One clip at a time in this process, the time per clip of both engines (per_item_ms) gives the speed-up
+        for jam_file in fixtures["list_jams"]:
+            render_from_jams(jam_file, osp.join(work_folder, osp.splitext(osp.basename(jam_file))[0] + ".wav"),
+                             fg_folder, bg_folder, engine=name.split("_")[1])
+    elif name == "bg_snr_files":
+        generate_new_bg_snr_files(15, fixtures["stems_folder"], work_folder, n_jobs=n_jobs)
+    elif name == "fg_onset_files":
+        generate_new_fg_onset_files(5.0, fixtures["stems_folder"], work_folder, in_csv=fixtures["stems_csv"],
+                                    out_csv=osp.join(folder, "onset.tsv"), n_jobs=n_jobs)
+    else:
+        raise ValueError(f"Unknown benchmark {name}, choose between {BENCHMARKS}")
+    return time.perf_counter() - t
+
+
+def create_fixtures(folder, size, params, fg_folder, bg_folder, template_jams, sr=16000, engine="numpy"):
+    """ Create the datasets of a size: the JAMS of sampled soundscapes, dense annotation files and soundscapes
+    with their stems (to generate the variants from)
+    Args:
+        folder: str, folder of the fixtures of this size.
+        size: int, number of soundscapes (and annotation files).
+        params: dict, occurrences of events (event_occurences_XXX.json), keys are the main classes.
+        fg_folder: str, path of the foreground soundbank (see create_soundbank).
+        bg_folder: str, path of the background soundbank.
+        template_jams: str, a JAMS file generated by scaper (see create_plan_jams).
+        sr: int, sample rate of the soundbank and of the soundscapes.
+        engine: str, "scaper" or "numpy", engine generating the audio.
+
+    Returns:
+        dict, the fixtures
+    """
+    # Without the polyphony limit, so rm_high_polyphony removes soundscapes
+    random_state = np.random.RandomState(size)
+    df_plan = sample_soundscapes(params, choose_main_classes(params, size, random_state), fg_folder, bg_folder,
+                                 random_state=random_state)
+    jams_folder = osp.join(folder, "jams")
+    list_jams = create_plan_jams(df_plan, jams_folder, fg_folder, bg_folder, template_jams, sr=sr)
+    create_dense_annotations(osp.join(folder, "dense"), size, random_state=np.random.RandomState(size))
+
+    stems_folder = osp.join(folder, "stems_soundscapes")
+    plan_stems = sample_soundscapes(params, choose_main_classes(params, size, random_state), fg_folder, bg_folder,
+                                    random_state=random_state, max_polyphony=3)
+    stems_jams = create_plan_jams(plan_stems, stems_folder, fg_folder, bg_folder, template_jams, sr=sr)
+    render_jams_batch(stems_jams, [osp.splitext(jam_file)[0] + ".wav" for jam_file in stems_jams], keep_stems=True)
+    stems_csv = osp.join(folder, "stems_soundscapes.tsv")
+    post_processing_annotations(stems_folder, output_csv=stems_csv, length_sec=10.)
+    return {"folder": folder, "params": params, "fg_folder": fg_folder, "bg_folder": bg_folder,
+            "jams_folder": jams_folder, "list_jams": list_jams, "dense_folder": osp.join(folder, "dense"),
+            "stems_folder": stems_folder, "stems_csv": stems_csv, "engine": engine}
+
+
+def get_run_info():
+    """ Get the information identifying a run: commit, versions and machine """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "scaper": scaper.__version__, "machine": platform.node(), "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare_results(reference_file, results_file):
+    """ Compare the times of two benchmark runs (json lines files), the last result of each benchmark and size
+    Args:
+        reference_file: str, the results of the reference run.
+        results_file: str, the results of the new run.
+
+    Returns:
+        pd.DataFrame, the times of both runs and their ratio (new / reference), for the benchmarks of both runs
+    """
+    dfs = []
+    for results in [reference_file, results_file]:
+        df = pd.read_json(results, lines=True)
+        dfs.append(df[df["seconds"].notnull()].drop_duplicates(["benchmark", "size"], keep="last")
+                   .set_index(["benchmark", "size"])["seconds"])
+    df = pd.concat(dfs, axis=1, keys=["reference", "new"], join="inner")
+    df["ratio"] = df["new"] / df["reference"]
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs="+", default=[10, 100],
+                        help="Number of soundscapes (and annotation files) of the datasets")
+    parser.add_argument('--benchmarks', type=str, nargs="+", default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--n-files', type=int, default=4, help="Number of files per label of the soundbank")
+    parser.add_argument('--sr', type=int, default=16000, help="Sample rate of the soundbank and of the soundscapes")
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1, help="Number of runs of each benchmark, the best is kept")
+    parser.add_argument('--engine', type=str, default="numpy", choices=["scaper", "numpy"],
+                        help="Engine of generate_files, scaper needs sox")
+    parser.add_argument('--folder', type=str, default=osp.join("generated", "benchmark"))
+    parser.add_argument('--output', type=str, default="benchmark.jsonl",
+                        help="json lines file to which the results are appended")
+    parser.add_argument('--compare', type=str, nargs=2, default=None, metavar=("REFERENCE", "NEW"),
+                        help="Only compare the results of two runs")
+    args = parser.parse_args()
+    pprint(vars(args))
+    if args.compare is not None:
+        print(compare_results(*args.compare).to_string())
+        sys.exit(0)
+
+    with open(osp.join("..", "event_occurences_train.json")) as json_file:
+        params = json.load(json_file)
+    template_jams = osp.join("material", "post_processing", "7.jams")
+    run_info = dict(get_run_info(), n_files=args.n_files, sr=args.sr, jobs=args.jobs, engine=args.engine)
+    has_sox = shutil.which("sox") is not None
+    if osp.exists(args.folder):
+        shutil.rmtree(args.folder)
+    # Synthetic soundbank: noise files of random durations, n_files per label
+    fg_folder, bg_folder = osp.join(args.folder, "soundbank", "foreground"), osp.join(args.folder, "soundbank",
+                                                                                      "background")
+    labels = sorted(set(params) | set(c for class_params in params.values() for c in class_params["event_class"]))
+    create_soundbank(fg_folder, labels, args.n_files, args.sr)
+    create_soundbank(bg_folder, ["sins"], args.n_files, args.sr)
+    for size in args.sizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fixtures = create_fixtures(osp.join(args.folder, str(size)), size, params, fg_folder, bg_folder,
+                                       template_jams, args.sr, args.engine)
+        for name in args.benchmarks:
+            result = dict(run_info, benchmark=name, size=size, seconds=None)
+            if not has_sox and (name in SOX_BENCHMARKS or (name == "generate_files" and args.engine == "scaper")):
+                result["skipped"] = "sox is not installed"
+            else:
+                # The functions benchmarked print their progress
+                with contextlib.redirect_stdout(io.StringIO()):
+                    times = [run_benchmark(name, size, fixtures, args.jobs) for _ in range(args.repeat)]
+                result.update(seconds=round(min(times), 6), per_item_ms=round(1000 * min(times) / size, 4))
+            print(f"{name:<30} size {size:<8} {result.get('seconds')} s {result.get('skipped', '')}")
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+import os
+import os.path as osp
+import shutil
+import zipfile
+import threading
+import functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from utils import create_folder
+from get_background_training import md5sum, download_file, get_background_training
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """ Serve the files of a folder, with range requests (as zenodo), and count the bytes sent """
+    bytes_sent = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path.split("?")[0])
+        if "Range" not in self.headers or not osp.isfile(path):
+            return super().do_GET()
+        start = int(self.headers["Range"].split("=")[1].split("-")[0])
+        size = osp.getsize(path)
+        if start >= size:
+            self.send_response(416)
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+        RangeRequestHandler.bytes_sent += len(data)
+        self.wfile.write(data)
+
+
+def create_sins(folder, n_zips=3, n_files=4):
+    """ Create zip files like the SINS dataset: a meta zip (meta.txt) and audio zips, half of the files are "other"
+    Args:
+        folder: str, folder in which to create the zip files.
+        n_zips: int, number of audio zip files.
+        n_files: int, number of audio files per zip file.
+
+    Returns:
+        tuple, (list of the names of the zip files, list of the names of the "other" files)
+    """
+    create_folder(folder)
+    meta, others, zip_names = [], [], []
+    for i in range(1, n_zips + 1):
+        zip_names.append(f"DCASE2018-task5-dev.audio.{i}.zip")
+        with zipfile.ZipFile(osp.join(folder, zip_names[-1]), "w") as z:
+            for cnt in range(n_files):
+                filename = f"DevNode{i}_ex{cnt}.wav"
+                label = "other" if cnt % 2 == 0 else "cooking"
+                z.writestr(f"DCASE2018-task5-dev/audio/{filename}", os.urandom(10000 + cnt))
+                meta.append(f"audio/{filename}\t{label}\tDevNode{i}")
+                if label == "other":
+                    others.append(filename)
+    with zipfile.ZipFile(osp.join(folder, "DCASE2018-task5-dev.meta.zip"), "w") as z:
+        z.writestr("DCASE2018-task5-dev/meta.txt", "\n".join(meta) + "\n")
+    return zip_names, others
+
+
+def test_download(folder):
+    """ The downloads are streamed, resumed and checked, and only the "other" files are extracted """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    server_folder = osp.join(folder, "server")
+    zip_names, others = create_sins(server_folder)
+    server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                 functools.partial(RangeRequestHandler, directory=server_folder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        checksums = {name: md5sum(osp.join(server_folder, name)) for name in os.listdir(server_folder)}
+
+        # Resume an interrupted download: only the missing bytes are sent
+        download_folder = osp.join(folder, "download")
+        create_folder(download_folder)
+        zip_file = osp.join(download_folder, zip_names[0])
+        with open(osp.join(server_folder, zip_names[0]), "rb") as f:
+            content = f.read()
+        with open(zip_file + ".part", "wb") as f:
+            f.write(content[:1000])
+        RangeRequestHandler.bytes_sent = 0
+        download_file(f"{base_url}/{zip_names[0]}?download=1", zip_file, checksums[zip_names[0]])
+        assert md5sum(zip_file) == checksums[zip_names[0]] and not osp.exists(zip_file + ".part"), \
+            "Problem download_file, resume"
+        assert RangeRequestHandler.bytes_sent == len(content) - 1000, "Problem download_file, not resumed"
+
+        # A corrupted part file is downloaded again, a wrong checksum raises an error
+        with open(zip_file + ".part", "wb") as f:
+            f.write(b"0" * 1000)
+        os.remove(zip_file)
+        download_file(f"{base_url}/{zip_names[0]}", zip_file, checksums[zip_names[0]])
+        assert md5sum(zip_file) == checksums[zip_names[0]], "Problem download_file, corrupted part file"
+        try:
+            download_file(f"{base_url}/{zip_names[1]}", osp.join(download_folder, zip_names[1]), "0" * 32)
+            raise AssertionError("Problem download_file, wrong checksum")
+        except IOError:
+            pass
+
+        soundbank = osp.join(folder, "soundbank")
+        extracted = get_background_training(soundbank, meta_url=f"{base_url}/DCASE2018-task5-dev.meta.zip?download=1",
+                                            audio_urls=[f"{base_url}/{name}?download=1" for name in zip_names],
+                                            checksums=checksums, n_jobs=2)
+        assert sorted(os.listdir(osp.join(soundbank, "background", "sins"))) == sorted(others), \
+            "Problem get_background_training, not only the other files"
+        assert len(extracted) == len(others), "Problem get_background_training, files extracted"
+        assert not osp.exists(osp.join(soundbank, "DCASE2018-task5-dev")), "Problem get_background_training, zips"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    test_download(osp.join("generated", "download"))
@@ -0,0 +1,799 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+# Initial software
+# Copyright Nicolas Turpault, Romain Serizel, Justin Salamon, Ankit Parag Shah, 2019, v1.0
+# This software is distributed under the terms of the License MIT
+#########################################################################
+import os
+import time
+import os.path as osp
+import shutil
+import glob
+import json
+import numpy as np
+import pandas as pd
+import soundfile as sf
+
+import jams
+from utils import create_folder, write_jams, read_jams, get_jams_events, read_annotations, set_desed_sandbox, \
+    get_desed_sandbox, get_length_sec, is_valid_audio, get_scaper_annotation, render_from_jams, move_background_snr
+from generate_eval_FBSNR import modify_bg_snr, generate_new_bg_snr_files
+from generate_eval_var_onset import modify_fg_onset, generate_new_fg_onset_files
+from plan import sample_plan, save_plan, load_plan, plan_polyphony
+from reverb import synthetic_ir, apply_reverb_batch, get_reverb_params, get_ir
+from stems import get_events_folder, save_stems, has_stems, read_stems, write_mix
+from generate_eval_distortions import generate_distorted_files
+from degradation import DEGRADATIONS, smartphone_ir, degrade
+from mixer import integrated_loudness, pitch_shift, process_event, render_jams, render_jams_batch
+from generate_wav import generate_files_sharded, generate_files, SourceHashes, select_changed, index_rendered, \
+    get_source_files, RENDER_INDEX
+from encoding import AudioEncoder, encode_file
+from features import FeatureReader, write_labels, log_mel, power_spectrogram, FEATURES_FOLDER
+from shards import list_files, open_file, file_exists
+from stream import SoundscapeStream, generate_block
+from soundbank import get_soundbank_index
+from manifest import RunManifest, get_run_seed, process_generated, MANIFEST_FILENAME
+
+
+def create_soundbank(folder, labels, n_files=4, sr=16000, random_state=None):
+    """ Create a soundbank of noise files with random durations, (one subfolder per label)
+    Args:
+        folder: str, path of the soundbank to create.
+        labels: list, labels (subfolders) of the soundbank.
+        n_files: int, number of files per label.
+        sr: int, sample rate of the files.
+        random_state: np.random.RandomState, optional, the random state to use.
+
+    Returns:
+        None
+    """
+    if random_state is None:
+        random_state = np.random.RandomState(0)
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    for label in labels:
+        create_folder(osp.join(folder, label))
+        for cnt in range(n_files):
+            duration = random_state.uniform(0.3, 12)
+            sf.write(osp.join(folder, label, f"{cnt}.wav"), 0.1 * random_state.randn(int(duration * sr)), sr)
+
+
+def test_sample_plan(folder, param_file):
+    with open(param_file) as json_file:
+        params = json.load(json_file)
+    labels = sorted(set(params) | set(c for class_params in params.values() for c in class_params["event_class"]))
+    fg_folder = osp.join(folder, "foreground")
+    bg_folder = osp.join(folder, "background")
+    create_soundbank(fg_folder, labels)
+    create_soundbank(bg_folder, ["sins"])
+
+    df = sample_plan(params, 100, fg_folder, bg_folder, random_state=np.random.RandomState(2019))
+    df_fg = df[df.role == "foreground"]
+    df_bg = df[df.role == "background"]
+    assert len(df_bg) == df.soundscape.nunique() == 100, "Problem sample_plan, one background per soundscape"
+    main_labels = df_fg.groupby("soundscape")["label"].first()
+    for class_lbl, class_params in params.items():
+        assert (main_labels == class_lbl).sum() == int(100 * class_params['prob']), \
+            "Problem sample_plan, main class of the soundscapes"
+    assert (df_fg.event_time >= 0).all() and (df_fg.event_time + df_fg.event_duration <= 10 + 1e-9).all(), \
+        "Problem sample_plan, events outside of the soundscape"
+    assert df_fg.snr.between(6, 30).all() and df_fg.pitch_shift.between(-3, 3).all(), \
+        "Problem sample_plan, snr or pitch_shift"
+    for event in df_fg.itertuples():
+        assert osp.basename(osp.dirname(event.source_file)) == event.label, "Problem sample_plan, source file"
+        # Events without onset and offset last the whole soundscape (scaper adjusts them to the source file)
+        if "_nOn_nOff" not in event.label:
+            assert event.source_time + event.event_duration <= sf.info(event.source_file).duration + 1e-6, \
+                "Problem sample_plan, event longer than its source file"
+
+    # Quantized pitch shifts
+    df = sample_plan(params, 100, fg_folder, bg_folder, random_state=np.random.RandomState(2019), pitch_step=0.25)
+    pitch_shift = df.loc[df.role == "foreground", "pitch_shift"].values
+    assert np.allclose(pitch_shift * 4, np.round(pitch_shift * 4)) and len(np.unique(pitch_shift)) <= 25, \
+        "Problem sample_plan, pitch shifts not quantized"
+    df = sample_plan(params, 100, fg_folder, bg_folder, random_state=np.random.RandomState(2019))
+
+    # Same seed gives the same plan, and the plan can be saved and loaded
+    plan_file = osp.join(folder, "plan.csv")
+    save_plan(sample_plan(params, 100, fg_folder, bg_folder, random_state=np.random.RandomState(2019)), plan_file)
+    pd.testing.assert_frame_equal(df, load_plan(plan_file), check_dtype=False)
+
+
+def test_plan_polyphony(folder, param_file):
+    """ The polyphony is computed on the plan, and too polyphonic soundscapes are sampled again before rendering """
+    with open(param_file) as json_file:
+        params = json.load(json_file)
+    fg_folder = osp.join(folder, "foreground")
+    bg_folder = osp.join(folder, "background")
+    labels = sorted(set(params) | set(c for class_params in params.values() for c in class_params["event_class"]))
+    create_soundbank(fg_folder, labels)
+    create_soundbank(bg_folder, ["sins"])
+
+    df = sample_plan(params, 100, fg_folder, bg_folder, random_state=np.random.RandomState(2019))
+    polyphony = plan_polyphony(df)
+    # Brute force polyphony, sampling the time every ms
+    times = np.arange(0, 10, 0.001)
+    for soundscape, df_sc in df[df.role == "foreground"].groupby("soundscape"):
+        onsets = df_sc.event_time.values[:, None]
+        offsets = onsets + df_sc.event_duration.values[:, None]
+        active = ((onsets <= times) & (times < offsets)).sum(axis=0)
+        assert polyphony[soundscape] == active.max(), "Problem plan_polyphony"
+    assert (polyphony >= 3).any(), "The test needs polyphonic soundscapes"
+
+    df = sample_plan(params, 100, fg_folder, bg_folder, random_state=np.random.RandomState(2019), max_polyphony=3)
+    assert (plan_polyphony(df) < 3).all(), "Problem sample_plan, polyphonic soundscapes not sampled again"
+    assert df.soundscape.nunique() == 100, "Problem sample_plan, not the number of soundscapes asked"
+
+
+def test_modify_jams(jam_file, folder):
+    """ The JAMS modified without the jams package are still valid JAMS with the expected values """
+    create_folder(folder)
+    out_jams = osp.join(folder, "bg_snr.jams")
+    write_jams(modify_bg_snr(15, jam_file), out_jams)
+    ann = jams.load(out_jams).annotations[0]
+    assert [obs.value["snr"] for obs in ann.data if obs.value["role"] == "background"] == [15], \
+        "Problem modify_bg_snr"
+
+    out_jams = osp.join(folder, "fg_onset.jams")
+    jam_dict = modify_fg_onset(5., jam_file)
+    write_jams(jam_dict, out_jams)
+    ann = jams.load(out_jams).annotations[0]
+    ref_ann = jams.load(jam_file).annotations[0]
+    ref_onsets = sorted(obs.time + 5. for obs in ref_ann.data if obs.value["role"] == "foreground")
+    assert [obs.time for obs in ann.data if obs.value["role"] == "foreground"] == ref_onsets, \
+        "Problem modify_fg_onset"
+    df = get_jams_events(jam_dict)
+    assert (df.time.diff().dropna() >= 0).all(), "Problem modify_fg_onset, events not sorted"
+    assert (df.loc[df.role == "foreground", "time"] == df.loc[df.role == "foreground", "event_time"]).all(), \
+        "Problem modify_fg_onset, time and event_time differ"
+
+    # Parameters not handled by scaper are kept in the sandbox, the JAMS is still valid
+    set_desed_sandbox(out_jams, pitch_step=0.25)
+    jams.load(out_jams)
+    assert get_desed_sandbox(read_jams(out_jams)) == {"pitch_step": 0.25}, "Problem set_desed_sandbox"
+
+
+def create_stems(jam_file, folder, sr=16000, duration=10.0, random_state=None):
+    """ Create a soundscape with its stems from a JAMS, (noise instead of the sources, like scaper isolated events)
+    Args:
+        jam_file: str, the JAMS file of the soundscape (copied in folder).
+        folder: str, folder in which to save the soundscape.
+        sr: int, sample rate of the soundscape.
+        duration: float, duration of the soundscape in seconds.
+        random_state: np.random.RandomState, optional, the random state to use.
+
+    Returns:
+        str, path of the audio file of the soundscape
+    """
+    if random_state is None:
+        random_state = np.random.RandomState(0)
+    create_folder(folder)
+    shutil.copy(jam_file, folder)
+    audio_file = osp.join(folder, osp.splitext(osp.basename(jam_file))[0] + ".wav")
+    events_folder = get_events_folder(audio_file)
+    create_folder(events_folder)
+    df = get_jams_events(read_jams(jam_file))
+    n_samples = int(duration * sr)
+    cnt = {"foreground": 0, "background": 0}
+    for event in df.itertuples():
+        audio = np.zeros(n_samples)
+        start = int(event.event_time * sr)
+        stop = min(n_samples, int((event.event_time + event.event_duration) * sr))
+        audio[start:stop] = 0.05 * random_state.randn(stop - start)
+        sf.write(osp.join(events_folder, f"{event.role}{cnt[event.role]}_{event.label}.wav"), audio, sr,
+                 subtype='FLOAT')
+        cnt[event.role] += 1
+    save_stems(audio_file)
+    stems, sr = read_stems(audio_file)
+    write_mix(audio_file, stems, sr)
+    return audio_file
+
+
+def test_bg_snr_stems(jam_file, folder):
+    """ The FBSNR variants are a gain-and-sum of the stems of the base soundscape """
+    base_folder = osp.join(folder, "30dB")
+    audio_file = create_stems(jam_file, base_folder)
+    assert has_stems(audio_file) and not osp.exists(get_events_folder(audio_file)), "Problem save_stems"
+    stems, sr = read_stems(audio_file)
+    ref, _ = sf.read(audio_file)
+    assert np.allclose(ref, stems["foreground"] + stems["background"], atol=1e-4), "Problem save_stems, not the sum"
+
+    out_folder = osp.join(folder, "15dB")
+    create_folder(out_folder)
+    generate_new_bg_snr_files(15, base_folder, out_folder)
+    audio, _ = sf.read(osp.join(out_folder, osp.basename(audio_file)))
+    expected = np.clip(stems["foreground"] + 10 ** (15 / 20.) * stems["background"], -1, 1)
+    assert np.allclose(audio, expected, atol=1e-4), "Problem generate_new_bg_snr_files, background gain"
+    df = get_jams_events(read_jams(osp.join(out_folder, osp.basename(jam_file))))
+    assert (df.loc[df.role == "background", "snr"] == 15).all(), "Problem generate_new_bg_snr_files, JAMS"
+
+
+def create_local_jams(jam_file, folder, sr=16000):
+    """ Copy a JAMS in folder with its sources created in folder/soundbank (see create_sources)
+    Returns:
+        str, path of the JAMS copied
+    """
+    soundbank = osp.join(folder, "soundbank")
+    create_sources(jam_file, soundbank, sr)
+    jam_dict = read_jams(jam_file)
+    for obs in get_scaper_annotation(jam_dict)["data"]:
+        value = obs["value"]
+        value["source_file"] = osp.join(soundbank, value["role"], value["label"], osp.basename(value["source_file"]))
+    sandbox = get_scaper_annotation(jam_dict)["sandbox"]["scaper"]
+    sandbox["fg_path"], sandbox["bg_path"] = osp.join(soundbank, "foreground"), osp.join(soundbank, "background")
+    out_jams = osp.join(folder, osp.basename(jam_file))
+    write_jams(jam_dict, out_jams)
+    return out_jams
+
+
+def test_bg_snr_render(jam_file, folder):
+    """ Without stems, the FBSNR variants are generated again with the engine of the base soundscapes """
+    base_folder = osp.join(folder, "30dB")
+    create_folder(base_folder)
+    base_jams = create_local_jams(jam_file, base_folder)
+    render_jams(base_jams, osp.splitext(base_jams)[0] + ".wav")
+
+    audio_file = osp.splitext(osp.basename(jam_file))[0] + ".wav"
+    out_folder = osp.join(folder, "15dB")
+    create_folder(out_folder)
+    generate_new_bg_snr_files(15, base_folder, out_folder, engine="numpy")
+    out_jams = osp.join(out_folder, osp.basename(jam_file))
+    audio, _ = sf.read(osp.splitext(out_jams)[0] + ".wav", dtype='float32')
+    expected = render_jams(out_jams, osp.join(folder, "expected.wav"))
+    assert np.allclose(audio, expected, atol=1e-4), "Problem generate_new_bg_snr_files, not rendered by the engine"
+
+    # The background SNR moved to ref_db gives the same soundscape (what scaper generates, see render_from_jams)
+    jam_dict = read_jams(out_jams)
+    assert move_background_snr(jam_dict) == 15, "Problem move_background_snr"
+    moved_jams = osp.join(folder, "moved.jams")
+    write_jams(jam_dict, moved_jams)
+    assert np.allclose(render_jams(moved_jams, osp.join(folder, "moved.wav")), expected, atol=1e-4), \
+        "Problem move_background_snr, not the same gains"
+
+    # The variants are the same with or without the stems of the base soundscapes, for each engine
+    engines = ["numpy"] if shutil.which("sox") is None else ["numpy", "scaper"]
+    for engine in engines:
+        stems_folder = osp.join(folder, f"30dB_stems_{engine}")
+        create_folder(stems_folder)
+        shutil.copy(base_jams, stems_folder)
+        render_from_jams(base_jams, osp.join(stems_folder, osp.basename(audio_file)), keep_stems=True, engine=engine)
+        no_stems_folder = osp.join(folder, f"30dB_{engine}")
+        create_folder(no_stems_folder)
+        shutil.copy(base_jams, no_stems_folder)
+        variants = []
+        for in_folder in [stems_folder, no_stems_folder]:
+            variant_folder = in_folder + "_15dB"
+            create_folder(variant_folder)
+            generate_new_bg_snr_files(15, in_folder, variant_folder, engine=engine)
+            variants.append(sf.read(osp.join(variant_folder, osp.basename(audio_file)))[0])
+        assert np.allclose(variants[0], variants[1], atol=1e-3), \
+            f"Problem generate_new_bg_snr_files, not the same with and without stems ({engine})"
+
+
+def test_fg_onset_stems(jam_file, folder):
+    """ The onset variants are a shift of the foreground stem of the base soundscape, with the same annotations """
+    base_folder = osp.join(folder, "500ms")
+    audio_file = create_stems(jam_file, base_folder)
+    stems, sr = read_stems(audio_file)
+    in_csv = osp.join(folder, "500ms.csv")
+    pd.DataFrame({'filename': [audio_file] * 2, 'onset': [0.5, 3.], 'offset': [2., 6.],
+                  'event_label': ['Dog', 'Cat']}).to_csv(in_csv, sep="\t", index=False)
+
+    out_folder = osp.join(folder, "5500ms")
+    create_folder(out_folder)
+    out_csv = osp.join(folder, "5500ms.csv")
+    generate_new_fg_onset_files(5., base_folder, out_folder, in_csv=in_csv, out_csv=out_csv)
+    audio, _ = sf.read(osp.join(out_folder, osp.basename(audio_file)))
+    n_shift = 5 * sr
+    expected = stems["background"].copy()
+    expected[n_shift:] += stems["foreground"][:-n_shift]
+    assert np.allclose(audio, np.clip(expected, -1, 1), atol=1e-4), "Problem generate_new_fg_onset_files, shift"
+    df = read_annotations(out_csv)
+    assert df.onset.tolist() == [5.5, 8.] and df.offset.tolist() == [7., 10.], \
+        "Problem generate_new_fg_onset_files, annotations"
+
+
+def test_fg_onset_render(jam_file, folder):
+    """ Without stems, the onset variants are generated again with the engine of the base soundscapes """
+    base_folder = osp.join(folder, "500ms")
+    create_folder(base_folder)
+    base_jams = create_local_jams(jam_file, base_folder)
+    render_jams(base_jams, osp.splitext(base_jams)[0] + ".wav")
+
+    out_folder = osp.join(folder, "5500ms")
+    create_folder(out_folder)
+    generate_new_fg_onset_files(5., base_folder, out_folder, engine="numpy")
+    out_jams = osp.join(out_folder, osp.basename(jam_file))
+    audio, _ = sf.read(osp.splitext(out_jams)[0] + ".wav", dtype='float32')
+    expected = render_jams(out_jams, osp.join(folder, "expected.wav"))
+    assert np.allclose(audio, expected, atol=1e-4), "Problem generate_new_fg_onset_files, not rendered by the engine"
+
+
+def test_fft_reverb(folder):
+    """ The FFT reverb is a convolution truncated to the length of the signals, for a batch of signals """
+    sr = 16000
+    random_state = np.random.RandomState(0)
+    ir = synthetic_ir(0.1, sr)
+    assert ir[0] == 1 and len(ir) == int(0.005 * sr) + int(0.29 * sr), "Problem synthetic_ir"
+    assert np.isclose(np.sum(ir[1:].astype(float) ** 2), 1, atol=1e-3), "Problem synthetic_ir, energy of the tail"
+    audio = random_state.randn(3, sr).astype(np.float32)
+    out = apply_reverb_batch(audio, ir)
+    assert out.shape == audio.shape, "Problem apply_reverb_batch, shape"
+    for signal, signal_out in zip(audio, out):
+        assert np.allclose(np.convolve(signal, ir)[:sr], signal_out, atol=1e-3), "Problem apply_reverb_batch"
+
+    # Impulse responses of a bank, used in turn
+    create_folder(folder)
+    for cnt in range(2):
+        sf.write(osp.join(folder, f"ir{cnt}.wav"), synthetic_ir(0.5, 8000, seed=cnt), 8000, subtype='FLOAT')
+    params = [get_reverb_params(n, ir_bank=folder) for n in range(3)]
+    assert [osp.basename(p["ir"]) for p in params] == ["ir0.wav", "ir1.wav", "ir0.wav"], "Problem get_reverb_params"
+    assert len(get_ir(params[0], sr)) == 2 * len(synthetic_ir(0.5, 8000)), "Problem get_ir, not resampled"
+
+
+def create_sources(jam_file, folder, sr=16000, random_state=None):
+    """ Create noise files with the names of the sources of a JAMS (folder/role/label/name.wav), 7s long
+    Args:
+        jam_file: str, the JAMS file of the soundscape.
+        folder: str, folder in which to save the sources.
+        sr: int, sample rate of the sources.
+        random_state: np.random.RandomState, optional, the random state to use.
+
+    Returns:
+        None
+    """
+    if random_state is None:
+        random_state = np.random.RandomState(0)
+    for event in get_jams_events(read_jams(jam_file)).itertuples():
+        label_folder = osp.join(folder, event.role, event.label)
+        create_folder(label_folder)
+        sf.write(osp.join(label_folder, osp.basename(event.source_file)), 0.1 * random_state.randn(7 * sr), sr)
+
+
+def test_numpy_mixer(jam_file, folder):
+    """ The python engine places the events and normalizes them to ref_db + snr, as scaper """
+    sr = 16000
+    t = np.arange(2 * sr) / sr
+    # ITU-R BS.1770: a full scale 997Hz sine is at -3.01 LUFS
+    assert np.isclose(integrated_loudness(np.sin(2 * np.pi * 997 * t), sr), -3.01, atol=0.1), \
+        "Problem integrated_loudness"
+    shifted = pitch_shift(np.sin(2 * np.pi * 440 * t), sr, -3)
+    assert len(shifted) == len(t), "Problem pitch_shift, length"
+    assert np.isclose(np.argmax(np.abs(np.fft.rfft(shifted))) / 2., 440 * 2 ** (-3 / 12.), atol=1), \
+        "Problem pitch_shift, frequency"
+
+    # Without reverb
+    jam_dict = read_jams(jam_file)
+    jam_dict["annotations"][0]["sandbox"]["scaper"]["reverb"] = None
+    create_folder(folder)
+    dry_jams = osp.join(folder, osp.basename(jam_file))
+    write_jams(jam_dict, dry_jams)
+    df = get_jams_events(jam_dict)
+    create_sources(jam_file, osp.join(folder, "soundbank"))
+
+    audio_file = osp.join(folder, osp.splitext(osp.basename(jam_file))[0] + ".wav")
+    fg_path, bg_path = osp.join(folder, "soundbank", "foreground"), osp.join(folder, "soundbank", "background")
+    mix = render_jams(dry_jams, audio_file, fg_path, bg_path, keep_stems=True)
+    stems, sr = read_stems(audio_file)
+    assert len(mix) == 10 * 44100 and sr == 44100, "Problem render_jams, length"
+    assert np.allclose(sf.read(audio_file)[0], stems["foreground"] + stems["background"], atol=1e-4), \
+        "Problem render_jams, not the sum of the stems"
+    assert np.isclose(integrated_loudness(stems["background"], sr), -50, atol=0.1), "Problem render_jams, ref_db"
+    active = np.zeros(len(mix), dtype=bool)
+    for event in df[df.role == "foreground"].itertuples():
+        event = event._replace(source_file=osp.join(fg_path, event.label, osp.basename(event.source_file)))
+        audio, onset = process_event(event, sr, 10.0, -50)
+        assert np.isclose(integrated_loudness(audio, sr), -50 + event.snr, atol=0.1), "Problem process_event, snr"
+        active[onset:onset + len(audio)] = True
+    assert not np.any(stems["foreground"][~active]), "Problem render_jams, placement of the events"
+
+
+def test_engines(jam_file, folder, tolerance=0.5):
+    """ The python engine gives the loudness and rms of scaper (sox) within tolerance dB, with and without pitch shift
+    and reverb (skipped without sox). The tolerance is not validated yet: the differences measured are printed. """
+    if shutil.which("sox") is None:
+        print("sox is not installed, test_engines skipped")
+        return
+    create_folder(folder)
+    create_sources(jam_file, osp.join(folder, "soundbank"))
+    fg_path, bg_path = osp.join(folder, "soundbank", "foreground"), osp.join(folder, "soundbank", "background")
+    # Without pitch shift nor reverb, only the placement, fades and gains are compared
+    jam_dict = read_jams(jam_file)
+    ann = get_scaper_annotation(jam_dict)
+    ann["sandbox"]["scaper"]["reverb"] = None
+    for obs in ann["data"]:
+        obs["value"]["pitch_shift"] = None
+    dry_jams = osp.join(folder, "dry.jams")
+    write_jams(jam_dict, dry_jams)
+    for name, jams_to_render in [("dry", dry_jams), ("pitch shift and reverb", jam_file)]:
+        mixes = {}
+        for engine in ["scaper", "numpy"]:
+            audio_file = osp.join(folder, f"{engine}.wav")
+            render_from_jams(jams_to_render, audio_file, fg_path, bg_path, engine=engine)
+            mixes[engine], sr = sf.read(audio_file)
+        assert mixes["scaper"].shape == mixes["numpy"].shape, "Problem engines, not the same length"
+        loudness = {engine: integrated_loudness(mix, sr) for engine, mix in mixes.items()}
+        rms = {engine: 20 * np.log10(np.sqrt(np.mean(mix ** 2))) for engine, mix in mixes.items()}
+        error = np.abs(mixes["scaper"] - mixes["numpy"])
+        print(f"Engines, {name}: loudness difference {abs(loudness['scaper'] - loudness['numpy']):.3f} dB, "
+              f"rms difference {abs(rms['scaper'] - rms['numpy']):.3f} dB, "
+              f"sample error max {error.max():.2e} mean {error.mean():.2e}")
+        assert np.isclose(loudness["scaper"], loudness["numpy"], atol=tolerance), f"Problem engines, loudness ({name})"
+        assert np.isclose(rms["scaper"], rms["numpy"], atol=tolerance), f"Problem engines, rms ({name})"
+
+
+def test_batch_mixer(list_jams, folder):
+    """ Generating soundscapes by batch gives the same soundscapes as generating them one by one """
+    fg_path, bg_path = osp.join(folder, "soundbank", "foreground"), osp.join(folder, "soundbank", "background")
+    for jam_file in list_jams:
+        create_sources(jam_file, osp.join(folder, "soundbank"))
+    audio_files = [osp.join(folder, osp.splitext(osp.basename(jam_file))[0] + ".wav") for jam_file in list_jams]
+    out_jams = [osp.join(folder, osp.basename(jam_file)) for jam_file in list_jams]
+    mixes = render_jams_batch(list_jams, audio_files, fg_path, bg_path, jams_outfiles=out_jams, keep_stems=True)
+    assert mixes.shape == (len(list_jams), 10 * 44100), "Problem render_jams_batch, shape"
+    for jam_file, audio_file, mix in zip(list_jams, audio_files, mixes):
+        single = render_jams(jam_file, osp.join(folder, "single.wav"), fg_path, bg_path)
+        assert np.allclose(mix, single, atol=1e-6), "Problem render_jams_batch, not the same as render_jams"
+        stems, _ = read_stems(audio_file)
+        assert np.allclose(sf.read(audio_file)[0], stems["foreground"] + stems["background"], atol=1e-4), \
+            "Problem render_jams_batch, stems"
+    # The synthetic impulse response replacing the reverb of sox is not saved, the JAMS are still generated with sox
+    assert all("reverb" not in get_desed_sandbox(read_jams(jam_file)) for jam_file in out_jams), \
+        "Problem render_jams_batch, synthetic reverb saved in the JAMS"
+
+    # All the soundscapes of a batch have the same duration
+    jam_dict = read_jams(list_jams[0])
+    jam_dict["annotations"][0]["sandbox"]["scaper"]["duration"] = 5.0
+    short_jams = osp.join(folder, "short.jams")
+    write_jams(jam_dict, short_jams)
+    try:
+        render_jams_batch([list_jams[0], short_jams], audio_files, fg_path, bg_path)
+        raise AssertionError("Problem render_jams_batch, different durations in a batch")
+    except ValueError:
+        pass
+
+
+def test_distortions(jam_file, folder):
+    """ The degraded soundscapes keep their length, their annotations are shifted by the delay of the degradation """
+    base_folder = osp.join(folder, "30dB")
+    audio_file = create_stems(jam_file, base_folder)
+    audio, sr = sf.read(audio_file)
+    txt_file = osp.splitext(audio_file)[0] + ".txt"
+    df = pd.DataFrame({'onset': [0.5, 9.999], 'offset': [2., 10.], 'event_label': ['Dog', 'Cat']})
+    df.to_csv(txt_file, header=False, index=False, sep="\t")
+    in_csv = osp.join(folder, "30dB.csv")
+    df.assign(filename=audio_file).to_csv(in_csv, sep="\t", index=False)
+
+    out_folder = osp.join(folder, "distorted")
+    generate_distorted_files(base_folder, out_folder, in_csv=in_csv, seed=0, n_jobs=2)
+    delay = np.argmax(np.abs(smartphone_ir(sr, "speaker"))) / sr
+    for name in DEGRADATIONS:
+        degraded, _ = sf.read(osp.join(out_folder, name, osp.basename(audio_file)))
+        assert len(degraded) == len(audio) and not np.allclose(degraded, audio, atol=1e-3), f"Problem {name}"
+        df_name = read_annotations(osp.join(out_folder, name + ".csv"))
+        expected = delay if name.startswith("smartPhone") else 0
+        assert np.allclose(df_name.onset, df.onset[:len(df_name)] + expected, atol=1e-3), f"Problem {name}, annotations"
+        assert df_name.offset.max() <= 10 and osp.dirname(df_name.filename[0]) == osp.join(out_folder, name), \
+            f"Problem {name}, annotations"
+    # The delay of the smartphones moves the last event after the end of the soundscape
+    assert len(read_annotations(osp.join(out_folder, "smartPhonePlayback.csv"))) == 1, "Problem annotations, duration"
+    clipped, _ = sf.read(osp.join(out_folder, "unit_applyClippingAlternative", osp.basename(audio_file)))
+    assert np.isclose(np.mean(np.abs(clipped) > 0.999), 0.01, atol=0.002), "Problem clipping, percent of samples"
+
+    # The noise of a soundscape only depends on its id, not on the other files of the folder
+    other_folder = osp.join(folder, "other")
+    create_folder(other_folder)
+    shutil.copy(audio_file, osp.join(other_folder, "0.wav"))
+    shutil.copy(audio_file, osp.join(other_folder, osp.basename(audio_file)))
+    other_out = osp.join(folder, "distorted_other")
+    generate_distorted_files(other_folder, other_out, degradations=["smartPhonePlayback"])
+    assert np.array_equal(sf.read(osp.join(other_out, "smartPhonePlayback", osp.basename(audio_file)))[0],
+                          sf.read(osp.join(out_folder, "smartPhonePlayback", osp.basename(audio_file)))[0]), \
+        "Problem distortions, the noise depends on the other soundscapes"
+    try:
+        degrade(np.stack([audio, audio], axis=1), sr, "unit_applyLowpassFilter")
+        raise AssertionError("Problem degrade, multichannel signal")
+    except ValueError:
+        pass
+
+
+def test_sharded_generation(list_jams, folder):
+    """ The soundscapes generated in a sharded folder are the same as the ones generated in a flat folder """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    fg_path, bg_path = osp.join(folder, "soundbank", "foreground"), osp.join(folder, "soundbank", "background")
+    for jam_file in list_jams:
+        create_sources(jam_file, osp.join(folder, "soundbank"))
+    sharded_dir = osp.join(folder, "sharded")
+    generate_files_sharded(list_jams, sharded_dir, fg_path, bg_path, n_jobs=2, engine="numpy", block_size=1)
+    assert len(list_files(sharded_dir, ".wav")) == len(list_jams), "Problem generate_files_sharded"
+    for jam_file in list_jams:
+        name = osp.splitext(osp.basename(jam_file))[0]
+        single = render_jams(jam_file, osp.join(folder, "single.wav"), fg_path, bg_path)
+        with open_file(osp.join(sharded_dir, name + ".wav")) as f:
+            assert np.allclose(sf.read(f)[0], single, atol=1e-4), "Problem generate_files_sharded, audio"
+        assert file_exists(osp.join(sharded_dir, name + ".txt")), "Problem generate_files_sharded, txt"
+
+    # Resume: the soundscapes already in the shards are not generated again, the JAMS of the shards can be generated
+    generate_files_sharded(list_files(sharded_dir, ".jams"), sharded_dir, fg_path, bg_path, skip_valid=True,
+                           engine="numpy")
+    assert len(glob.glob(osp.join(sharded_dir, "*.tar"))) == 1, "Problem generate_files_sharded, resume"
+
+    # The manifest of a sharded folder records the files of the shards, and is processed in the shards
+    manifest = RunManifest(sharded_dir, seed=2019)
+    for jam_file in list_files(sharded_dir, ".jams"):
+        manifest.add_soundscape(jam_file)
+    assert sorted(manifest.records[7]["checksums"]) == ["7.jams", "7.txt", "7.wav"], "Problem RunManifest, sharded"
+    assert process_generated(manifest, osp.join(folder, "sharded.csv"), length_sec=10.) == [5, 7], \
+        "Problem process_generated, sharded"
+    assert manifest.pending([5, 7]) == [], "Problem RunManifest, sharded files not complete"
+
+
+def test_encoding(list_jams, folder):
+    """ The soundscapes are encoded while the next ones are generated, the readers accept the compressed files """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    fg_path, bg_path = osp.join(folder, "soundbank", "foreground"), osp.join(folder, "soundbank", "background")
+    for jam_file in list_jams:
+        create_sources(jam_file, osp.join(folder, "soundbank"))
+    wav_folder, flac_folder = osp.join(folder, "wav"), osp.join(folder, "flac")
+    for out_folder in [wav_folder, flac_folder]:
+        create_folder(out_folder)
+        with AudioEncoder("flac" if out_folder == flac_folder else "wav", n_workers=2) as encoder:
+            generate_files(list_jams, out_folder, fg_path, bg_path, n_jobs=2, engine="numpy", encoder=encoder)
+    for jam_file in list_jams:
+        name = osp.splitext(osp.basename(jam_file))[0]
+        assert not osp.exists(osp.join(flac_folder, name + ".wav")), "Problem AudioEncoder, wav file not removed"
+        flac, _ = sf.read(osp.join(flac_folder, name + ".flac"), dtype='int16')
+        wav, _ = sf.read(osp.join(wav_folder, name + ".wav"), dtype='int16')
+        assert np.array_equal(flac, wav), "Problem AudioEncoder, FLAC is not lossless"
+        assert get_length_sec(osp.join(flac_folder, name + ".wav")) == 10., "Problem get_length_sec, FLAC file"
+
+    # The FBSNR variants of compressed soundscapes are in the same format
+    base_folder = osp.join(folder, "30dB")
+    audio_file = create_stems(list_jams[0], base_folder)
+    stems, sr = read_stems(audio_file)
+    encode_file(audio_file, "flac", remove=False)
+    assert encode_file(audio_file, "opus") == osp.splitext(audio_file)[0] + ".opus", "Problem encode_file, opus"
+    assert is_valid_audio(osp.splitext(audio_file)[0] + ".opus", len(stems["foreground"]), sr), \
+        "Problem encode_file, opus resampled"
+    os.remove(osp.splitext(audio_file)[0] + ".opus")
+    out_folder = osp.join(folder, "15dB")
+    create_folder(out_folder)
+    generate_new_bg_snr_files(15, base_folder, out_folder)
+    audio, _ = sf.read(osp.join(out_folder, osp.splitext(osp.basename(audio_file))[0] + ".flac"))
+    expected = np.clip(stems["foreground"] + 10 ** (15 / 20.) * stems["background"], -1, 1)
+    assert np.allclose(audio, expected, atol=1e-4), "Problem generate_new_bg_snr_files, FLAC soundscape"
+
+
+def test_features(list_jams, folder):
+    """ The log-mel features are computed during the generation, with frame-level labels of the annotations """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    sr = 16000
+    t = np.arange(sr) / sr
+    power = power_spectrogram(np.sin(2 * np.pi * 1000 * t), n_fft=1024, hop_length=256)
+    assert power.shape == (1 + sr // 256, 513) and np.argmax(power[10]) == 64, "Problem power_spectrogram"
+
+    fg_path, bg_path = osp.join(folder, "soundbank", "foreground"), osp.join(folder, "soundbank", "background")
+    for jam_file in list_jams:
+        create_sources(jam_file, osp.join(folder, "soundbank"))
+    out_folder = osp.join(folder, "soundscapes")
+    create_folder(out_folder)
+    for jam_file in list_jams:
+        shutil.copy(osp.splitext(jam_file)[0] + ".txt", out_folder)
+    params = {"n_fft": 1024, "hop_length": 256, "n_mels": 40}
+    with AudioEncoder("flac", n_workers=2, feature_params=params) as encoder:
+        generate_files(list_jams, out_folder, fg_path, bg_path, n_jobs=2, engine="numpy", encoder=encoder)
+    classes = write_labels(osp.join(out_folder, FEATURES_FOLDER))
+
+    reader = FeatureReader(osp.join(out_folder, FEATURES_FOLDER))
+    assert sorted(reader.ids()) == ["5", "7"] and reader.classes == classes, "Problem FeatureWriter, ids"
+    for jam_file in list_jams:
+        soundscape_id = osp.splitext(osp.basename(jam_file))[0]
+        audio, sr = sf.read(osp.join(out_folder, soundscape_id + ".flac"), dtype='float32')
+        features = reader.load(soundscape_id)
+        assert isinstance(features, np.memmap) and features.shape == (1 + len(audio) // 256, 40), \
+            "Problem FeatureReader, shape"
+        assert np.allclose(features, log_mel(audio, sr, params), atol=1e-2), "Problem FeatureWriter, features"
+        df = pd.read_csv(osp.splitext(jam_file)[0] + ".txt", sep="\t", names=["onset", "offset", "event_label"])
+        labels = reader.labels(soundscape_id)
+        times = reader.times()
+        for event in df.itertuples():
+            column = labels[:, classes.index(event.event_label)]
+            assert column[(times >= event.onset + 0.05) & (times < event.offset - 0.05)].all(), \
+                "Problem write_labels, event not labelled"
+        assert labels[times >= max(df["offset"]) + 0.05].sum() == 0, "Problem write_labels, label after the events"
+
+
+def test_stream(folder, param_file):
+    """ The soundscapes are generated on the fly by workers, without writing any file """
+    with open(param_file) as json_file:
+        params = json.load(json_file)
+    labels = sorted(set(params) | set(c for class_params in params.values() for c in class_params["event_class"]))
+    fg_folder = osp.join(folder, "foreground")
+    bg_folder = osp.join(folder, "background")
+    create_soundbank(fg_folder, labels)
+    create_soundbank(bg_folder, ["sins"])
+    # The indexes of the soundbanks are written before listing the files
+    get_soundbank_index(fg_folder)
+    get_soundbank_index(bg_folder)
+    files = sorted(glob.glob(osp.join(folder, "**"), recursive=True))
+
+    kwargs = dict(sr=16000, max_polyphony=3)
+    with SoundscapeStream(params, fg_folder, bg_folder, n_soundscapes=6, seed=2019, n_workers=2, prefetch=2,
+                          batch_size=2, **kwargs) as stream:
+        soundscapes = list(stream)
+    assert len(soundscapes) == 6, "Problem SoundscapeStream, number of soundscapes"
+    assert sorted(glob.glob(osp.join(folder, "**"), recursive=True)) == files, "Problem SoundscapeStream, files"
+
+    # Same soundscapes as the blocks generated in this process, whatever the worker
+    expected = [soundscape for index in range(3)
+                for soundscape in generate_block(params, index, 2, fg_folder, bg_folder, seed=2019, **kwargs)]
+    assert sorted(audio.sum() for audio, _ in soundscapes) == sorted(audio.sum() for audio, _ in expected), \
+        "Problem SoundscapeStream, not the soundscapes of the seed"
+    for audio, df in soundscapes:
+        assert audio.dtype == np.float32 and audio.shape == (160000,), "Problem SoundscapeStream, audio"
+        assert list(df.columns) == ["onset", "offset", "event_label"] and len(df) > 0, \
+            "Problem SoundscapeStream, labels"
+        assert (df.onset >= 0).all() and (df.offset <= 10).all() and (df.offset - df.onset >= 0.25 - 1e-6).all(), \
+            "Problem SoundscapeStream, labels not post-processed"
+        for _, df_label in df.groupby("event_label"):
+            assert (df_label.onset.values[1:] - df_label.offset.values[:-1] >= 0.15 - 1e-6).all(), \
+                "Problem SoundscapeStream, events of a class not merged"
+
+    # Without limit, the stream is stopped by the consumer
+    stream = SoundscapeStream(params, fg_folder, bg_folder, seed=2019, n_workers=2, prefetch=2, **kwargs)
+    for cnt, (audio, _) in enumerate(stream):
+        if cnt == 4:
+            break
+    workers = stream.workers
+    stream.close()
+    assert all(not process.is_alive() for process in workers), "Problem SoundscapeStream, close"
+
+
+def test_manifest(list_jams, folder):
+    """ The soundscapes generated are recorded in the manifest, a run is resumed and processed incrementally """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    fg_path, bg_path = osp.join(folder, "soundbank", "foreground"), osp.join(folder, "soundbank", "background")
+    for jam_file in list_jams:
+        create_sources(jam_file, osp.join(folder, "soundbank"))
+    out_folder = osp.join(folder, "soundscapes")
+    create_folder(out_folder)
+    for jam_file in list_jams:
+        shutil.copy(jam_file, out_folder)
+        shutil.copy(osp.splitext(jam_file)[0] + ".txt", out_folder)
+    list_jams = [osp.join(out_folder, osp.basename(jam_file)) for jam_file in list_jams]
+    out_csv = osp.join(folder, "soundscapes.csv")
+
+    # The run is interrupted after the soundscape 7
+    manifest = RunManifest(out_folder, seed=2019)
+    with AudioEncoder("flac", n_workers=2, manifest=manifest) as encoder:
+        generate_files(list_jams[1:], out_folder, fg_path, bg_path, engine="numpy", encoder=encoder)
+    assert sorted(manifest.records[7]["checksums"]) == ["7.flac", "7.jams", "7.txt"], "Problem RunManifest, files"
+    assert process_generated(manifest, out_csv, length_sec=10.) == [7], "Problem process_generated"
+    with open(osp.join(out_folder, MANIFEST_FILENAME), "a") as f:
+        f.write("5\tgenera")
+
+    # Resumed with the seed of the run, only the soundscape 5 is generated and processed
+    assert get_run_seed(out_folder) == 2019, "Problem get_run_seed"
+    try:
+        RunManifest(out_folder, seed=1)
+        raise AssertionError("Problem RunManifest, resumed with another seed")
+    except ValueError:
+        pass
+    manifest = RunManifest(out_folder, seed=2019)
+    assert manifest.status(7) == "post_processed" and manifest.pending([5, 7]) == [5], "Problem RunManifest, resume"
+    with AudioEncoder("wav", manifest=manifest) as encoder:
+        generate_files(list_jams[:1], out_folder, fg_path, bg_path, engine="numpy", encoder=encoder)
+    assert process_generated(manifest, out_csv, length_sec=10.) == [5], "Problem process_generated, resume"
+    df = read_annotations(out_csv)
+    assert sorted(df.filename.apply(osp.basename).unique()) == ["5.wav", "7.flac"], "Problem process_generated, csv"
+
+    # Interrupted after writing the annotations of 5, before its record: they are not added twice
+    manifest.add_soundscape(osp.join(out_folder, "5.jams"))
+    assert process_generated(manifest, out_csv, length_sec=10.) == [5], "Problem process_generated, processed again"
+    assert read_annotations(out_csv).equals(df), "Problem process_generated, annotations added twice"
+
+    # A modified file is generated again
+    with open(osp.join(out_folder, "5.txt"), "a") as f:
+        f.write("0.0\t1.0\tSpeech\n")
+    os.utime(osp.join(out_folder, "5.txt"), (time.time() + 10, time.time() + 10))
+    assert RunManifest(out_folder, seed=2019).pending([5, 7]) == [5], "Problem RunManifest, modified file"
+
+    # The polyphony filter only checks the soundscapes generated since the last time
+    manifest.add_soundscape(osp.join(out_folder, "7.jams"))
+    assert process_generated(manifest, out_csv, max_polyphony=1, length_sec=10.) == [], \
+        "Problem process_generated, polyphony"
+    assert manifest.status(7) == "removed" and not osp.exists(osp.join(out_folder, "7.jams")) and \
+        osp.exists(osp.join(out_folder, "5.jams")), "Problem process_generated, soundscape removed"
+    assert RunManifest(out_folder, seed=1, restart=True).records == {}, "Problem RunManifest, restart"
+
+
+def test_incremental_rebuild(list_jams, folder):
+    """ Only the soundscapes whose events or source files changed are rendered again """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    fg_path, bg_path = osp.join(folder, "soundbank", "foreground"), osp.join(folder, "soundbank", "background")
+    for jam_file in list_jams:
+        create_sources(jam_file, osp.join(folder, "soundbank"))
+    out_folder = osp.join(folder, "soundscapes")
+    create_folder(out_folder)
+    for jam_file in list_jams:
+        shutil.copy(jam_file, out_folder)
+    list_jams = [osp.join(out_folder, osp.basename(jam_file)) for jam_file in list_jams]
+    hash_file = osp.join(folder, "source_hashes.tsv")
+
+    def rebuild():
+        hashes = SourceHashes(hash_file)
+        changed = select_changed(list_jams, out_folder, hashes, fg_path, bg_path, engine="numpy")
+        to_render = [jam_file for jam_file, reason in changed if reason != "missing_source"]
+        generate_files(to_render, out_folder, fg_path, bg_path, engine="numpy")
+        index_rendered(to_render, out_folder, hashes, fg_path, bg_path, engine="numpy")
+        hashes.save()
+        return [(osp.basename(jam_file), reason) for jam_file, reason in changed]
+
+    assert rebuild() == [("5.jams", "new"), ("7.jams", "new")], "Problem select_changed, first rendering"
+    assert rebuild() == [], "Problem select_changed, nothing changed"
+    assert SourceHashes(hash_file).update(get_source_files(list_jams[0], fg_path, bg_path)) == 0, \
+        "Problem SourceHashes, the hashes are not kept"
+
+    # A source file of the soundscape 7 only: touched without change, then modified
+    source_file = sorted(set(get_source_files(list_jams[1], fg_path, bg_path)) -
+                         set(get_source_files(list_jams[0], fg_path, bg_path)))[0]
+    audio, sr = sf.read(source_file)
+    os.utime(source_file, (time.time() + 10, time.time() + 10))
+    assert rebuild() == [], "Problem select_changed, source file touched"
+    sf.write(source_file, audio[::-1], sr)
+    audio_before, _ = sf.read(osp.join(out_folder, "7.wav"))
+    assert rebuild() == [("7.jams", "changed")], "Problem select_changed, source file modified"
+    assert not np.array_equal(sf.read(osp.join(out_folder, "7.wav"))[0], audio_before), \
+        "Problem select_changed, soundscape not rendered again"
+
+    # Events modified, and audio file missing
+    jam_dict = read_jams(list_jams[0])
+    get_scaper_annotation(jam_dict)['data'][1]['value']['snr'] += 1
+    write_jams(jam_dict, list_jams[0])
+    os.remove(osp.join(out_folder, "7.wav"))
+    assert rebuild() == [("5.jams", "changed"), ("7.jams", "missing")], "Problem select_changed, events modified"
+    assert rebuild() == [], "Problem index_rendered"
+
+    # A source file removed is reported, the soundscape is not rendered
+    os.rename(source_file, source_file + ".moved")
+    assert rebuild() == [("7.jams", "missing_source")], "Problem select_changed, source file missing"
+    os.rename(source_file + ".moved", source_file)
+    assert rebuild() == [], "Problem select_changed, source file restored"
+
+    # Without index, the soundscapes already rendered are indexed instead of rendered again
+    os.remove(osp.join(out_folder, RENDER_INDEX))
+    os.remove(osp.join(out_folder, "7.wav"))
+    assert rebuild() == [("7.jams", "new")], "Problem select_changed, index not seeded from the rendered soundscapes"
+    assert rebuild() == [], "Problem select_changed, seeded index"
+
+
+if __name__ == '__main__':
+    test_sample_plan(osp.join("generated", "plan"), osp.join("..", "event_occurences_train.json"))
+    test_plan_polyphony(osp.join("generated", "plan_polyphony"), osp.join("..", "event_occurences_train.json"))
+    test_modify_jams(osp.join("material", "post_processing", "7.jams"), osp.join("generated", "modify_jams"))
+    test_bg_snr_stems(osp.join("material", "post_processing", "7.jams"), osp.join("generated", "bg_snr_stems"))
+    test_bg_snr_render(osp.join("material", "post_processing", "7.jams"), osp.join("generated", "bg_snr_render"))
+    test_fg_onset_stems(osp.join("material", "post_processing", "7.jams"), osp.join("generated", "fg_onset_stems"))
+    test_fg_onset_render(osp.join("material", "post_processing", "7.jams"), osp.join("generated", "fg_onset_render"))
+    test_fft_reverb(osp.join("generated", "ir_bank"))
+    test_numpy_mixer(osp.join("material", "post_processing", "7.jams"), osp.join("generated", "numpy_mixer"))
+    test_engines(osp.join("material", "post_processing", "7.jams"), osp.join("generated", "engines"))
+    test_distortions(osp.join("material", "post_processing", "7.jams"), osp.join("generated", "distortions"))
+    test_batch_mixer([osp.join("material", "post_processing", f"{n}.jams") for n in [5, 7]],
+                     osp.join("generated", "batch_mixer"))
+    test_sharded_generation([osp.join("material", "post_processing", f"{n}.jams") for n in [5, 7]],
+                            osp.join("generated", "sharded_generation"))
+    test_encoding([osp.join("material", "post_processing", f"{n}.jams") for n in [5, 7]],
+                  osp.join("generated", "encoding"))
+    test_features([osp.join("material", "post_processing", f"{n}.jams") for n in [5, 7]],
+                  osp.join("generated", "features"))
+    test_stream(osp.join("generated", "stream"), osp.join("..", "event_occurences_train.json"))
+    test_manifest([osp.join("material", "post_processing", f"{n}.jams") for n in [5, 7]],
+                  osp.join("generated", "manifest"))
+    test_incremental_rebuild([osp.join("material", "post_processing", f"{n}.jams") for n in [5, 7]],
+                             osp.join("generated", "incremental_rebuild"))
@@ -9,7 +9,15 @@ import os.path as osp
 import pandas as pd
 import shutil
 import glob
-from utils import create_folder, post_processing_annotations, rm_high_polyphony
+import time
+import numpy as np
+import soundfile as sf
+from utils import create_folder, post_processing_annotations, rm_high_polyphony, get_random_state, map_jobs, \
+    choose_class, is_valid_audio, choose_file, get_file_duration, merge_events, get_length_sec, \
+    AnnotationWriter, read_annotations
+from soundbank import build_soundbank_index, INDEX_FILENAME
+from audio_cache import AudioCache
+from shards import pack_folder, ShardWriter, ShardReader, list_files, open_file, file_exists, remove_files
 
 
 def test_postprocessing(folder, checked_folder, out_csv):
@@ -44,7 +52,217 @@ def test_high_polyphony(folder, n_pol):
     rm_high_polyphony(folder, max_polyphony=n_pol)
 
 
+def draw_classes(index, seed=2019):
+    class_params = {"event_class": ["Cat", "Dog", "Speech"], "event_prob": [20, 30, 50]}
+    random_state = get_random_state(seed, index)
+    return [choose_class(class_params, random_state) for _ in range(10)]
+
+
+def test_random_state():
+    """ The soundscapes have to be the same whatever the number of jobs used to generate them """
+    list_args = [(n,) for n in range(8)]
+    serial = map_jobs(draw_classes, list_args, n_jobs=1)
+    parallel = map_jobs(draw_classes, list_args, n_jobs=3)
+    assert serial == parallel, "Problem get_random_state, parallel generation differs from serial generation"
+    assert draw_classes(0) != draw_classes(1), "Problem get_random_state, same random state for different indexes"
+
+
+def test_valid_audio(folder):
+    create_folder(folder)
+    wav_file = osp.join(folder, "valid.wav")
+    sf.write(wav_file, np.zeros(16000), 16000)
+    assert is_valid_audio(wav_file, 16000), "Problem is_valid_audio with a valid file"
+    assert not is_valid_audio(wav_file, 44100), "Problem is_valid_audio with a wrong number of samples"
+    assert not is_valid_audio(osp.join(folder, "missing.wav")), "Problem is_valid_audio with a missing file"
+    with open(wav_file, "rb") as f:
+        header = f.read(20)
+    truncated_file = osp.join(folder, "truncated.wav")
+    with open(truncated_file, "wb") as f:
+        f.write(header)
+    assert not is_valid_audio(truncated_file), "Problem is_valid_audio with a truncated file"
+
+
+def test_soundbank_index(folder):
+    """ The index has to give the same files and durations as reading the soundbank folder """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    for label, durations in {"Cat": [0.5, 1.], "Dog": [2., 0.25, 3.]}.items():
+        create_folder(osp.join(folder, label))
+        for cnt, duration in enumerate(durations):
+            sf.write(osp.join(folder, label, f"{cnt}.wav"), np.zeros(int(duration * 16000)), 16000)
+    df = build_soundbank_index(folder)
+    assert osp.exists(osp.join(folder, INDEX_FILENAME)), "Problem build_soundbank_index, index not saved"
+    assert list(df.label) == ["Cat", "Cat", "Dog", "Dog", "Dog"], "Problem build_soundbank_index, wrong files"
+
+    class_path = osp.join(folder, "Dog")
+    chosen_file = choose_file(class_path, get_random_state(2019, 0))
+    source_files = sorted(glob.glob(os.path.join(class_path, "*")))
+    assert chosen_file == source_files[get_random_state(2019, 0).randint(0, len(source_files))], \
+        "Problem choose_file, different from choosing in the folder"
+    assert get_file_duration(osp.join(class_path, "2.wav")) == 3., "Problem get_file_duration"
+    # The same file spelled differently, after the index is loaded
+    assert get_file_duration(osp.abspath(osp.join(class_path, "2.wav"))) == 3., \
+        "Problem get_file_duration, path spelled differently"
+
+    # Only the modified files are read again
+    sf.write(osp.join(folder, "Cat", "1.wav"), np.zeros(4000), 16000)
+    df = build_soundbank_index(folder)
+    assert list(df.duration) == [0.5, 0.25, 2., 0.25, 3.], "Problem build_soundbank_index, modified file not updated"
+
+
+def test_merge_events():
+    """ Each rule of post_processing_annotations on a single class, and a class not affecting the other """
+    onsets = np.array([0., 0.5, 1., 1.1, 3., 3.2, 5., 5.3, 9.9])
+    offsets = np.array([2., 1.5, 1.05, 2.5, 3.1, 4., 6., 7., 9.95])
+    labels = np.array(["Cat", "Cat", "Dog", "Dog", "Cat", "Cat", "Cat", "Dog", "Cat"])
+    keep, new_offsets, fix_count = merge_events(onsets, offsets, labels, length_sec=10.)
+    # Cat: [0, 2] contains [0.5, 1.5], [3, 3.1] is extended to 3.25 and merged with [3.2, 4] (onsets < 400ms),
+    # [9.9, 9.95] is too short and can't be extended
+    # Dog: [1, 1.05] is merged with [1.1, 2.5] (pause < 150ms)
+    assert list(keep) == [True, False, True, False, True, False, True, True, False], "Problem merge_events, keep"
+    assert list(new_offsets[keep]) == [2., 2.5, 4., 6., 7.], "Problem merge_events, offsets"
+    assert fix_count == 4, "Problem merge_events, fix count"
+
+
+def test_length_sec(folder):
+    """ The length is read in the header of the audio file, or in the JAMS file if there is no audio file """
+    assert get_length_sec(osp.join(folder, "5.wav")) == 10., "Problem get_length_sec with the audio file"
+    assert get_length_sec(osp.join(folder, "missing.wav"), osp.join(folder, "5.jams")) == 10., \
+        "Problem get_length_sec with the JAMS file"
+    assert get_length_sec(osp.join(folder, "missing.wav")) is None, "Problem get_length_sec without file"
+
+
+def test_annotation_writer(folder):
+    """ The annotations written block by block are the same in csv and parquet, and as with pandas to_csv """
+    create_folder(folder)
+    columns = {'filename': str, 'onset': float, 'offset': float, 'event_label': str}
+    df1 = pd.DataFrame({'filename': ['1.wav', '1.wav'], 'onset': [0.1234, 1.], 'offset': [2., 3.5],
+                        'event_label': ['Speech', 'Dog']})
+    df2 = pd.DataFrame({'filename': ['2.wav'], 'onset': [4.], 'offset': [9.9999], 'event_label': ['Cat']})
+    df_ref = pd.concat([df1, df2], ignore_index=True)
+    ref_csv = osp.join(folder, "ref.csv")
+    df_ref.to_csv(ref_csv, sep="\t", index=False, float_format="%.3f")
+    for ext in ["csv", "parquet"]:
+        out_file = osp.join(folder, f"annotations.{ext}")
+        with AnnotationWriter(out_file, columns, float_format="%.3f") as writer:
+            writer.write(df1)
+            writer.write(df2)
+        pd.testing.assert_frame_equal(read_annotations(out_file), read_annotations(ref_csv))
+    with open(osp.join(folder, "annotations.csv")) as f_out, open(ref_csv) as f_ref:
+        assert f_out.read() == f_ref.read(), "Problem AnnotationWriter, not the same csv as pandas"
+
+
+def test_audio_cache(folder):
+    """ The cached files are resampled, memory-mapped, decoded again when modified, and the least used are deleted """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    soundbank = osp.join(folder, "soundbank")
+    create_folder(osp.join(soundbank, "Dog"))
+    random_state = np.random.RandomState(0)
+    files = []
+    for cnt in range(3):
+        files.append(osp.join(soundbank, "Dog", f"{cnt}.wav"))
+        sf.write(files[-1], 0.1 * random_state.randn(16000), 16000)
+
+    cache = AudioCache(osp.join(folder, "cache"))
+    cached_file = cache.get_file(files[0], 8000)
+    assert cached_file == osp.join(cache.get_folder(soundbank, 8000), "Dog", "0.wav"), "Problem AudioCache, mirror"
+    audio = cache.load(files[0], 8000)
+    assert isinstance(audio, np.memmap) and audio.dtype == np.float32 and len(audio) == 8000, \
+        "Problem AudioCache, not resampled or not memory-mapped"
+    assert np.array_equal(audio, sf.read(cached_file, dtype='float32')[0]), "Problem AudioCache, load"
+
+    # Modified source files are decoded again
+    sf.write(files[0], np.zeros(16000), 16000)
+    os.utime(cached_file, ns=(os.stat(cached_file).st_atime_ns, os.stat(files[0]).st_mtime_ns - 10 ** 9))
+    assert not cache.load(files[0], 8000).any(), "Problem AudioCache, modified file not decoded again"
+    # The last use is the mtime of the cached files, not their atime (not updated on relatime/noatime mounts)
+    used_file = cache.get_file(files[1], 8000)
+    os.utime(used_file, ns=(time.time_ns(), os.stat(files[1]).st_mtime_ns))
+    cache.get_file(files[1], 8000)
+    assert os.stat(used_file).st_mtime_ns > os.stat(files[1]).st_mtime_ns, "Problem AudioCache, last use not updated"
+
+    # The files just used are kept, a render may be about to read them
+    cache.get_file(files[1], 8000)
+    cache.get_file(files[0], 8000)
+    file_size = os.stat(cached_file).st_size
+    cache.max_size = 2.5 * file_size
+    cache.get_file(files[2], 8000)
+    assert all(osp.exists(cache.get_cached_path(f, 8000)) for f in files), "Problem AudioCache, recent file deleted"
+
+    # Least recently used files are deleted, until the cache is below max_size * (1 - margin)
+    cache = AudioCache(osp.join(folder, "cache"), max_size=2.5 * file_size, margin=0.3, min_age=0)
+    cache.get_file(files[1], 8000)
+    cache.get_file(files[0], 8000)
+    os.remove(cache.get_cached_path(files[2], 8000))
+    cache.get_file(files[2], 8000)
+    assert [osp.exists(cache.get_cached_path(f, 8000)) for f in files] == [False, False, True], \
+        "Problem AudioCache, least recently used files not deleted"
+    assert cache.size() <= 2.5 * file_size * 0.7, "Problem AudioCache, no margin after the eviction"
+    # The cache is not listed again before margin * max_size bytes are added
+    cache.get_file(files[0], 8000)
+    assert [osp.exists(cache.get_cached_path(f, 8000)) for f in files] == [True, False, True], \
+        "Problem AudioCache, evicted before reaching max_size"
+
+    # The most recently loaded files are kept in memory
+    cache = AudioCache(osp.join(folder, "cache"), max_memory=2.5 * 8000 * 4)
+    arrays = [cache.load(f, 8000) for f in files]
+    assert not isinstance(arrays[0], np.memmap) and cache.load(files[2], 8000) is arrays[2], \
+        "Problem AudioCache, not kept in memory"
+    assert cache.load(files[0], 8000) is not arrays[0], "Problem AudioCache, least recently used array not removed"
+
+
+def test_shards(folder):
+    """ The soundscapes of a sharded folder are processed as the ones of a flat folder """
+    if osp.exists(folder):
+        shutil.rmtree(folder)
+    flat_dir, sharded_dir = osp.join(folder, "flat"), osp.join(folder, "sharded")
+    shutil.copytree(osp.join("material", "post_processing"), flat_dir)
+    assert pack_folder(flat_dir, sharded_dir, shard_size=1) == 2, "Problem pack_folder"
+    assert len(glob.glob(osp.join(sharded_dir, "*.tar"))) == 2, "Problem pack_folder, one soundscape per shard"
+    assert [osp.basename(f) for f in list_files(sharded_dir, ".jams")] == ["5.jams", "7.jams"], "Problem list_files"
+    with open(osp.join(flat_dir, "7.wav"), "rb") as f, open_file(osp.join(sharded_dir, "7.wav")) as f_shard:
+        assert f.read() == f_shard.read(), "Problem open_file, random access in the shards"
+    assert get_length_sec(osp.join(sharded_dir, "5.wav")) == get_length_sec(osp.join(flat_dir, "5.wav"))
+
+    for dir in [flat_dir, sharded_dir]:
+        post_processing_annotations(dir, output_folder=dir + "_checked", output_csv=dir + ".csv")
+    df_flat, df_sharded = read_annotations(flat_dir + ".csv"), read_annotations(sharded_dir + ".csv")
+    df_flat["filename"] = df_flat["filename"].apply(osp.basename)
+    df_sharded["filename"] = df_sharded["filename"].apply(osp.basename)
+    df_flat = df_flat.sort_values(["filename", "onset"]).reset_index(drop=True)
+    assert df_flat.equals(df_sharded.sort_values(["filename", "onset"]).reset_index(drop=True)), \
+        "Problem post_processing_annotations, sharded folder"
+    for txt_file in glob.glob(osp.join(flat_dir + "_checked", "*.txt")):
+        with open(txt_file, "rb") as f:
+            with open_file(osp.join(sharded_dir + "_checked", osp.basename(txt_file))) as f_shard:
+                assert f.read() == f_shard.read(), "Problem post_processing_annotations, txt in the shards"
+
+    # A file written again is appended in a new shard, the last version is read
+    with ShardWriter(sharded_dir) as writer:
+        writer.write({"5.txt": b"0.0\t1.0\tCat\n"})
+    assert len(glob.glob(osp.join(sharded_dir, "*.tar"))) == 3, "Problem ShardWriter, append"
+    with open_file(osp.join(sharded_dir, "5.txt")) as f:
+        assert f.read() == b"0.0\t1.0\tCat\n", "Problem ShardWriter, last version"
+
+    for dir in [flat_dir, sharded_dir]:
+        rm_high_polyphony(dir, max_polyphony=2)
+    assert [osp.basename(f) for f in list_files(sharded_dir, "")] == sorted(os.listdir(flat_dir)), \
+        "Problem rm_high_polyphony, sharded folder"
+    remove_files([osp.join(sharded_dir, "5.txt")])
+    assert not file_exists(osp.join(sharded_dir, "5.txt")), "Problem remove_files"
+    assert "5.txt" not in ShardReader(sharded_dir), "Problem remove_files, index"
+
+
 if __name__ == '__main__':
+    test_random_state()
+    test_valid_audio(osp.join("generated", "valid_audio"))
+    test_soundbank_index(osp.join("generated", "soundbank"))
+    test_merge_events()
+    test_length_sec(osp.join("material", "post_processing"))
+    test_annotation_writer(osp.join("generated", "annotation_writer"))
+    test_audio_cache(osp.join("generated", "audio_cache"))
+    test_shards(osp.join("generated", "shards"))
     pol_dir = osp.join("generated", "polyphony")
     if osp.exists(pol_dir):
         shutil.rmtree(pol_dir)
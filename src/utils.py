@@ -14,6 +14,21 @@ import glob
 import soundfile as sf
 import pprint
 import pandas as pd
+import multiprocessing
+import warnings
+import tempfile
+import hashlib
+
+from soundbank import get_class_files
+from stems import get_events_folder, save_stems
+from reverb import get_ir, apply_reverb_batch
+from shards import is_sharded, open_file, file_exists, list_files, list_soundscape_files, remove_files, ShardWriter
+from encoding import find_audio_file, AUDIO_FORMATS
+from audio_cache import AudioCache
+from features import read_feature_params
+
+# Key of the sandbox of the scaper annotation in which the parameters not handled by scaper are saved
+SANDBOX_KEY = "desed_synthetic"
 
 
 def create_folder(folder, delete_if_exists=False):
@@ -31,24 +46,223 @@ def pprint(x):
     pp.pprint(x)
 
 
-def choose_class(class_params):
+def get_random_state(seed, index):
+    """ Get the random state of a single soundscape. It only depends on the base seed and the index of the soundscape,
+    so a soundscape is the same whatever the order (or the process) in which it is generated.
+
+    Args:
+        seed: int, base seed of the generation.
+        index: int, index of the soundscape.
+
+    Returns:
+        np.random.RandomState
+    """
+    return np.random.RandomState(np.random.MT19937(np.random.SeedSequence([seed, index])))
+
+
+def md5sum(filename, chunk_size=1 << 20):
+    """ Get the md5 checksum of a file, read by chunks
+    Args:
+        filename: str, path of the file (in a flat or a sharded folder, see shards.py).
+        chunk_size: int, number of bytes read at once.
+
+    Returns:
+        str, the md5 checksum (hexadecimal)
+    """
+    md5 = hashlib.md5()
+    with open_file(filename) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _apply_args(func_args):
+    func, args = func_args
+    return func(*args)
+
+
+def map_jobs(func, list_args, n_jobs=1, print_every=None, callback=None):
+    """ Apply func on each tuple of arguments of list_args, in a pool of n_jobs processes if n_jobs > 1.
+
+    Args:
+        func: function, a top-level function (it has to be picklable).
+        list_args: list of tuples, arguments given to func.
+        n_jobs: int, number of processes to use.
+        print_every: int, optional, print the progress every print_every calls done.
+        callback: function, optional, called in this process with the arguments and the result of each call as soon
+            as it is done, while the next calls are running (ex: encoding the files generated, see encoding.py).
+
+    Returns:
+        list, the results of func in the same order as list_args.
+    """
+    tasks = [(func, args) for args in list_args]
+    results = []
+    if n_jobs is None or n_jobs <= 1:
+        iterator = map(_apply_args, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(n_jobs)
+        iterator = pool.imap(_apply_args, tasks, chunksize=1)
+    try:
+        for args, res in zip(list_args, iterator):
+            results.append(res)
+            if callback is not None:
+                callback(args, res)
+            if print_every is not None and len(results) % print_every == 0:
+                print(f"{len(results)} / {len(tasks)} done")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return results
+
+
+def add_generation_args(parser, plan=False):
+    """ Add the arguments shared by the generate_* scripts (number, seed, jobs, rendering, cache, format, features
+    and resume of the run) to an argument parser.
+    Args:
+        parser: argparse.ArgumentParser, the parser of the script.
+        plan: bool, whether the script renders a plan (see plan.py), it also gets --pitch-step and --batch-size.
+
+    Returns:
+        argparse.ArgumentParser, the parser
+    """
+    parser.add_argument('--number', type=int, default=1000)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    if plan:
+        parser.add_argument('--pitch-step', type=float, default=None,
+                            help="Round the pitch shifts to a grid (semitones), so the shifted sources can be cached")
+    parser.add_argument('--fft-reverb', action="store_true", default=False,
+                        help="Apply the reverb with an impulse response (FFT convolution) instead of sox")
+    parser.add_argument('--ir-bank', type=str, default=None,
+                        help="Folder of impulse responses used with --fft-reverb (default: synthetic impulse response)")
+    parser.add_argument('--engine', type=str, default="scaper", choices=["scaper", "numpy"],
+                        help="Generate the audio with scaper (sox) or in python (see mixer.py)")
+    if plan:
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help="With --engine numpy, number of soundscapes generated in a single batch by each job")
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help="Folder of the cache of decoded source files, shared by the jobs (no cache if not given)")
+    parser.add_argument('--cache-size', type=float, default=20,
+                        help="Maximum size of the cache in GB, the least recently used files are deleted")
+    parser.add_argument('--audio-format', type=str, default="wav", choices=list(AUDIO_FORMATS),
+                        help="Format of the soundscapes, the compressed formats are encoded during the generation")
+    parser.add_argument('--encode-jobs', type=int, default=2,
+                        help="Number of threads encoding the soundscapes (with --audio-format flac or opus)")
+    parser.add_argument('--features', action="store_true", default=False,
+                        help="Compute the log-mel features of the soundscapes during the generation (see features.py)")
+    parser.add_argument('--feature-params', type=str, default=None,
+                        help="json file of the parameters of the features (default: features.FEATURE_PARAMS)")
+    parser.add_argument('--restart', action="store_true", default=False,
+                        help="Generate all the soundscapes again, instead of resuming the run of the output folder")
+    return parser
+
+
+def setup_generation(args, run_folder):
+    """ Set up a generation run from the arguments of add_generation_args: the seed (the one of the interrupted run
+    of run_folder if it is resumed, random if not given), the manifest of run_folder, the cache and the features.
+    The arguments are printed once completed.
+
+    Args:
+        args: argparse.Namespace, the arguments of the script (args.seed and args.fft_reverb are set).
+        run_folder: str, folder of the first soundscapes generated, the other subsets are derived from them.
+
+    Returns:
+        tuple, (manifest.RunManifest of run_folder, audio_cache.AudioCache or None, dict of the feature parameters
+        or None)
+    """
+    # Imported here, manifest depends on utils
+    from manifest import RunManifest, get_run_seed
+    if args.seed is None:
+        # An interrupted run is resumed with its seed (see manifest.py)
+        args.seed = None if args.restart else get_run_seed(run_folder)
+    if args.seed is None:
+        # Keep track of the seed used, so the generation can be reproduced
+        args.seed = np.random.randint(2 ** 31)
+    # An impulse response bank is only used by the FFT reverb
+    args.fft_reverb = args.fft_reverb or args.ir_bank is not None
+    pprint(vars(args))
+    cache = AudioCache(args.cache_dir, args.cache_size * 1e9) if args.cache_dir is not None else None
+    feature_params = read_feature_params(args.feature_params) if args.features else None
+    create_folder(run_folder)
+    manifest = RunManifest(run_folder, args.seed, restart=args.restart)
+    return manifest, cache, feature_params
+
+
+def is_valid_audio(audio_file, n_samples=None, sr=None):
+    """ Check if an audio file exists and can be read (useful to resume a generation that has been stopped)
+
+    Args:
+        audio_file: str, path of the audio file.
+        n_samples: int, optional, the number of samples (per channel) the file should have.
+        sr: int, optional, the sample rate of n_samples, if the file has been resampled (ex: Opus, see encoding.py).
+
+    Returns:
+        bool, True if the file is valid.
+    """
+    if not osp.isfile(audio_file):
+        return False
+    try:
+        info = sf.info(audio_file)
+    except RuntimeError:
+        return False
+    if n_samples is not None:
+        if sr is not None and info.samplerate != sr:
+            n_samples = int(round(n_samples * info.samplerate / sr))
+        return info.frames == n_samples
+    return info.frames > 0
+
+
+def choose_class(class_params, random_state=None):
+    if random_state is None:
+        random_state = np.random
     tmp = 0
     inter = []
     for i in range(len(class_params['event_prob'])):
         tmp += class_params['event_prob'][i]
         inter.append(tmp)
-    ind = np.random.uniform()*100
+    ind = random_state.uniform()*100
     return class_params['event_class'][np.argmax(np.asarray(inter)>ind)]
 
 
-def choose_file(class_path):
-    source_files = sorted(glob.glob(os.path.join(class_path, "*")))
-    source_files = [f for f in source_files if os.path.isfile(f)]
-    ind = np.random.randint(0, len(source_files))
-    return source_files[ind]
+def choose_file(class_path, random_state=None):
+    if random_state is None:
+        random_state = np.random
+    # The soundbank index is built once (and kept up to date on disk) instead of listing the folder at each call
+    source_files = get_class_files(class_path)['filename'].values
+    ind = random_state.randint(0, len(source_files))
+    return os.path.join(class_path, osp.basename(source_files[ind]))
 
 
-def add_event(sc, class_lbl, duration, fg_folder):
+def get_file_duration(filename):
+    """ Get the duration of a file of a soundbank, using the soundbank index (no need to read the file)
+    Args:
+        filename: str, path of a file in a soundbank (soundbank/label/filename)
+
+    Returns:
+        float, the duration of the file in seconds
+    """
+    df = get_class_files(osp.dirname(filename))
+    # The paths of the index are absolute (see soundbank.get_soundbank_index)
+    return df['duration'].values[df['filename'].values == osp.abspath(filename)][0]
+
+
+def quantize_pitch(pitch_shift, pitch_step):
+    """ Round pitch shifts to a grid, so the shifted sources can be cached (see audio_cache.AudioCache)
+    Args:
+        pitch_shift: float or np.array, the pitch shifts in semitones.
+        pitch_step: float, step of the grid in semitones.
+
+    Returns:
+        float or np.array, the quantized pitch shifts.
+    """
+    return np.round(np.round(np.asarray(pitch_shift) / pitch_step) * pitch_step, 6)
+
+
+def add_event(sc, class_lbl, duration, fg_folder, pitch_step=None):
+    # Use the random state of the scaper object, so the whole soundscape depends on a single random state
+    random_state = sc.random_state
     source_time_dist = 'const'
     source_time = 0.0
     event_duration_min = 0.25
@@ -65,8 +279,13 @@ def add_event(sc, class_lbl, duration, fg_folder):
     time_stretch_min = 1
     time_stretch_max = 1
 
-    chosen_file = choose_file(os.path.join(fg_folder, class_lbl))
-    file_duration = round(sf.info(chosen_file).duration, 6)  # round because Scaper uses sox with round 6 digits
+    pitch_shift = (pitch_dist, pitch_min, pitch_max)
+    if pitch_step is not None:
+        # Pitch shift on a grid (see quantize_pitch), the JAMS have to record it (see set_desed_sandbox)
+        pitch_shift = ('const', float(quantize_pitch(random_state.uniform(pitch_min, pitch_max), pitch_step)))
+
+    chosen_file = choose_file(os.path.join(fg_folder, class_lbl), random_state)
+    file_duration = round(get_file_duration(chosen_file), 6)  # round because Scaper uses sox with round 6 digits
     if "_nOn_nOff" in class_lbl:
         print('no onset/offset')
         sc.add_event(label=('const', class_lbl),
@@ -75,22 +294,22 @@ def add_event(sc, class_lbl, duration, fg_folder):
                      event_time=('const', 0),
                      event_duration=('const', duration),
                      snr=(snr_dist, snr_min, snr_max),
-                     pitch_shift=(pitch_dist, pitch_min, pitch_max),
+                     pitch_shift=pitch_shift,
                      time_stretch=(time_stretch_dist, time_stretch_min, time_stretch_max))
     elif "_nOn" in class_lbl:
         print('no onset')
-        source_start = np.random.uniform(0, file_duration - event_duration_min)
+        source_start = random_state.uniform(0, file_duration - event_duration_min)
         sc.add_event(label=('const', class_lbl),
                      source_file=('const', chosen_file),
                      source_time=('const', source_start),
                      event_time=('const', 0),
                      event_duration=('const', np.minimum(duration, file_duration - source_start)),
                      snr=(snr_dist, snr_min, snr_max),
-                     pitch_shift=(pitch_dist, pitch_min, pitch_max),
+                     pitch_shift=pitch_shift,
                      time_stretch=(time_stretch_dist, time_stretch_min, time_stretch_max))
     elif "_nOf" in class_lbl:
         print('no offset')
-        event_start = np.random.uniform(max(0, duration - file_duration), duration - event_duration_min)
+        event_start = random_state.uniform(max(0, duration - file_duration), duration - event_duration_min)
         event_length = duration - event_start
         sc.add_event(label=('const', class_lbl),
                      source_file=('const', chosen_file),
@@ -98,10 +317,10 @@ def add_event(sc, class_lbl, duration, fg_folder):
                      event_time=('const', event_start),
                      event_duration=('const', event_length),
                      snr=(snr_dist, snr_min, snr_max),
-                     pitch_shift=(pitch_dist, pitch_min, pitch_max),
+                     pitch_shift=pitch_shift,
                      time_stretch=(time_stretch_dist, time_stretch_min, time_stretch_max))
     else:
-        event_start = np.random.uniform(0, duration - event_duration_min)
+        event_start = random_state.uniform(0, duration - event_duration_min)
         event_length = min(file_duration, duration - event_start)
         sc.add_event(label=('const', class_lbl),
                      source_file=('const', chosen_file),
@@ -109,47 +328,394 @@ def add_event(sc, class_lbl, duration, fg_folder):
                      event_time=('const', event_start),
                      event_duration=('const', event_length),
                      snr=(snr_dist, snr_min, snr_max),
-                     pitch_shift=(pitch_dist, pitch_min, pitch_max),
+                     pitch_shift=pitch_shift,
                      time_stretch=(time_stretch_dist, time_stretch_min, time_stretch_max))
     return sc
 
 
-def rm_high_polyphony(folder, max_polyphony=3, save_csv_associated=None):
+class AnnotationWriter:
+    """ Write annotations block by block (one DataFrame per file), without keeping all of them in memory.
+    The output is a tab separated csv file (same format as pandas to_csv), or a parquet file with typed columns
+    if the name ends with .parquet (needs pyarrow).
+
+    Args:
+        output_file: str, path of the output file.
+        columns: dict, {column name: python type (str, float or int)}, the columns written.
+        float_format: str, format of the floats (rounding also applied in parquet files).
+        append: bool, whether to add the annotations to an existing file (a parquet file is read and written again).
+
+    Example:
+        with AnnotationWriter("out.tsv", {'filename': str, 'onset': float}) as writer:
+            writer.write(df)
+    """
+    def __init__(self, output_file, columns, float_format=None, append=False):
+        self.output_file = output_file
+        self.columns = columns
+        self.float_format = float_format
+        self.parquet = output_file.endswith(".parquet")
+        append = append and osp.exists(output_file) and osp.getsize(output_file) > 0
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pa_types = {str: pa.string(), float: pa.float64(), int: pa.int64()}
+            self.schema = pa.schema([(col, pa_types[col_type]) for col, col_type in columns.items()])
+            # Parquet files cannot be appended, the existing rows are written first in a new file
+            table = pq.read_table(output_file, schema=self.schema) if append else None
+            self.writer = pq.ParquetWriter(output_file, self.schema)
+            if table is not None:
+                self.writer.write_table(table)
+        else:
+            self.writer = open(output_file, "a" if append else "w")
+            if not append:
+                self.writer.write("\t".join(columns) + "\n")
+
+    def write(self, df):
+        df = df[list(self.columns)]
+        if self.parquet:
+            import pyarrow as pa
+            if self.float_format is not None:
+                n_decimals = int(self.float_format.strip("%.f"))
+                float_cols = [col for col, col_type in self.columns.items() if col_type is float]
+                df = df.round({col: n_decimals for col in float_cols})
+            self.writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        else:
+            df.to_csv(self.writer, header=False, index=False, sep="\t", float_format=self.float_format)
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_annotations(annotation_file):
+    """ Read annotations written by AnnotationWriter (tab separated csv or parquet file)
+    Args:
+        annotation_file: str, path of the file.
+
+    Returns:
+        pd.DataFrame, the annotations
+    """
+    if annotation_file.endswith(".parquet"):
+        return pd.read_parquet(annotation_file)
+    return pd.read_csv(annotation_file, sep="\t")
+
+
+def read_jams(jam_file):
+    """ Read a JAMS file as a dict, without building (and validating) the jams objects, much faster than jams.load
+    Args:
+        jam_file: str, path of the JAMS file (in a flat or a sharded folder, see shards.py).
+
+    Returns:
+        dict, the content of the JAMS file
+    """
+    with open_file(jam_file) as json_file:
+        return json.load(json_file)
+
+
+def write_jams(jam_dict, jam_file):
+    """ Write a JAMS file from a dict (read with read_jams), without validating it
+    Args:
+        jam_dict: dict, the content of the JAMS file.
+        jam_file: str, path of the JAMS file.
+
+    Returns:
+        None
+    """
+    with open(jam_file, "w") as json_file:
+        json.dump(jam_dict, json_file, indent=2)
+
+
+def get_scaper_annotation(jam_dict):
+    """ Get the scaper annotation of a JAMS dict (read with read_jams)
+    Args:
+        jam_dict: dict, the content of the JAMS file.
+
+    Returns:
+        dict, the annotation, with keys 'data' (the events) and 'sandbox' (['scaper'] contains the parameters)
+    """
+    for ann in jam_dict['annotations']:
+        if ann['namespace'] == 'scaper':
+            return ann
+    raise ValueError("JAMS file does not contain any annotation with namespace scaper")
+
+
+def get_jams_events(jam_dict):
+    """ Get the events of a JAMS dict (read with read_jams) in a DataFrame
+    Args:
+        jam_dict: dict, the content of the JAMS file.
+
+    Returns:
+        pd.DataFrame, one line per event, columns 'time', 'duration' and the scaper values ('label', 'source_file',
+        'source_time', 'event_time', 'event_duration', 'snr', 'role', 'pitch_shift', 'time_stretch')
+    """
+    data = get_scaper_annotation(jam_dict)['data']
+    df = pd.DataFrame([obs['value'] for obs in data])
+    df.insert(0, 'time', [obs['time'] for obs in data])
+    df.insert(1, 'duration', [obs['duration'] for obs in data])
+    return df
+
+
+def get_desed_sandbox(jam_dict):
+    """ Get the parameters of the generation not handled by scaper, saved in the sandbox of the scaper annotation
+    Args:
+        jam_dict: dict, the content of the JAMS file.
+
+    Returns:
+        dict, the parameters (empty if there is none), for example {'pitch_step': 0.25}
+    """
+    return get_scaper_annotation(jam_dict)['sandbox'].get(SANDBOX_KEY, {})
+
+
+def set_desed_sandbox(jam_file, **params):
+    """ Save parameters of the generation not handled by scaper in the sandbox of the scaper annotation
+    Args:
+        jam_file: str, path of the JAMS file (modified in place).
+        **params: the parameters to save, the parameters set to None are not saved.
+
+    Returns:
+        dict, all the parameters saved in the sandbox
+    """
+    params = {key: value for key, value in params.items() if value is not None}
+    jam_dict = read_jams(jam_file)
+    sandbox = get_scaper_annotation(jam_dict)['sandbox'].setdefault(SANDBOX_KEY, {})
+    if params:
+        sandbox.update(params)
+        write_jams(jam_dict, jam_file)
+    return sandbox
+
+
+def sort_jams_events(jam_dict):
+    """ Sort the events of a JAMS dict by time (after modifying their time), as the jams package does
+    Args:
+        jam_dict: dict, the content of the JAMS file.
+
+    Returns:
+        dict, the JAMS dict (modified in place)
+    """
+    ann = get_scaper_annotation(jam_dict)
+    ann['data'] = sorted(ann['data'], key=lambda obs: (obs['time'], obs['duration']))
+    return jam_dict
+
+
+def move_background_snr(jam_dict):
+    """ Move the background SNR of a JAMS into its ref_db: ref_db + snr, the foreground SNRs minus snr and the
+    background SNR 0. Scaper normalizes the backgrounds to ref_db whatever their snr, the JAMS modified gives the same
+    gains to all the events as the JAMS with a background SNR (the FBSNR variants, see generate_eval_FBSNR.py).
+    Args:
+        jam_dict: dict, the content of the JAMS file (modified in place).
+
+    Returns:
+        float, the background SNR moved (0 if the JAMS is not modified)
+    """
+    ann = get_scaper_annotation(jam_dict)
+    bg_snrs = {obs['value']['snr'] or 0 for obs in ann['data'] if obs['value']['role'] == 'background'}
+    if len(bg_snrs) > 1:
+        raise ValueError(f"The backgrounds have different SNRs {sorted(bg_snrs)}, scaper cannot generate them")
+    bg_snr = bg_snrs.pop() if bg_snrs else 0
+    if bg_snr != 0:
+        ann['sandbox']['scaper']['ref_db'] += bg_snr
+        for obs in ann['data']:
+            if obs['value']['role'] == 'background':
+                obs['value']['snr'] = 0
+            else:
+                obs['value']['snr'] -= bg_snr
+    return bg_snr
+
+
+def render_from_jams(jam_file, audio_file, fg_path=None, bg_path=None, jams_outfile=None, keep_stems=False,
+                     cache=None, engine="scaper"):
+    """ Generate the audio of a JAMS file with scaper (see scaper.generate_from_jams)
+    If the JAMS has reverb parameters in its sandbox (see set_desed_sandbox and reverb.get_reverb_params), scaper
+    generates the soundscape without reverb, and the reverb is a convolution with an impulse response instead of sox.
+    The backgrounds are normalized to ref_db + their snr with both engines (scaper alone ignores the snr of the
+    backgrounds, see move_background_snr).
+
+    Args:
+        jam_file: str, path of the JAMS file.
+        audio_file: str, path of the audio file to generate.
+        fg_path: str, optional, path of the foreground soundbank (if different from the one in the JAMS).
+        bg_path: str, optional, path of the background soundbank (if different from the one in the JAMS).
+        jams_outfile: str, optional, where to save the JAMS after the generation.
+        keep_stems: bool, whether to save the foreground and background stems (see stems.save_stems).
+        cache: audio_cache.AudioCache, optional, the source files are read from this cache of decoded files.
+            If the pitch shifts of the JAMS are quantized (pitch_step in the sandbox, see set_desed_sandbox),
+            the sources are also pitch shifted once in the cache instead of at each generation.
+            The JAMS saved still refer to the soundbank files and to the pitch shifts of the events.
+        engine: str, "scaper" to generate the audio with scaper (sox), "numpy" to generate it in python without
+            temporary files (see mixer.render_jams).
+
+    Returns:
+        None
+    """
+    if engine == "numpy":
+        # Imported here, mixer depends on utils
+        from mixer import render_jams
+        render_jams(jam_file, audio_file, fg_path, bg_path, jams_outfile, keep_stems=keep_stems, cache=cache)
+        return None
+    elif engine != "scaper":
+        raise ValueError(f"Unknown engine {engine}, choose between 'scaper' and 'numpy'")
+    jam_dict = read_jams(jam_file)
+    ann = get_scaper_annotation(jam_dict)
+    sandbox = ann['sandbox']['scaper']
+    sox_reverb = sandbox['reverb']
+    reverb_params = get_desed_sandbox(jam_dict).get('reverb')
+    originals = None
+    if cache is not None:
+        sr = sandbox.get('sr', 44100)
+        shift_sources = get_desed_sandbox(jam_dict).get('pitch_step') is not None
+        folders = {'foreground': fg_path, 'background': bg_path}
+        originals = []
+        for obs in ann['data']:
+            value = obs['value']
+            class_path = osp.dirname(value['source_file'])
+            folder = folders[value['role']] if folders[value['role']] is not None else osp.dirname(class_path)
+            source_file = osp.join(folder, osp.basename(class_path), osp.basename(value['source_file']))
+            originals.append((source_file, value['pitch_shift']))
+            pitch_shift = value['pitch_shift'] if shift_sources else None
+            value['source_file'] = cache.get_file(source_file, sr, pitch_shift)
+            if pitch_shift is not None:
+                value['pitch_shift'] = None
+        # Scaper only checks the soundbank folders, the source files are the ones of the cache
+        sandbox['fg_path'] = fg_path or sandbox['fg_path']
+        sandbox['bg_path'] = bg_path or sandbox['bg_path']
+        fg_path, bg_path = None, None
+    if reverb_params is not None:
+        sandbox['reverb'] = None
+    ref_db, snrs = sandbox['ref_db'], [obs['value']['snr'] for obs in ann['data']]
+    bg_snr = move_background_snr(jam_dict)
+
+    jams_to_render = jam_file
+    if originals is not None or reverb_params is not None or bg_snr != 0:
+        fd, jams_to_render = tempfile.mkstemp(suffix=".jams")
+        os.close(fd)
+        write_jams(jam_dict, jams_to_render)
+    with warnings.catch_warnings():
+        # The reverb is applied to the stems by save_stems
+        warnings.filterwarnings("ignore", message="Reverb is on and save_isolated_events is True")
+        scaper.generate_from_jams(jams_to_render, audio_file, fg_path=fg_path, bg_path=bg_path,
+                                  jams_outfile=jams_outfile if jams_to_render == jam_file else jams_to_render,
+                                  save_isolated_events=keep_stems, isolated_events_path=get_events_folder(audio_file))
+
+    ir = None
+    if reverb_params is not None:
+        audio, sr = sf.read(audio_file, dtype='float32')
+        ir = get_ir(reverb_params, sr)
+        sf.write(audio_file, np.clip(apply_reverb_batch(audio.T, ir).T, -1, 1), sr,
+                 subtype=sf.info(audio_file).subtype)
+    if keep_stems:
+        save_stems(audio_file, reverb=sox_reverb, ir=ir)
+
+    if jams_to_render != jam_file:
+        if jams_outfile is not None:
+            # The JAMS refer to the soundbank, the pitch shifts, the SNRs and the reverb, not to the cache and the
+            # render
+            jam_dict = read_jams(jams_to_render)
+            ann = get_scaper_annotation(jam_dict)
+            ann['sandbox']['scaper']['reverb'] = sox_reverb
+            ann['sandbox']['scaper']['ref_db'] = ref_db
+            for obs, snr in zip(ann['data'], snrs):
+                obs['value']['snr'] = snr
+            if originals is not None:
+                for obs, (source_file, pitch_shift) in zip(ann['data'], originals):
+                    obs['value']['source_file'] = source_file
+                    obs['value']['pitch_shift'] = pitch_shift
+            write_jams(jam_dict, jams_outfile)
+        os.remove(jams_to_render)
+
+
+def generate_max_polyphony(sc, audiofile, jamsfile, txtfile, max_polyphony=3, max_trials=100, reverb=0.1,
+                           keep_stems=False, cache=None, pitch_step=None, reverb_params=None, engine="scaper"):
+    """ Instantiate the soundscape of a scaper object until its polyphony is lower than max_polyphony,
+    and only then generate the audio (the audio of rejected soundscapes is never generated).
+
+    Args:
+        sc: scaper.Scaper, the scaper object with the events specified.
+        audiofile: str, path of the audio file to generate.
+        jamsfile: str, path of the JAMS file to generate.
+        txtfile: str, path of the txt file to generate.
+        max_polyphony: int, the soundscapes having a polyphony >= max_polyphony are instantiated again.
+        max_trials: int, maximum number of instantiations.
+        reverb: float, reverb applied to the soundscape (see scaper.Scaper.generate).
+        keep_stems: bool, whether to save the foreground and background stems (see stems.save_stems).
+        cache: audio_cache.AudioCache, optional, cache of the decoded source files (see render_from_jams).
+        pitch_step: float, optional, step of the grid of the pitch shifts of the events (see add_event),
+            saved in the JAMS.
+        reverb_params: dict, optional, reverb applied with an impulse response instead of sox,
+            saved in the JAMS (see reverb.get_reverb_params).
+        engine: str, "scaper" or "numpy", engine generating the audio (see render_from_jams).
+
+    Returns:
+        bool, True if the soundscape has been generated, False if no instantiation had a polyphony low enough.
+    """
+    for _ in range(max_trials):
+        sc.generate(audiofile, jamsfile,
+                    allow_repeated_label=True,
+                    allow_repeated_source=True,
+                    reverb=reverb,
+                    disable_sox_warnings=True,
+                    no_audio=True,
+                    txt_path=txtfile)
+        if get_scaper_annotation(read_jams(jamsfile))['sandbox']['scaper']['polyphony_max'] < max_polyphony:
+            set_desed_sandbox(jamsfile, pitch_step=pitch_step, reverb=reverb_params)
+            render_from_jams(jamsfile, audiofile, jams_outfile=jamsfile, keep_stems=keep_stems, cache=cache,
+                             engine=engine)
+            return True
+    os.remove(jamsfile)
+    os.remove(txtfile)
+    return False
+
+
+def _get_polyphony_sources(jam_file):
+    """ Get the maximum polyphony, the background and all the source files of a JAMS file """
+    ann = get_scaper_annotation(read_jams(jam_file))
+    fg = [osp.basename(line['value']['source_file']) for line in ann['data']]
+    bg = osp.basename(ann['data'][0]['value']['source_file'])
+    return ann['sandbox']['scaper']['polyphony_max'], bg, fg
+
+
+def rm_high_polyphony(folder, max_polyphony=3, save_csv_associated=None, n_jobs=1, list_jams=None):
     """ Remove the files having a too high polyphony in the deignated folder
 
     Args:
         folder: str, path to the folder containing scaper generated sounds (JAMS files) in which to remove the files.
+            It can be a sharded folder (see shards.py), the files are then removed from its index.
         max_polyphony: int, the maximum number of sounds that can be hear at the same time (polyphony).
-        save_csv_associated: str, optional, the path to generate the csv files of associated sounds.
+        save_csv_associated: str, optional, the path to generate the csv files of associated sounds
+            (a parquet file if it ends with .parquet).
+        n_jobs: int, number of processes used to read the JAMS files.
+        list_jams: list, optional, the JAMS files of the folder to check (all the JAMS files of the folder if None),
+            so the soundscapes can be checked as they are generated (see manifest.process_generated).
 
     Returns:
-        None
+        list, the JAMS files of the soundscapes removed
 
     """
     # Select training
+    if list_jams is None:
+        list_jams = list_files(folder, ".jams")
     i = 0
-    df = pd.DataFrame(columns=['scaper', 'bg', 'fg'])
     fnames_to_rmv = []
-    for f in sorted(glob.glob(osp.join(folder, "*.jams"))):
-        with open(f) as json_file:
-            param = json.load(json_file)
-            if param['annotations'][0]['sandbox']['scaper']['polyphony_max'] < max_polyphony:
-                fg = [osp.basename(line['value']['source_file']) for line in param['annotations'][0]['data']]
-                bg = osp.basename(param['annotations'][0]['data'][0]['value']['source_file'])
-                fname = osp.basename(f)
-                df_tmp = pd.DataFrame(np.array([[fname, bg, ",".join(fg)]]), columns=['scaper', 'bg', 'fg'])
-                df = df.append(df_tmp, ignore_index=True)
-                i += 1
-            else:
-                fnames_to_rmv.append(f)
+    writer = None
     if save_csv_associated is not None:
-        df.to_csv(save_csv_associated, sep="\t", index=False)
+        writer = AnnotationWriter(save_csv_associated, {'scaper': str, 'bg': str, 'fg': str})
+    for f, (polyphony, bg, fg) in zip(list_jams, map_jobs(_get_polyphony_sources, [(f,) for f in list_jams], n_jobs)):
+        if polyphony < max_polyphony:
+            if writer is not None:
+                writer.write(pd.DataFrame([[osp.basename(f), bg, ",".join(fg)]], columns=['scaper', 'bg', 'fg']))
+            i += 1
+        else:
+            fnames_to_rmv.append(f)
+    if writer is not None:
+        writer.close()
 
     print(f"{i} files with less than {max_polyphony} overlapping events. Deleting others...")
     for fname in fnames_to_rmv:
-        names = glob.glob(osp.splitext(fname)[0] + ".*")
-        for file in names:
-            os.remove(file)
+        remove_files(list_soundscape_files(fname))
+    return fnames_to_rmv
 
 
 def sanity_check(df, length_sec=None):
@@ -160,30 +726,158 @@ def sanity_check(df, length_sec=None):
     return df
 
 
-def get_data(txt_file, wav_file=None):
+def get_length_sec(wav_file=None, jams_file=None):
+    """ Get the length of a clip without reading its audio data.
+    The header of the audio file is used if it exists, otherwise the duration in the JAMS file.
+
+    Args:
+        wav_file: str, optional, path of the audio file, or of the wav file of a compressed file (see encoding.py).
+        jams_file: str, optional, path of the JAMS file generated by scaper.
+
+    Returns:
+        float, the length in seconds (None if no file exists)
+    """
     if wav_file is not None:
-        data, sr = sf.read(wav_file)
-        length_sec = data.shape[0] / sr
-    else:
-        length_sec = None
-    df = pd.read_csv(txt_file, sep='\t', names=["onset", "offset", "event_label"])
+        wav_file = find_audio_file(wav_file)
+    if wav_file is not None and file_exists(wav_file):
+        with open_file(wav_file) as f:
+            info = sf.info(f)
+        return info.frames / info.samplerate
+    if jams_file is not None and file_exists(jams_file):
+        return get_scaper_annotation(read_jams(jams_file))['sandbox']['scaper']['duration']
+    return None
+
+
+def get_data(txt_file, wav_file=None, jams_file=None, length_sec=None):
+    """ Get the annotations of a file and the length of the clip (used to clip the offsets)
+    Args:
+        txt_file: str, path of the annotation file (onset, offset, event_label tab separated)
+        wav_file: str, optional, path of the audio file (wav, or FLAC/Opus with the same name), only its header is read.
+        jams_file: str, optional, path of the JAMS file, used if the audio file does not exist.
+        length_sec: float, optional, fixed length of the clip, no file is read to get it.
+
+    Returns:
+        tuple, (pd.DataFrame of the annotations, length of the clip in seconds or None)
+    """
+    if length_sec is None:
+        length_sec = get_length_sec(wav_file, jams_file)
+    with open_file(txt_file) as f:
+        df = pd.read_csv(f, sep='\t', names=["onset", "offset", "event_label"])
     return df, length_sec
 
 
+def merge_events(onsets, offsets, labels, length_sec=None, min_dur_event=0.250, min_dur_inter=0.150):
+    """ Merge the events of the same class following the rules of post_processing_annotations.
+    Events are sorted by class and onset (all classes at once), then swept a single time.
+    - overlapping events of the same class are merged
+    - if silence < min_dur_inter between two consecutive events of the same class, they are merged
+    - if the onsets of two consecutive events are closer than min_dur_event + min_dur_inter, they are merged
+    - if event < min_dur_event, the event lasts min_dur_event (if it goes beyond length_sec, it is removed with
+    all the following events of the same class)
+
+    Args:
+        onsets: np.array, onsets of the events (sec), sorted.
+        offsets: np.array, offsets of the events (sec).
+        labels: np.array, class of the events.
+        length_sec: float, optional, length of the file (sec).
+        min_dur_event: float, optional in sec, minimum duration of an event
+        min_dur_inter: float, optional in sec, minimum duration between 2 events
+
+    Returns:
+        tuple, (np.array of bool, events to keep, np.array of the new offsets, int the number of fixes)
+    """
+    n_events = len(onsets)
+    codes = pd.factorize(np.asarray(labels))[0]
+    # Stable sort: the events of a class keep the order of the onsets given
+    order = np.lexsort((onsets, codes))
+    on = np.asarray(onsets, dtype=float)[order].tolist()
+    off = np.asarray(offsets, dtype=float)[order].tolist()
+    cls = codes[order].tolist()
+
+    keep = np.ones(n_events, dtype=bool)
+    new_off = list(off)
+    fix_count = 0
+    i = 0
+    while i < n_events:
+        ref_onset = on[i]
+        ref_offset = off[i]
+        if ref_offset - ref_onset < min_dur_event:
+            ref_offset = ref_onset + min_dur_event
+            # Too short event, and at the offset (onset sorted),
+            # so if it overlaps with others, they are also too short.
+            if length_sec is not None and ref_offset > length_sec:
+                j = i
+                while j < n_events and cls[j] == cls[i]:
+                    j += 1
+                keep[i:j] = False
+                fix_count += j - i
+                i = j
+                continue
+            new_off[i] = ref_offset
+        j = i + 1
+        while j < n_events and cls[j] == cls[i]:
+            if off[j] < ref_offset:
+                # Merging overlapping annotations
+                pass
+            elif on[j] - ref_offset < min_dur_inter or on[j] - ref_onset < min_dur_event + min_dur_inter:
+                # Merging consecutive annotations with a short pause or a short onset difference
+                ref_offset = off[j]
+                new_off[i] = ref_offset
+            else:
+                break
+            keep[j] = False
+            fix_count += 1
+            j += 1
+        i = j
+
+    # Back to the order of the events given
+    keep_ordered = np.empty(n_events, dtype=bool)
+    keep_ordered[order] = keep
+    offsets_ordered = np.empty(n_events)
+    offsets_ordered[order] = new_off
+    return keep_ordered, offsets_ordered, fix_count
+
+
+def post_process_events(df, length_sec=None, min_dur_event=0.250, min_dur_inter=0.150):
+    """ Clean the annotations of a single file (see post_processing_annotations for the rules)
+    Args:
+        df: pd.DataFrame, the annotations (onset, offset, event_label).
+        length_sec: float, optional, length of the file (sec), the offsets are clipped to it.
+        min_dur_event: float, optional in sec, minimum duration of an event
+        min_dur_inter: float, optional in sec, minimum duration between 2 events
+
+    Returns:
+        tuple, (pd.DataFrame of the annotations cleaned, sorted by onset, int the number of fixes)
+    """
+    df = sanity_check(df, length_sec)
+    df = df.sort_values('onset')
+    keep, offsets, n_fix = merge_events(df['onset'].values, df['offset'].values, df['event_label'].values,
+                                        length_sec, min_dur_event, min_dur_inter)
+    df['offset'] = offsets
+    df = df[keep]
+    return df.sort_values('onset'), n_fix
+
+
 def post_processing_annotations(dir, wavdir=None, output_folder=None, output_csv=None, min_dur_event=0.250,
-                                min_dur_inter=0.150):
+                                min_dur_inter=0.150, length_sec=None, list_txt=None, append=False):
     """ clean the .txt files of each file. It is the same processing as the real data
     - overlapping events of the same class are mixed
     - if silence < 150ms between two conscutive events of the same class, they are mixed
     - if event < 250ms, the event lasts 250ms
 
     Args:
-        dir: str, directory path where the XXX.txt files are.
+        dir: str, directory path where the XXX.txt files are. It can be a sharded folder (see shards.py).
         wavdir: str, directory path where the associated XXX.wav audio files are (associated with .txt files)
         output_folder: str, optional, folder in which to put the checked files
-        output_csv: str, optional, csv with all the annotations concatenated
+            (in shards appended to output_folder if dir is a sharded folder)
+        output_csv: str, optional, csv with all the annotations concatenated (a parquet file if it ends with .parquet)
         min_dur_event: float, optional in sec, minimum duration of an event
         min_dur_inter: float, optional in sec, minimum duration between 2 events
+        length_sec: float, optional in sec, fixed length of all the files (no file is read to get their length).
+            By default, the length is read in the header of the audio files, or in the JAMS files if no audio file.
+        list_txt: list, optional, the txt files of dir to process (all the txt files of dir if None),
+            so the annotations can be processed as the soundscapes are generated (see manifest.process_generated).
+        append: bool, whether to add the annotations to an existing output_csv.
 
     Returns:
         None
@@ -198,67 +892,34 @@ def post_processing_annotations(dir, wavdir=None, output_folder=None, output_csv
     if output_folder is not None:
         create_folder(output_folder)
 
+    writer = None
     if output_csv is not None:
-        df_single = pd.DataFrame()
-    for fn in glob.glob(osp.join(dir, '*.txt')):
-        print(fn)
-        df, length_sec = get_data(fn, osp.join(wavdir, osp.splitext(osp.basename(fn))[0] + '.wav'))
-        df = sanity_check(df, length_sec)
-        df = df.sort_values('onset')
-        for class_name in df['event_label'].unique():
-            print(class_name)
-            i = 0
-            while i is not None:
-                indexes = df[df['event_label'] == class_name].index
-                ref_onset = df.loc[indexes[i], 'onset']
-                ref_offset = df.loc[indexes[i], 'offset']
-                if ref_offset - ref_onset < min_dur_event:
-                    ref_offset = ref_onset + min_dur_event
-                    # Too short event, and at the offset (onset sorted),
-                    # so if it overlaps with others, they are also too short.
-                    if ref_offset > length_sec:
-                        df = df.drop(indexes[i:])
-                        fix_count += len(indexes[i:])
-                        break
-                    else:
-                        df.loc[indexes[i], 'offset'] = ref_onset + min_dur_event
-                j = i + 1
-                while j < len(indexes):
-                    if df.loc[indexes[j], 'offset'] < ref_offset:
-                        df = df.drop(indexes[j])
-                        print("Merging overlapping annotations")
-                        fix_count += 1
-                    elif df.loc[indexes[j], 'onset'] - ref_offset < min_dur_inter:
-                        df.loc[indexes[i], 'offset'] = df.loc[indexes[j], 'offset']
-                        ref_offset = df.loc[indexes[j], 'offset']
-                        df = df.drop(indexes[j])
-                        print("Merging consecutive annotation with pause" +
-                              "<150ms")
-                        fix_count += 1
-                    elif df.loc[indexes[j], 'onset'] - ref_onset < min_dur_event + min_dur_inter:
-                        df.loc[indexes[i], 'offset'] = df.loc[indexes[j], 'offset']
-                        ref_offset = df.loc[indexes[j], 'offset']
-                        df = df.drop(indexes[j])
-                        print("Merging consecutive annotations" +
-                              " with onset diff<400ms")
-                        fix_count += 1
-                    else:
-                        # Quitting the loop
-                        break
-                    j += 1
-                i += 1
-                if i >= len(df[df['event_label'] == class_name].index):
-                    i = None
-        df = df.sort_values('onset')
-        if output_folder is not None:
+        writer = AnnotationWriter(output_csv, {'filename': str, 'onset': float, 'offset': float, 'event_label': str},
+                                  float_format="%.3f", append=append)
+    # The annotations of a sharded folder are written in the shards of output_folder (appended if it is sharded)
+    txt_writer = ShardWriter(output_folder) if output_folder is not None and is_sharded(dir) else None
+    if list_txt is None:
+        list_txt = list_files(dir, '.txt') if is_sharded(dir) else glob.glob(osp.join(dir, '*.txt'))
+    for fn in list_txt:
+        base_name = osp.splitext(osp.basename(fn))[0]
+        df, file_length = get_data(fn, osp.join(wavdir, base_name + '.wav'), osp.join(dir, base_name + '.jams'),
+                                   length_sec)
+        df, n_fix = post_process_events(df, file_length, min_dur_event, min_dur_inter)
+        fix_count += n_fix
+        if txt_writer is not None:
+            txt_writer.write({os.path.basename(fn): df[['onset', 'offset', 'event_label']].to_csv(
+                header=False, index=False, sep="\t").encode()})
+        elif output_folder is not None:
             df[['onset', 'offset', 'event_label']].to_csv(osp.join(output_folder, os.path.basename(fn)),
                 header=False, index=False, sep="\t")
-        if output_csv is not None:
-            df['filename'] = osp.join(osp.splitext(fn)[0] + '.wav')
-            df_single = df_single.append(df[['filename', 'onset', 'offset', 'event_label']], ignore_index=True)
-
-    if output_csv:
-        df_single.to_csv(output_csv, index=False, sep="\t", float_format="%.3f")
+        if writer is not None:
+            df['filename'] = find_audio_file(osp.splitext(fn)[0] + '.wav')
+            writer.write(df)
+
+    if writer is not None:
+        writer.close()
+    if txt_writer is not None:
+        txt_writer.close()
 
     print(f"================\nFixed {fix_count} problems\n================")
 